@@ -1,8 +1,10 @@
 import os
+import tempfile
 from dataclasses import dataclass
+from functools import lru_cache
 
 
-@dataclass
+@dataclass(frozen=True)
 class Settings:
     database_url: str
     default_iva: float
@@ -11,9 +13,45 @@ class Settings:
     default_margin_multiplier: float  # legacy
     rounding_strategy: str  # legacy
     openai_api_key: str | None
+    # Price history retention (raw rows / daily rollups); monthly rollups are kept forever
+    price_history_raw_days: int = 180
+    price_history_daily_days: int = 730
+    # Cross-worker cache: Redis when REDIS_URL is set, otherwise a local SQLite file ("" disables it)
+    redis_url: str | None = None
+    shared_cache_path: str = ""
+    shared_cache_ttl: int = 600
+    # Popular-query warm-up after startup and imports (0 disables it)
+    warmup_top_n: int = 50
+    warmup_concurrency: int = 2
+    # "bulk" (preloaded lookups + batched writes), "row" (one ORM round trip per lookup)
+    # or "copy" (Postgres COPY into a staging table + set-based merges; "bulk" elsewhere)
+    import_mode: str = "bulk"
+    # Uploads are spooled to temp files; larger files reject the whole upload
+    max_upload_mb: int = 50
+    # Import jobs run in a thread pool of this size (keep 1 on SQLite: one writer at a time)
+    import_concurrency: int = 1
+    # Processes that parse and match spreadsheet sheets for an import (1 parses in the import thread).
+    # Each process that imports (web instances with the thread runner, workers) spawns its own pool
+    import_parse_workers: int = 1
+    # "thread" (the web process imports in its pool) or "queue" (the web only enqueues into
+    # import_jobs and `python -m app.worker` imports)
+    import_runner: str = "thread"
+    # Queued jobs: attempts before giving up, heartbeat period and how long a silent lease lasts
+    import_max_attempts: int = 3
+    import_heartbeat_seconds: int = 15
+    import_lease_seconds: int = 300
 
 
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
+    """Environment configuration, parsed once per process (see reload_settings)."""
     database_url = os.getenv("DATABASE_URL") or os.getenv("DB_URL")
     if not database_url:
         raise RuntimeError(
@@ -58,6 +96,26 @@ def get_settings() -> Settings:
     # OpenAI API key for OCR+LLM processing
     openai_api_key = os.getenv("OPENAI_API_KEY")
 
+    price_history_raw_days = _int_env("PRICE_HISTORY_RAW_DAYS", 180)
+    price_history_daily_days = _int_env("PRICE_HISTORY_DAILY_DAYS", 730)
+
+    redis_url = os.getenv("REDIS_URL") or None
+    shared_cache_path = os.getenv(
+        "SHARED_CACHE_PATH",
+        os.path.join(tempfile.gettempdir(), "argenfuego-shared-cache.sqlite3"),
+    )
+    shared_cache_ttl = _int_env("SHARED_CACHE_TTL", 600)
+    warmup_top_n = _int_env("WARMUP_TOP_N", 50)
+    warmup_concurrency = _int_env("WARMUP_CONCURRENCY", 2)
+    import_mode = os.getenv("IMPORT_MODE", "bulk").strip().lower()
+    max_upload_mb = _int_env("MAX_UPLOAD_MB", 50)
+    import_concurrency = _int_env("IMPORT_CONCURRENCY", 1)
+    import_parse_workers = _int_env("IMPORT_PARSE_WORKERS", 1)
+    import_runner = os.getenv("IMPORT_RUNNER", "thread").strip().lower()
+    import_max_attempts = _int_env("IMPORT_MAX_ATTEMPTS", 3)
+    import_heartbeat_seconds = _int_env("IMPORT_HEARTBEAT_SECONDS", 15)
+    import_lease_seconds = _int_env("IMPORT_LEASE_SECONDS", 300)
+
     return Settings(
         database_url=database_url,
         default_iva=default_iva,
@@ -66,5 +124,26 @@ def get_settings() -> Settings:
         default_margin_multiplier=default_margin,
         rounding_strategy=rounding_strategy,
         openai_api_key=openai_api_key,
+        price_history_raw_days=price_history_raw_days,
+        price_history_daily_days=price_history_daily_days,
+        redis_url=redis_url,
+        shared_cache_path=shared_cache_path,
+        shared_cache_ttl=shared_cache_ttl,
+        warmup_top_n=warmup_top_n,
+        warmup_concurrency=warmup_concurrency,
+        import_mode=import_mode,
+        max_upload_mb=max_upload_mb,
+        import_concurrency=import_concurrency,
+        import_parse_workers=import_parse_workers,
+        import_runner=import_runner,
+        import_max_attempts=import_max_attempts,
+        import_heartbeat_seconds=import_heartbeat_seconds,
+        import_lease_seconds=import_lease_seconds,
     )
 
+
+
+def reload_settings() -> Settings:
+    """Re-read the environment, e.g. after changing variables in tests or a shell."""
+    get_settings.cache_clear()
+    return get_settings()
@@ -1,8 +1,9 @@
 from contextlib import contextmanager
+import time
 from typing import Iterator
 
 from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
 
 from .config import get_settings
 
@@ -47,6 +48,48 @@ def get_session():
         session.close()
 
 
+class LazySession:
+    """
+    Stands in for a Session and only creates one (and checks out a connection) on first use,
+    so requests answered from caches never touch the pool. Read-only sessions never commit.
+    """
+
+    def __init__(self, read_only: bool = False) -> None:
+        self._session: Session | None = None
+        self.read_only = read_only
+
+    @property
+    def used(self) -> bool:
+        return self._session is not None
+
+    def _get(self) -> Session:
+        if self._session is None:
+            self._session = get_session_factory()()
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __contains__(self, instance) -> bool:
+        return instance in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def finish(self, success: bool = True) -> None:
+        """Commit (unless read-only or failed) and close the session, if one was ever created."""
+        session, self._session = self._session, None
+        if session is None:
+            return
+        try:
+            if success and not self.read_only:
+                session.commit()
+            else:
+                session.rollback()
+        finally:
+            session.close()
+
+
 def init_db(engine=None):
     from . import models  # noqa: F401 ensure models are imported
 
@@ -320,3 +363,232 @@ def migrate_add_canonical_keys():
             print("[DB] Canonical key columns are present on products and product_prices.")
     except Exception as e:
         print(f"[DB] Could not add canonical key columns: {e}")
+
+
+def ensure_catalog_state():
+    """Seed the single catalog_state row so generation bumps are a plain UPDATE."""
+    engine = get_engine()
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM catalog_state WHERE id = 1")).first()
+            if exists is None:
+                conn.execute(
+                    text(
+                        "INSERT INTO catalog_state (id, generation, settings_version, updated_at) "
+                        "VALUES (1, :g, 0, CURRENT_TIMESTAMP)"
+                    ),
+                    {"g": int(time.time())},
+                )
+                print("[DB] catalog_state initialized.")
+    except Exception as e:
+        # Another worker may have inserted it concurrently
+        print(f"[DB] Could not initialize catalog_state: {e}")
+
+
+def migrate_add_settings_version():
+    """Add catalog_state.settings_version (cached settings invalidation) if it doesn't exist."""
+    engine = get_engine()
+    url = str(engine.url)
+    try:
+        with engine.begin() as conn:
+            if url.startswith("postgresql+"):
+                conn.execute(text(
+                    """
+                    ALTER TABLE catalog_state
+                    ADD COLUMN IF NOT EXISTS settings_version INTEGER NOT NULL DEFAULT 0;
+                    """
+                ))
+            elif url.startswith("sqlite"):
+                existing_cols = conn.execute(text("PRAGMA table_info('catalog_state');")).fetchall()
+                if not any(col[1] == "settings_version" for col in existing_cols):
+                    conn.execute(text("ALTER TABLE catalog_state ADD COLUMN settings_version INTEGER NOT NULL DEFAULT 0;"))
+            print("[DB] catalog_state.settings_version is present.")
+    except Exception as e:
+        print(f"[DB] Could not add settings_version column: {e}")
+
+
+def migrate_unique_product_provider():
+    """Keep one product_prices row per (product_id, provider_name) and enforce it with a unique index."""
+    engine = get_engine()
+    # Every offer but the most recent one of each product and provider
+    duplicates = (
+        "SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+        " PARTITION BY product_id, provider_name ORDER BY updated_at DESC, id DESC) AS rn"
+        " FROM product_prices) ranked WHERE rn > 1"
+    )
+    try:
+        with engine.begin() as conn:
+            # Unstamped outbox rows: the next generation bump publishes the deletes
+            conn.execute(text(
+                "INSERT INTO catalog_changes (generation, entity, entity_id, canonical_key, op, created_at) "
+                f"SELECT NULL, 'price', id, canonical_key, 'delete', CURRENT_TIMESTAMP FROM product_prices WHERE id IN ({duplicates})"
+            ))
+            removed = conn.execute(text(f"DELETE FROM product_prices WHERE id IN ({duplicates})")).rowcount
+            if removed:
+                print(f"[DB] Removed {removed} duplicate product_prices rows.")
+            conn.execute(text("DROP INDEX IF EXISTS ix_product_prices_product_provider;"))
+            conn.execute(text(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_product_prices_product_provider
+                ON product_prices (product_id, provider_name);
+                """
+            ))
+            print("[DB] product_prices is unique per product and provider.")
+    except Exception as e:
+        print(f"[DB] Could not add unique product/provider index: {e}")
+
+
+def setup_import_staging():
+    """Create the UNLOGGED staging table the COPY import (IMPORT_MODE=copy) loads rows into, if Postgres."""
+    engine = get_engine()
+    url = str(engine.url)
+    if not url.startswith("postgresql+"):
+        return
+    try:
+        with engine.begin() as conn:
+            # Not crash-safe and never replicated: rows only live until their upload's merge commits
+            conn.execute(text(
+                """
+                CREATE UNLOGGED TABLE IF NOT EXISTS import_staging (
+                    upload_id INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    provider_product_name TEXT NOT NULL,
+                    sku TEXT,
+                    canonical_key TEXT,
+                    canonical_name TEXT,
+                    base_name TEXT NOT NULL,
+                    normalized_name TEXT NOT NULL,
+                    unit_price NUMERIC(14, 2) NOT NULL,
+                    currency TEXT NOT NULL,
+                    recorded_at TIMESTAMP NOT NULL,
+                    product_id INTEGER
+                );
+                """
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_import_staging_upload ON import_staging (upload_id, seq);"
+            ))
+    except Exception as e:
+        print(f"[DB] Could not create import_staging table: {e}")
+
+
+def migrate_add_upload_status():
+    """Add the import job columns (status, error, finished_at) to uploads if they don't exist."""
+    engine = get_engine()
+    url = str(engine.url)
+    columns = (
+        ("status", "VARCHAR(16) NOT NULL DEFAULT 'done'"),
+        ("error", "TEXT"),
+        ("finished_at", "TIMESTAMP"),
+    )
+    try:
+        with engine.begin() as conn:
+            if url.startswith("postgresql+"):
+                for name, ddl in columns:
+                    conn.execute(text(f"ALTER TABLE uploads ADD COLUMN IF NOT EXISTS {name} {ddl};"))
+            elif url.startswith("sqlite"):
+                existing_cols = {col[1] for col in conn.execute(text("PRAGMA table_info('uploads');")).fetchall()}
+                for name, ddl in columns:
+                    if name not in existing_cols:
+                        conn.execute(text(f"ALTER TABLE uploads ADD COLUMN {name} {ddl};"))
+            print("[DB] uploads has import job status columns.")
+    except Exception as e:
+        print(f"[DB] Could not add upload status columns: {e}")
+
+
+def migrate_add_upload_job_id():
+    """Add uploads.job_id (the queued ImportJob carrying the file) if it doesn't exist."""
+    engine = get_engine()
+    url = str(engine.url)
+    try:
+        with engine.begin() as conn:
+            if url.startswith("postgresql+"):
+                conn.execute(text("ALTER TABLE uploads ADD COLUMN IF NOT EXISTS job_id INTEGER;"))
+            elif url.startswith("sqlite"):
+                existing_cols = {col[1] for col in conn.execute(text("PRAGMA table_info('uploads');")).fetchall()}
+                if "job_id" not in existing_cols:
+                    conn.execute(text("ALTER TABLE uploads ADD COLUMN job_id INTEGER;"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_uploads_job_id ON uploads (job_id);"))
+            print("[DB] uploads has job_id column.")
+    except Exception as e:
+        print(f"[DB] Could not add uploads.job_id column: {e}")
+
+
+def migrate_add_content_hash():
+    """Add uploads.content_sha256 and import_jobs.force (re-import identical files) if they don't exist."""
+    engine = get_engine()
+    url = str(engine.url)
+    columns = (
+        ("uploads", "content_sha256", "VARCHAR(64)"),
+        ("import_jobs", "force", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    )
+    try:
+        with engine.begin() as conn:
+            if url.startswith("postgresql+"):
+                for table, name, ddl in columns:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {ddl};"))
+            elif url.startswith("sqlite"):
+                for table, name, ddl in columns:
+                    existing_cols = {col[1] for col in conn.execute(text(f"PRAGMA table_info('{table}');")).fetchall()}
+                    if name not in existing_cols:
+                        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl};"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_uploads_content_sha256 ON uploads (content_sha256);"))
+            print("[DB] uploads has content_sha256 column.")
+    except Exception as e:
+        print(f"[DB] Could not add content hash columns: {e}")
+
+
+def migrate_add_upload_diff_counts():
+    """Add the import diff counts (rows_added, rows_changed, rows_removed) to uploads if they don't exist."""
+    engine = get_engine()
+    url = str(engine.url)
+    columns = ("rows_added", "rows_changed", "rows_removed")
+    try:
+        with engine.begin() as conn:
+            if url.startswith("postgresql+"):
+                for name in columns:
+                    conn.execute(text(f"ALTER TABLE uploads ADD COLUMN IF NOT EXISTS {name} INTEGER;"))
+            elif url.startswith("sqlite"):
+                existing_cols = {col[1] for col in conn.execute(text("PRAGMA table_info('uploads');")).fetchall()}
+                for name in columns:
+                    if name not in existing_cols:
+                        conn.execute(text(f"ALTER TABLE uploads ADD COLUMN {name} INTEGER;"))
+            print("[DB] uploads has diff count columns.")
+    except Exception as e:
+        print(f"[DB] Could not add upload diff count columns: {e}")
+
+
+def prepare_database():
+    """
+    Create the tables and run every migration, in order. Shared by the web process and
+    `python -m app.worker`, so either one can start first against an existing database.
+    """
+    # Initialize DB and create tables
+    init_db(get_engine())
+    # Migrate settings table to add new pricing columns
+    migrate_settings_table()
+    # Migrate existing products to ProductPrice model
+    migrate_to_product_prices()
+    # Add display_name column to products table
+    migrate_add_display_name()
+    # Ensure price table stores proveedor descriptions
+    migrate_add_provider_product_name()
+    # Ensure canonical grouping key columns exist
+    migrate_add_canonical_keys()
+    # Catalog generation and settings version used to invalidate caches
+    migrate_add_settings_version()
+    # Import job status on uploads
+    migrate_add_upload_status()
+    migrate_add_upload_job_id()
+    # Content hash of each upload (identical resends are skipped)
+    migrate_add_content_hash()
+    # Added/changed/removed offers per import
+    migrate_add_upload_diff_counts()
+    ensure_catalog_state()
+    # One price per product and provider (the COPY import upserts on it)
+    migrate_unique_product_provider()
+    setup_import_staging()
+    # Optional: accelerate LIKE queries on Postgres
+    setup_trgm()
+    # Enable FTS index if possible
+    setup_fts()
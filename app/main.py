@@ -1,32 +1,48 @@
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import csv
+import io
+import json
+import math
 import os
-from typing import List, Optional
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
 
 from fastapi import FastAPI, Request, UploadFile, File, Form, Depends
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from .config import get_settings
-from .db import (
-    get_engine,
-    get_session,
-    init_db,
-    setup_trgm,
-    setup_fts,
-    migrate_settings_table,
-    migrate_to_product_prices,
-    migrate_add_display_name,
-    migrate_add_provider_product_name,
-    migrate_add_canonical_keys,
-)
+from .utils.formatting import format_ars
+from .utils.fragment_cache import FragmentCache
+from .utils.http_cache import CachedStaticFiles, fragment_etag, not_modified, with_etag
+from .db import LazySession, get_session, prepare_database
+from .services.app_settings import get_app_settings, save_app_settings
 from .services.catalog_normalizer import normalize_catalog
-from .models import Setting
-from .services.importer import import_excels
-from .services.search import search_products
-from .services.variant_resolver import collect_variant_offers
-from .services.suggest_cache import suggest_cache, cache_key
+from .services.catalog_state import bump_generation, current_generation
+from .services.change_feed import CHANGES_PAGE_SIZE, changes_since, record_change
+from .services.duplicate_finder import DEFAULT_THRESHOLD, find_duplicate_clusters, merge_duplicates
+from .services.import_jobs import enqueue_import, fail_interrupted_imports, shutdown_import_jobs
+from .services.import_progress import STAGE_LABELS, UploadStatus, get_progress
+from .services.importer import superseding_upload_id
+from .services.price_history import get_price_history, history_key, rollup_price_history
+from .services.price_matrix import PriceMatrix, build_price_matrix, matrix_rows
+from .services.basket import BasketLine, build_cost_matrix, optimize_basket, resolve_basket_lines
+from .services.quote_batch import QuoteFileError, parse_quote_file, parse_quote_text, resolve_quote_lines
+from .services.search_results import get_search_hits, price_search_hit
+from .services.query_stats import record_query, start_query_stats_flusher, stop_query_stats_flusher
+from .services.shared_cache import get_shared_cache
+from .services.single_flight import search_flight
+from .services.suggest_cache import cache_key, suggest_cache
+from .services.suggestions import get_suggestions
+from .services.upload_spool import UploadTooLarge
+from .services.warmup import schedule_warm_up
 
 
 app = FastAPI(title="ArgenFuego Quick Search")
@@ -36,54 +52,65 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
+# Keep compiled templates on disk so cold starts skip recompiling them
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "argenfuego-jinja"))
+try:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+except OSError as e:
+    print(f"[TEMPLATES] Bytecode cache disabled: {e}")
+fragment_cache = FragmentCache(templates.env)
 
 
 @app.on_event("startup")
 def on_startup() -> None:
-    # Initialize DB and create tables
-    init_db(get_engine())
-    # Migrate settings table to add new pricing columns
-    migrate_settings_table()
-    # Migrate existing products to ProductPrice model
-    migrate_to_product_prices()
-    # Add display_name column to products table
-    migrate_add_display_name()
-    # Ensure price table stores proveedor descriptions
-    migrate_add_provider_product_name()
-    # Ensure canonical grouping key columns exist
-    migrate_add_canonical_keys()
-    # Optional: accelerate LIKE queries on Postgres
-    setup_trgm()
-    # Enable FTS index if possible
-    setup_fts()
+    # Tables and migrations (the worker runs the same list)
+    prepare_database()
+    # Thread-runner imports died with the previous process; queued jobs are retried by the worker
+    if get_settings().import_runner == "thread":
+        fail_interrupted_imports()
     # Normalize catalog so synonyms point to unificados
     with get_session() as session:
         normalize_catalog(session)
+    # Pick the shared cache backend now: a REDIS_URL without the redis package stops the boot
+    get_shared_cache()
+    # Count queries in memory and persist them periodically; warm the popular ones
+    start_query_stats_flusher()
+    schedule_warm_up("startup")
 
 
-def get_db_session():
-    with get_session() as session:
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    stop_query_stats_flusher()
+    shutdown_import_jobs()
+
+
+@asynccontextmanager
+async def _lazy_session(read_only: bool):
+    # Async so a request that never queries skips the threadpool round trips of a sync dependency
+    session = LazySession(read_only=read_only)
+    try:
         yield session
+    except Exception:
+        if session.used:
+            await run_in_threadpool(session.finish, False)
+        raise
+    if session.used:
+        await run_in_threadpool(session.finish, True)
 
 
-def get_or_create_settings(session: Session) -> Setting:
-    settings = session.query(Setting).first()
-    if settings is None:
-        defaults = get_settings()
-        settings = Setting(
-            default_iva=defaults.default_iva,
-            default_iibb=defaults.default_iibb,
-            default_profit=defaults.default_profit,
-            default_margin_multiplier=defaults.default_margin_multiplier,
-            rounding_strategy=defaults.rounding_strategy,
-            updated_at=datetime.utcnow(),
-        )
-        session.add(settings)
-        session.commit()
-        session.refresh(settings)
-    return settings
+async def get_db_session():
+    """Session checked out on first use and committed after the endpoint returns."""
+    async with _lazy_session(read_only=False) as session:
+        yield session
+
+
+async def get_read_db_session():
+    """Like get_db_session, for endpoints that only read: never commits."""
+    async with _lazy_session(read_only=True) as session:
+        yield session
 
 
 @app.get("/debug/static")
@@ -102,9 +129,38 @@ def debug_static():
     }
 
 
+@app.get("/debug/cache")
+def debug_cache():
+    """Hit/miss/eviction counters of the in-process caches"""
+    return {
+        "generation": current_generation(),
+        "shared_backend": get_shared_cache().backend,
+        "suggest": suggest_cache.stats(),
+        "single_flight": search_flight.stats(),
+        "fragments": fragment_cache.stats(),
+    }
+
+
+@app.get("/changes")
+def catalog_changes(
+    since: int = 0,
+    after_id: int = 0,
+    limit: int = CHANGES_PAGE_SIZE,
+    db: Session = Depends(get_read_db_session),
+):
+    """Change feed after the (since, after_id) cursor; pass the last row's generation/id to continue."""
+    limit = max(1, min(limit, CHANGES_PAGE_SIZE))
+    changes = changes_since(db, since, after_id, limit)
+    return {
+        "generation": current_generation(),
+        "changes": [change.as_dict() for change in changes],
+        "more": len(changes) == limit,
+    }
+
+
 @app.get("/", response_class=HTMLResponse)
-def index(request: Request, db: Session = Depends(get_db_session)):
-    settings = get_or_create_settings(db)
+def index(request: Request):
+    settings = get_app_settings()
     return templates.TemplateResponse(
         "index.html",
         {
@@ -116,48 +172,362 @@ def index(request: Request, db: Session = Depends(get_db_session)):
 
 
 @app.get("/uploads", response_class=HTMLResponse)
-def uploads_page(request: Request, db: Session = Depends(get_db_session)):
+def uploads_page(request: Request, db: Session = Depends(get_read_db_session)):
     # Lazy import to avoid circulars
     from .models import Upload
 
     uploads = db.query(Upload).order_by(Upload.uploaded_at.desc()).limit(50).all()
     return templates.TemplateResponse(
         "uploads.html",
-        {"request": request, "uploads": uploads},
+        {"request": request, "uploads": uploads, "stage_labels": STAGE_LABELS},
     )
 
 
 @app.post("/upload")
-async def upload(request: Request, files: List[UploadFile] = File(...), db: Session = Depends(get_db_session)):
-    await import_excels(files, db)
+async def upload(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    force: bool = Form(False),
+    db: Session = Depends(get_db_session),
+):
+    # Only spools and queues: parsing, writes and normalize_catalog run in the import pool (or the worker).
+    # Files identical to their provider's last upload are skipped unless `force` is checked
+    try:
+        uploads = await enqueue_import(files, db, force=force)
+    except UploadTooLarge as e:
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=413)
     # Check if request is from HTMX (for AJAX uploads)
     if request.headers.get("HX-Request"):
-        return {"status": "success", "message": "Files uploaded successfully"}
+        return templates.TemplateResponse(
+            "partials/upload_status.html",
+            {"request": request, "statuses": [UploadStatus.from_upload(u) for u in uploads]},
+        )
     # Fallback to redirect for non-HTMX requests
     return RedirectResponse(url="/uploads", status_code=303)
 
 
+@app.get("/uploads/{upload_id}/status", response_class=HTMLResponse)
+def upload_status(request: Request, upload_id: int, db: Session = Depends(get_read_db_session)):
+    """Progress fragment for an import; it keeps polling itself (htmx) until the upload finishes."""
+    from .models import Upload
+
+    # Live counts when this process runs the job; otherwise whatever the job last committed
+    status = get_progress(upload_id)
+    if status is None:
+        upload = db.get(Upload, upload_id)
+        if upload is None:
+            return HTMLResponse("", status_code=404)
+        status = UploadStatus.from_upload(upload)
+    return templates.TemplateResponse(
+        "partials/upload_status.html",
+        {"request": request, "statuses": [status]},
+    )
+
+
 @app.post("/uploads/{upload_id}/delete")
 def delete_upload(upload_id: int, db: Session = Depends(get_db_session)):
     # Lazy imports
-    from .models import Upload, ProductPrice
+    from .models import Upload, ProductPrice, PriceHistory
 
     upload = db.query(Upload).filter(Upload.id == upload_id).first()
     if upload is None:
         return RedirectResponse(url="/uploads", status_code=303)
 
+    # Offers the provider's latest diff import (or identical resend) listed again were not
+    # rewritten by it: they are still current, so they move to that upload instead of going away
+    later_id = superseding_upload_id(db, upload)
+    if later_id is not None:
+        db.query(ProductPrice).filter(ProductPrice.source_file_id == upload_id).update(
+            {ProductPrice.source_file_id: later_id}, synchronize_session=False
+        )
+
     # Remove related product prices (cascade will handle this if configured, but being explicit)
+    removed = db.query(ProductPrice.id, ProductPrice.canonical_key).filter(ProductPrice.source_file_id == upload_id).all()
+    for price_id, canonical_key in removed:
+        record_change(db, "price", price_id, "delete", canonical_key)
     db.query(ProductPrice).filter(ProductPrice.source_file_id == upload_id).delete(synchronize_session=False)
+    # A deleted upload was a mistake: drop its history points and rebuild the affected rollups
+    db.query(PriceHistory).filter(PriceHistory.upload_id == upload_id).delete(synchronize_session=False)
+    rollup_price_history(db, since=upload.uploaded_at)
     
     # Delete the upload record
     db.delete(upload)
+    bump_generation(db)
     db.commit()
     return RedirectResponse(url="/uploads", status_code=303)
 
 
+@app.get("/history")
+def price_history(
+    key: Optional[str] = None,
+    product_id: Optional[int] = None,
+    months: int = 6,
+    granularity: str = "auto",
+    db: Session = Depends(get_read_db_session),
+):
+    """Price series for a canonical key (or the key of `product_id`) over the last `months`."""
+    if key is None and product_id is not None:
+        from .models import Product
+
+        p = db.query(Product).filter(Product.id == product_id).first()
+        if p is not None:
+            key = history_key(p.canonical_key, p.normalized_name)
+    if not key:
+        return {"key": None, "granularity": granularity, "points": []}
+
+    if granularity not in ("auto", "raw", "day", "month"):
+        granularity = "auto"
+    since = datetime.utcnow() - timedelta(days=30 * max(months, 1))
+    points = get_price_history(db, key, since=since, granularity=granularity)
+    return {"key": key, "granularity": granularity, "points": points}
+
+
+MATRIX_PAGE_SIZE = 200
+
+
+def _matrix_csv(matrix: PriceMatrix) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["clave", "producto", *matrix.providers, "mejor_precio", "mejor_proveedor"])
+    for i, row in enumerate(matrix_rows(matrix), start=1):
+        writer.writerow([
+            row["key"],
+            row["name"],
+            *["" if cell is None else f"{cell['final_price']:.2f}" for cell in row["cells"]],
+            f"{row['best_price']:.2f}",
+            " / ".join(row["best_providers"]),
+        ])
+        if i % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def _matrix_json(matrix: PriceMatrix) -> Iterator[str]:
+    yield '{"providers": ' + json.dumps(matrix.providers, ensure_ascii=False) + ', "rows": ['
+    for i, row in enumerate(matrix_rows(matrix)):
+        payload = {
+            "key": row["key"],
+            "name": row["name"],
+            "best_price": row["best_price"],
+            "best_providers": row["best_providers"],
+            "prices": [None if cell is None else cell["final_price"] for cell in row["cells"]],
+        }
+        yield ("," if i else "") + json.dumps(payload, ensure_ascii=False)
+    yield "]}"
+
+
+@app.get("/matrix")
+def price_matrix(
+    request: Request,
+    format: str = "html",
+    q: Optional[str] = None,
+    iva: Optional[float] = None,
+    iibb: Optional[float] = None,
+    profit: Optional[float] = None,
+    page: int = 1,
+    db: Session = Depends(get_read_db_session),
+):
+    """Product × provider comparison grid with the cheapest provider per product highlighted."""
+    effective_iva = iva if iva is not None else 1.21
+    effective_iibb = iibb if iibb is not None else 1.025
+    effective_profit = profit if profit is not None else 1.0
+
+    matrix = build_price_matrix(
+        db,
+        iva=effective_iva,
+        iibb=effective_iibb,
+        profit=effective_profit,
+        query=q,
+    )
+
+    if format == "csv":
+        return StreamingResponse(
+            _matrix_csv(matrix),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="comparativa_precios.csv"'},
+        )
+    if format == "json":
+        return StreamingResponse(_matrix_json(matrix), media_type="application/json")
+
+    total_pages = max(1, math.ceil(len(matrix) / MATRIX_PAGE_SIZE))
+    page = min(max(page, 1), total_pages)
+    start = (page - 1) * MATRIX_PAGE_SIZE
+    return templates.TemplateResponse(
+        "matrix.html",
+        {
+            "request": request,
+            "providers": matrix.providers,
+            "rows": list(matrix_rows(matrix, start, start + MATRIX_PAGE_SIZE)),
+            "total": len(matrix),
+            "page": page,
+            "total_pages": total_pages,
+            "q": q or "",
+            "iva": effective_iva,
+            "iibb": effective_iibb,
+            "profit": effective_profit,
+        },
+    )
+
+
+class BasketLineIn(BaseModel):
+    quantity: float = 1.0
+    product_id: Optional[int] = None
+    query: Optional[str] = None
+
+
+class BasketRequest(BaseModel):
+    lines: List[BasketLineIn]
+    iva: float = 1.21
+    iibb: float = 1.025
+    profit: float = 1.0
+    max_providers: Optional[int] = None
+    # Minimum order per provider, compared against the final (with multipliers) subtotal
+    min_order: dict[str, float] = {}
+
+
+@app.post("/basket")
+def basket(payload: BasketRequest, db: Session = Depends(get_db_session)):
+    """Cheapest provider split for a multi-line quote, one result per assignment strategy."""
+    resolved = resolve_basket_lines(
+        db,
+        [BasketLine(quantity=line.quantity, product_id=line.product_id, query=line.query) for line in payload.lines],
+        iva=payload.iva,
+        iibb=payload.iibb,
+        profit=payload.profit,
+    )
+    providers, cost = build_cost_matrix(resolved)
+    min_order = None
+    if payload.min_order:
+        min_order = np.array([payload.min_order.get(name, 0.0) for name in providers])
+    results = optimize_basket(cost, max_providers=payload.max_providers, min_order=min_order)
+
+    lines_view = []
+    for item in resolved:
+        lines_view.append({
+            "quantity": item.line.quantity,
+            "query": item.line.query,
+            "product_id": item.product.id if item.product else None,
+            "product_name": (item.product.display_name or item.product.name) if item.product else None,
+            "offers": {offer.provider_name: offer.final_price for offer in item.offers},
+        })
+
+    strategies = []
+    for result in results:
+        strategies.append({
+            "strategy": result.strategy,
+            "total": result.total,
+            "optimal": result.optimal,
+            "providers_used": len(result.subtotals),
+            "subtotals": {providers[p]: subtotal for p, subtotal in result.subtotals.items()},
+            "assignment": [providers[p] if p >= 0 else None for p in result.assignment.tolist()],
+            "unassigned_lines": [i for i, p in enumerate(result.assignment.tolist()) if p < 0],
+            "dropped_providers": [providers[p] for p in result.dropped_providers],
+            "notes": result.notes,
+        })
+    return {"providers": providers, "lines": lines_view, "strategies": strategies}
+
+
+@app.post("/quote/batch")
+def quote_batch(
+    request: Request,
+    lines: str = Form(""),
+    file: Optional[UploadFile] = File(None),
+    iva: float = Form(1.21),
+    iibb: float = Form(1.025),
+    profit: float = Form(1.0),
+    format: str = Form("html"),
+    db: Session = Depends(get_db_session),
+):
+    """Resolve a whole customer request (pasted lines or a sheet) in one round trip."""
+    quote_lines = parse_quote_text(lines)
+    if file is not None and file.filename:
+        try:
+            quote_lines.extend(parse_quote_file(file.filename, file.file.read()))
+        except QuoteFileError as e:
+            return JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+
+    results = resolve_quote_lines(db, quote_lines, iva=iva, iibb=iibb, profit=profit)
+    grand_total = round(sum(r.line_total or 0.0 for r in results), 2)
+
+    if format == "json":
+        return {
+            "total": grand_total,
+            "lines": [
+                {
+                    "text": r.line.text,
+                    "quantity": r.line.quantity,
+                    "product_id": r.product.id if r.product else None,
+                    "product_name": (r.product.display_name or r.product.name) if r.product else None,
+                    "score": r.score,
+                    "best_provider": r.best_offer.provider_name if r.best_offer else None,
+                    "best_price": r.best_offer.final_price if r.best_offer else None,
+                    "line_total": r.line_total,
+                    "offers": {offer.provider_name: offer.final_price for offer in r.offers},
+                }
+                for r in results
+            ],
+        }
+
+    results_view = [
+        {
+            "line": r.line,
+            "quantity_fmt": f"{r.line.quantity:g}",
+            "product": r.product,
+            "offers": r.offers,
+            "best_offer": r.best_offer,
+            "line_total_fmt": format_ars(r.line_total) if r.line_total is not None else "-",
+        }
+        for r in results
+    ]
+    return templates.TemplateResponse(
+        "partials/quote_results.html",
+        {
+            "request": request,
+            "results": results_view,
+            "matched": sum(1 for r in results if r.product is not None),
+            "grand_total_fmt": format_ars(grand_total),
+        },
+    )
+
+
+@app.get("/duplicates")
+def duplicates_report(threshold: float = DEFAULT_THRESHOLD, db: Session = Depends(get_read_db_session)):
+    """Proposed merges of near-duplicate products, for review. Nothing is modified."""
+    clusters = find_duplicate_clusters(db, threshold=threshold)
+    return {"threshold": threshold, "clusters": [c.as_dict() for c in clusters]}
+
+
+@app.post("/duplicates/merge")
+def duplicates_merge(
+    keeper_ids: str = Form(""),
+    threshold: float = Form(DEFAULT_THRESHOLD),
+    merge_all: bool = Form(False, alias="all"),
+    db: Session = Depends(get_db_session),
+):
+    """
+    Apply the reviewed clusters (comma-separated keeper ids). Merging every proposed cluster
+    takes an explicit `all=true`: an empty selection is rejected, never read as "everything".
+    """
+    selected = {int(x) for x in keeper_ids.split(",") if x.strip().isdigit()}
+    if not selected and not merge_all:
+        return JSONResponse({"status": "error", "message": "No se indicó ningún keeper_ids válido"}, status_code=400)
+    clusters = find_duplicate_clusters(db, threshold=threshold)
+    if not merge_all:
+        clusters = [c for c in clusters if c.keeper.id in selected]
+    # Report before merging: the duplicates are gone afterwards
+    report = [c.as_dict() for c in clusters]
+    merge_duplicates(db, clusters)
+    bump_generation(db)
+    db.commit()
+    print(f"[DEDUP] merged {len(report)} clusters ({sum(len(c['duplicates']) for c in report)} products)")
+    return {"applied": report}
+
+
 @app.get("/settings", response_class=HTMLResponse)
-def settings_page(request: Request, db: Session = Depends(get_db_session)):
-    settings = get_or_create_settings(db)
+def settings_page(request: Request):
+    settings = get_app_settings()
     return templates.TemplateResponse(
         "settings.html",
         {
@@ -175,12 +545,7 @@ def update_settings(
     rounding_strategy: str = Form("none"),
     db: Session = Depends(get_db_session),
 ):
-    settings = get_or_create_settings(db)
-    settings.default_margin_multiplier = default_margin
-    settings.rounding_strategy = rounding_strategy
-    settings.updated_at = datetime.utcnow()
-    db.add(settings)
-    db.commit()
+    save_app_settings(db, default_margin=default_margin, rounding_strategy=rounding_strategy)
     return RedirectResponse(url="/settings", status_code=303)
 
 
@@ -195,93 +560,70 @@ def search(
     rounding: Optional[str] = None,  # legacy
     limit: Optional[str] = None,
     product_id: Optional[int] = None,
-    db: Session = Depends(get_db_session),
+    db: Session = Depends(get_read_db_session),
 ):
-    settings = get_or_create_settings(db)
-    
     # Parse new pricing parameters
     effective_iva = iva if iva is not None else 1.21
     effective_iibb = iibb if iibb is not None else 1.025
     effective_profit = profit if profit is not None else 1.0
 
-    if product_id is not None:
-        # Direct fetch by selected suggestion
-        from .models import Product
-        from sqlalchemy.orm import joinedload
-        p = db.query(Product).options(joinedload(Product.prices)).filter(Product.id == product_id).first()
-        if not p:
-            return templates.TemplateResponse(
-                "partials/results_table.html",
-                {"request": request, "results": [], "query": q or ""},
-            )
-
-        variant_result = collect_variant_offers(
-            session=db,
-            product=p,
-            iva=effective_iva,
-            iibb=effective_iibb,
-            profit=effective_profit,
-            query_text=q,
-        )
-
-        results_view = [{
-            "product": p,
-            "score": 100.0,
-            "prices": variant_result.offers,
-        }]
-        return templates.TemplateResponse(
-            "partials/results_table.html",
-            {"request": request, "results": results_view, "query": p.name},
-        )
-
-    if not q or not q.strip():
+    if product_id is None and (not q or not q.strip()):
         # Empty search → empty results fragment
         return templates.TemplateResponse(
             "partials/results_table.html",
             {"request": request, "results": [], "query": q or ""},
         )
+    if product_id is None:
+        record_query("search", q)
 
     try:
         effective_limit = int(limit) if limit not in (None, "") else 50
     except (TypeError, ValueError):
         effective_limit = 50
-    results = search_products(query=q, session=db, limit=effective_limit)
-
-    # Augment with final_price for rendering
-    results_view_map = {}
-    for p, score in results:
-        variant_result = collect_variant_offers(
-            session=db,
-            product=p,
-            iva=effective_iva,
-            iibb=effective_iibb,
-            profit=effective_profit,
-            query_text=q,
-        )
 
-        canonical_key = variant_result.canonical_key or p.canonical_key or f"product-{p.id}"
-        existing = results_view_map.get(canonical_key)
-        if existing is None or score > existing["score"]:
-            results_view_map[canonical_key] = {
-                "product": p,
-                "score": score,
-                "prices": variant_result.offers,
-            }
+    # Answer revalidations before doing any search work
+    generation = current_generation()
+    etag = fragment_etag(
+        "search", q, product_id, effective_limit, effective_iva, effective_iibb, effective_profit, generation
+    )
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
 
-    results_view = list(results_view_map.values())
-    results_view.sort(key=lambda entry: entry["score"], reverse=True)
+    # Hits and base prices are cached per query and catalog generation; only pricing runs per request,
+    # and only for cards that are not in the fragment cache yet
+    hits = get_search_hits(db, q, limit=effective_limit, product_id=product_id)
 
-    return templates.TemplateResponse(
+    query_label = q
+    if product_id is not None:
+        query_label = hits[0].product.name if hits else (q or "")
+    # Variants of products without a canonical key are found by searching the query itself
+    query_part = cache_key(q or "")
+    rows = [
+        fragment_cache.render(
+            "partials/result_card.html",
+            (
+                hit.key, hit.product.id, effective_iva, effective_iibb, effective_profit, generation,
+                None if hit.product.canonical_key else query_part,
+            ),
+            lambda hit=hit: {
+                "r": price_search_hit(hit, iva=effective_iva, iibb=effective_iibb, profit=effective_profit)
+            },
+        )
+        for hit in hits
+    ]
+    response = templates.TemplateResponse(
         "partials/results_table.html",
-        {"request": request, "results": results_view, "query": q},
+        {"request": request, "results": hits, "rows": rows, "query": query_label},
     )
+    return with_etag(response, etag)
 
 
 @app.get("/suggest", response_class=HTMLResponse)
 def suggest(
     request: Request,
     q: Optional[str] = None,
-    db: Session = Depends(get_db_session),
+    db: Session = Depends(get_read_db_session),
 ):
     if not q or not q.strip():
         return templates.TemplateResponse(
@@ -289,52 +631,20 @@ def suggest(
             {"request": request, "suggestions": []},
         )
 
-    key = cache_key(q)
-    if len(q.strip()) >= 2 and key in suggest_cache:
-        suggestions = suggest_cache[key]
-    else:
-        results = search_products(query=q, session=db, limit=20)  # Show top 20 with scroll
-        suggestions_map = {}
-        for p, _ in results:
-            variant_result = collect_variant_offers(
-                session=db,
-                product=p,
-                iva=1.0,
-                iibb=1.0,
-                profit=1.0,
-                query_text=None,
-                search_limit=25,
-            )
-            offers = variant_result.offers
-
-            if offers:
-                cheapest_offer = offers[0]
-                provider_count = len(offers)
-                price_label = cheapest_offer.unit_price_fmt
-                if provider_count > 1:
-                    price_label += f" ({provider_count} proveedores)"
-                currency = cheapest_offer.currency
-            else:
-                price_label = "Sin precio"
-                currency = p.prices[0].currency if p.prices else "ARS"
-            
-            canonical_key = variant_result.canonical_key or p.canonical_key or f"product-{p.id}"
-            if canonical_key in suggestions_map:
-                continue
-            suggestions_map[canonical_key] = {
-                "id": p.id,
-                "name": p.name,
-                "display_name": p.display_name if p.display_name else p.name,
-                "price_fmt": price_label,
-                "currency": currency,
-            }
-
-        suggestions = list(suggestions_map.values())
-        
-        # cache solo si hay resultados y hay al menos 2 caracteres
-        if len(q.strip()) >= 2 and suggestions:
-            suggest_cache[key] = suggestions
-    return templates.TemplateResponse(
+    record_query("suggest", q)
+    generation = current_generation()
+    etag = fragment_etag("suggest", q, generation)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
+    suggestions = get_suggestions(db, q)
+    rows = [
+        fragment_cache.render("partials/suggestion_item.html", (s.get("key"), s["id"], generation), lambda s=s: {"s": s})
+        for s in suggestions
+    ]
+    response = templates.TemplateResponse(
         "partials/suggestions.html",
-        {"request": request, "suggestions": suggestions, "query": q},
+        {"request": request, "suggestions": suggestions, "rows": rows, "query": q},
     )
+    return with_etag(response, etag)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, Numeric, String, Text, Index
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Integer, LargeBinary, Numeric, String, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -15,11 +15,62 @@ class Upload(Base):
     uploaded_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
     sheet_count: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
     processed_rows: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Import job state: queued | parsing | normalizing | done | failed (see import_progress)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="done")
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    # ImportJob that carries the file when imports run in the worker process (IMPORT_RUNNER=queue)
+    job_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+    # SHA-256 of the uploaded file: a provider's identical resend is not imported again
+    content_sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    # Diff against the provider's previous offers (NULL for row-mode, PDF and image imports)
+    rows_added: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    rows_changed: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    rows_removed: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     products: Mapped[list["Product"]] = relationship("Product", back_populates="upload")
     prices: Mapped[list["ProductPrice"]] = relationship("ProductPrice", back_populates="upload")
 
 
+class ImportJob(Base):
+    """Import queued for the worker process; claimed with a lease that its heartbeat keeps alive."""
+    __tablename__ = "import_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")  # queued | running | done | failed
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=3)
+    # Import even files identical to their provider's last upload
+    force: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    # Not claimable before this time (retry backoff)
+    available_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    worker_id: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_import_jobs_status_available", "status", "available_at"),
+    )
+
+
+class ImportJobChunk(Base):
+    """Uploaded file bytes in fixed-size pieces, so neither side holds a whole file in memory."""
+    __tablename__ = "import_job_chunks"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("import_jobs.id", ondelete="CASCADE"), nullable=False)
+    upload_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    seq: Mapped[int] = mapped_column(Integer, nullable=False)
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        Index("ix_import_job_chunks_job_upload_seq", "job_id", "upload_id", "seq"),
+    )
+
+
 class Product(Base):
     __tablename__ = "products"
 
@@ -66,7 +117,8 @@ class ProductPrice(Base):
     upload: Mapped["Upload"] = relationship("Upload", back_populates="prices")
 
     __table_args__ = (
-        Index("ix_product_prices_product_provider", "product_id", "provider_name"),
+        # One offer per provider and product; the COPY import upserts on it (ON CONFLICT)
+        Index("ux_product_prices_product_provider", "product_id", "provider_name", unique=True),
     )
 
 
@@ -82,3 +134,93 @@ class Setting(Base):
     default_margin_multiplier: Mapped[float] = mapped_column(Float, nullable=False, default=1.5)
     rounding_strategy: Mapped[str] = mapped_column(String(32), nullable=False, default="none")
     updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class PriceHistory(Base):
+    """Append-only log of a provider's prices: one row per imported row whose offer is new or changed price."""
+    __tablename__ = "price_history"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    recorded_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    # canonical_key when the dictionary matched, otherwise the product's normalized_name
+    canonical_key: Mapped[str] = mapped_column(String(128), nullable=False)
+    # No FKs on purpose: history must survive product merges and catalog cleanups
+    product_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    upload_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+    provider_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    unit_price: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False)
+    currency: Mapped[str] = mapped_column(String(8), nullable=False, default="ARS")
+
+    __table_args__ = (
+        # Rows arrive in time order, so a BRIN index stays tiny and prunes range scans well
+        Index("ix_price_history_recorded_at_brin", "recorded_at", postgresql_using="brin"),
+        Index("ix_price_history_key_recorded_at", "canonical_key", "recorded_at"),
+    )
+
+
+class PriceHistoryRollup(Base):
+    """Downsampled price history: min/max/last per canonical key, provider and day or month."""
+    __tablename__ = "price_history_rollups"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    granularity: Mapped[str] = mapped_column(String(8), nullable=False)  # "day" | "month"
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    canonical_key: Mapped[str] = mapped_column(String(128), nullable=False)
+    provider_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    min_price: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False)
+    max_price: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False)
+    last_price: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False)
+    last_seen_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    samples: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_price_history_rollups_key_bucket", "canonical_key", "granularity", "bucket_start"),
+        Index("ix_price_history_rollups_bucket", "granularity", "bucket_start"),
+    )
+
+
+class CatalogState(Base):
+    """Single row with the catalog generation; bumped on every catalog change to invalidate caches."""
+    __tablename__ = "catalog_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # Seeded from the clock so a recreated database never reuses generations still in the shared cache
+    generation: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    # Bumped by POST /settings so every worker reloads its cached settings
+    settings_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class QueryStat(Base):
+    """How often each normalized query was asked, per endpoint; written behind by query_stats."""
+    __tablename__ = "query_stats"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)  # "suggest" | "search"
+    query: Mapped[str] = mapped_column(String(255), nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_seen_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_query_stats_kind_query", "kind", "query", unique=True),
+        Index("ix_query_stats_kind_count", "kind", "count"),
+    )
+
+
+class CatalogChange(Base):
+    """Outbox of catalog changes; consumers replay the rows after the last generation they applied."""
+    __tablename__ = "catalog_changes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # NULL until the transaction that bumps the catalog generation stamps it
+    generation: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    entity: Mapped[str] = mapped_column(String(16), nullable=False)  # "product" | "price"
+    entity_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    canonical_key: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    op: Mapped[str] = mapped_column(String(8), nullable=False)  # "insert" | "update" | "delete"
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_catalog_changes_generation_id", "generation", "id"),
+        Index("ix_catalog_changes_created_at", "created_at"),
+    )
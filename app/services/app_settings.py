@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..db import get_session
+from ..models import Setting
+from .catalog_state import bump_settings_version, current_settings_version
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    """Detached copy of the settings row, safe to share between requests and threads."""
+    default_iva: float
+    default_iibb: float
+    default_profit: float
+    default_margin_multiplier: float
+    rounding_strategy: str
+
+
+_lock = threading.Lock()
+_cached: Optional[AppSettings] = None
+_cached_version: Optional[int] = None
+
+
+def get_or_create_settings(session: Session) -> Setting:
+    settings = session.query(Setting).first()
+    if settings is None:
+        defaults = get_settings()
+        settings = Setting(
+            default_iva=defaults.default_iva,
+            default_iibb=defaults.default_iibb,
+            default_profit=defaults.default_profit,
+            default_margin_multiplier=defaults.default_margin_multiplier,
+            rounding_strategy=defaults.rounding_strategy,
+            updated_at=datetime.utcnow(),
+        )
+        session.add(settings)
+        session.commit()
+        session.refresh(settings)
+    return settings
+
+
+def get_app_settings() -> AppSettings:
+    """Cached settings; reloaded only when the settings version in catalog_state changes."""
+    global _cached, _cached_version
+    version = current_settings_version()
+    with _lock:
+        if _cached is not None and _cached_version == version:
+            return _cached
+    with get_session() as session:
+        row = get_or_create_settings(session)
+        snapshot = AppSettings(
+            default_iva=row.default_iva,
+            default_iibb=row.default_iibb,
+            default_profit=row.default_profit,
+            default_margin_multiplier=row.default_margin_multiplier,
+            rounding_strategy=row.rounding_strategy,
+        )
+    with _lock:
+        _cached = snapshot
+        _cached_version = version
+    return snapshot
+
+
+def save_app_settings(session: Session, *, default_margin: float, rounding_strategy: str) -> None:
+    """Update the settings row and bump the version so every worker drops its cached copy."""
+    global _cached
+    settings = get_or_create_settings(session)
+    settings.default_margin_multiplier = default_margin
+    settings.rounding_strategy = rounding_strategy
+    settings.updated_at = datetime.utcnow()
+    session.add(settings)
+    bump_settings_version(session)
+    session.commit()
+    with _lock:
+        _cached = None
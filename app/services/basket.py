@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import Product
+from .search import search_products
+from .variant_resolver import ProviderOffer, collect_variant_offers
+
+
+# Exact search is only attempted on small baskets, and gives up after this many nodes
+EXACT_MAX_LINES = 12
+EXACT_NODE_LIMIT = 200_000
+
+
+@dataclass
+class BasketLine:
+    quantity: float
+    product_id: Optional[int] = None
+    query: Optional[str] = None
+
+
+@dataclass
+class ResolvedLine:
+    line: BasketLine
+    product: Optional[Product]
+    offers: List[ProviderOffer]
+
+
+@dataclass
+class BasketAssignment:
+    strategy: str
+    total: float
+    # provider index per line, -1 when the line is left unassigned
+    assignment: np.ndarray
+    subtotals: Dict[int, float]
+    optimal: bool = False
+    # providers removed by the greedy solver for not reaching their minimum order
+    dropped_providers: List[int] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+
+def resolve_basket_lines(
+    session: Session,
+    lines: Sequence[BasketLine],
+    *,
+    iva: float,
+    iibb: float,
+    profit: float,
+) -> List[ResolvedLine]:
+    """Find the product for each line and its per-provider offers via collect_variant_offers."""
+    resolved: List[ResolvedLine] = []
+    for line in lines:
+        product: Optional[Product] = None
+        if line.product_id is not None:
+            product = session.query(Product).filter(Product.id == line.product_id).first()
+        elif line.query and line.query.strip():
+            hits = search_products(query=line.query, session=session, limit=5)
+            if hits:
+                product = max(hits, key=lambda hit: hit[1])[0]
+        if product is None:
+            resolved.append(ResolvedLine(line=line, product=None, offers=[]))
+            continue
+        variant_result = collect_variant_offers(
+            session=session,
+            product=product,
+            iva=iva,
+            iibb=iibb,
+            profit=profit,
+            query_text=line.query,
+        )
+        resolved.append(ResolvedLine(line=line, product=product, offers=variant_result.offers))
+    return resolved
+
+
+def build_cost_matrix(resolved: Sequence[ResolvedLine]) -> tuple[List[str], np.ndarray]:
+    """Line × provider matrix of line totals (final price × quantity), inf where not offered."""
+    providers: Dict[str, int] = {}
+    for item in resolved:
+        for offer in item.offers:
+            providers.setdefault(offer.provider_name, len(providers))
+    cost = np.full((len(resolved), len(providers)), np.inf)
+    for i, item in enumerate(resolved):
+        quantity = max(float(item.line.quantity or 0), 0.0)
+        for offer in item.offers:
+            cost[i, providers[offer.provider_name]] = round(offer.final_price * quantity, 2)
+    return list(providers), cost
+
+
+def _assign(cost: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+    """Cheapest allowed provider per line (-1 if none of them offers it)."""
+    if cost.shape[1] == 0:
+        return np.full(cost.shape[0], -1, dtype=np.int64)
+    masked = np.where(allowed[None, :], cost, np.inf)
+    choice = np.argmin(masked, axis=1)
+    choice[~np.isfinite(masked[np.arange(cost.shape[0]), choice])] = -1
+    return choice
+
+
+def _summarize(strategy: str, cost: np.ndarray, assignment: np.ndarray, **kwargs) -> BasketAssignment:
+    assigned = assignment >= 0
+    line_costs = cost[np.flatnonzero(assigned), assignment[assigned]]
+    counts = np.bincount(assignment[assigned], minlength=cost.shape[1])
+    sums = np.bincount(assignment[assigned], weights=line_costs, minlength=cost.shape[1])
+    subtotals = {int(p): round(float(sums[p]), 2) for p in np.flatnonzero(counts)}
+    return BasketAssignment(
+        strategy=strategy,
+        total=round(float(line_costs.sum()), 2),
+        assignment=assignment,
+        subtotals=subtotals,
+        **kwargs,
+    )
+
+
+def solve_cheapest_per_line(cost: np.ndarray, constrained: bool = False) -> BasketAssignment:
+    """
+    Unconstrained optimum: every line goes to its cheapest provider. With a provider limit or
+    minimum orders in play it may break them, so it is only flagged optimal when `constrained` is False.
+    """
+    assignment = _assign(cost, np.ones(cost.shape[1], dtype=bool))
+    result = _summarize("cheapest_per_line", cost, assignment, optimal=not constrained)
+    if constrained:
+        result.notes.append("ignores max_providers and min_order")
+    return result
+
+
+def solve_single_provider(cost: np.ndarray, constrained: bool = False) -> BasketAssignment:
+    """
+    Whole basket from one provider: most lines covered, then lowest total. Like
+    solve_cheapest_per_line it ignores max_providers and min_order, so it is only flagged
+    optimal when `constrained` is False.
+    """
+    if cost.shape[1] == 0:
+        return _summarize("single_provider", cost, np.full(cost.shape[0], -1, dtype=np.int64))
+    finite = np.isfinite(cost)
+    covered = finite.sum(axis=0)
+    totals = np.where(finite, cost, 0.0).sum(axis=0)
+    best = int(np.lexsort((totals, -covered))[0])
+    allowed = np.zeros(cost.shape[1], dtype=bool)
+    allowed[best] = True
+    result = _summarize("single_provider", cost, _assign(cost, allowed), optimal=not constrained)
+    if constrained:
+        result.notes.append("ignores max_providers and min_order")
+    return result
+
+
+def _min_order_violations(result: BasketAssignment, min_order: np.ndarray) -> List[int]:
+    return [p for p, subtotal in result.subtotals.items() if subtotal < min_order[p] - 0.005]
+
+
+def solve_greedy(
+    cost: np.ndarray,
+    *,
+    max_providers: Optional[int] = None,
+    min_order: Optional[np.ndarray] = None,
+) -> BasketAssignment:
+    """
+    Add providers one at a time, each step taking the one that covers the most lines and then
+    lowers the total the most (evaluated for all candidates at once). Providers that end up
+    below their minimum order are dropped and their lines reassigned.
+    """
+    n_lines, n_providers = cost.shape
+    limit = n_providers if max_providers is None else max(0, min(max_providers, n_providers))
+    selected = np.zeros(n_providers, dtype=bool)
+    current = np.full(n_lines, np.inf)
+    dropped_providers: List[int] = []
+
+    while selected.sum() < limit:
+        candidate = np.minimum(current[:, None], cost)
+        finite = np.isfinite(candidate)
+        covered = finite.sum(axis=0)
+        totals = np.where(finite, candidate, 0.0).sum(axis=0)
+        covered[selected] = -1
+        best = int(np.lexsort((totals, -covered))[0])
+        current_covered = int(np.isfinite(current).sum())
+        current_total = float(np.where(np.isfinite(current), current, 0.0).sum())
+        if covered[best] < current_covered or (covered[best] == current_covered and totals[best] >= current_total - 0.005):
+            break
+        selected[best] = True
+        current = candidate[:, best]
+
+    result = _summarize("greedy", cost, _assign(cost, selected))
+    if min_order is not None:
+        while True:
+            violations = _min_order_violations(result, min_order)
+            if not violations:
+                break
+            dropped = min(violations, key=lambda p: result.subtotals[p] - min_order[p])
+            selected[dropped] = False
+            dropped_providers.append(dropped)
+            result = _summarize("greedy", cost, _assign(cost, selected))
+    result.dropped_providers = dropped_providers
+    return result
+
+
+def solve_exact(
+    cost: np.ndarray,
+    *,
+    max_providers: Optional[int] = None,
+    min_order: Optional[np.ndarray] = None,
+) -> Optional[BasketAssignment]:
+    """
+    Branch and bound over line assignments for small baskets. Covering a line always beats
+    leaving it unassigned; the result is flagged optimal unless the node budget ran out.
+    """
+    n_lines, n_providers = cost.shape
+    if n_lines > EXACT_MAX_LINES:
+        return None
+    limit = n_providers if max_providers is None else max(0, min(max_providers, n_providers))
+    minimums = min_order if min_order is not None else np.zeros(n_providers)
+
+    finite = np.isfinite(cost)
+    # Leaving a line unassigned costs more than any possible basket
+    penalty = float(np.where(finite, cost, 0.0).sum()) + 1.0
+    order = sorted(range(n_lines), key=lambda i: int(finite[i].sum()))
+    options = [[int(p) for p in np.argsort(cost[i]) if finite[i, p]] for i in order]
+    line_min = np.array([cost[i, opts[0]] if opts else penalty for i, opts in zip(order, options)])
+    remaining_min = np.concatenate([np.cumsum(line_min[::-1])[::-1], [0.0]])
+
+    best_value = np.inf
+    best_assignment: Optional[List[int]] = None
+    assignment = [-1] * n_lines
+    subtotals = np.zeros(n_providers)
+    used = np.zeros(n_providers, dtype=np.int64)
+    nodes = 0
+    exhausted = True
+
+    def search(depth: int, value: float, n_used: int) -> None:
+        nonlocal best_value, best_assignment, nodes, exhausted
+        nodes += 1
+        if nodes > EXACT_NODE_LIMIT:
+            exhausted = False
+            return
+        if value + remaining_min[depth] >= best_value - 1e-9:
+            return
+        if depth == n_lines:
+            if all(subtotals[p] >= minimums[p] - 0.005 for p in np.flatnonzero(used)):
+                best_value = value
+                best_assignment = assignment[:]
+            return
+        line = order[depth]
+        for p in options[depth]:
+            new_provider = used[p] == 0
+            if new_provider and n_used >= limit:
+                continue
+            used[p] += 1
+            subtotals[p] += cost[line, p]
+            assignment[line] = p
+            search(depth + 1, value + cost[line, p], n_used + (1 if new_provider else 0))
+            assignment[line] = -1
+            subtotals[p] -= cost[line, p]
+            used[p] -= 1
+            if nodes > EXACT_NODE_LIMIT:
+                return
+        search(depth + 1, value + penalty, n_used)
+
+    search(0, 0.0, 0)
+    if best_assignment is None:
+        return None
+    result = _summarize("exact", cost, np.array(best_assignment, dtype=np.int64), optimal=exhausted)
+    if not exhausted:
+        result.notes.append("node limit reached, best assignment found so far")
+    return result
+
+
+def optimize_basket(
+    cost: np.ndarray,
+    *,
+    max_providers: Optional[int] = None,
+    min_order: Optional[np.ndarray] = None,
+) -> List[BasketAssignment]:
+    """Run every strategy that applies to the basket and return their assignments."""
+    constrained = (max_providers is not None and max_providers < cost.shape[1]) or (
+        min_order is not None and bool((min_order > 0).any())
+    )
+    results = [
+        solve_cheapest_per_line(cost, constrained=constrained),
+        solve_single_provider(cost, constrained=constrained),
+        solve_greedy(cost, max_providers=max_providers, min_order=min_order),
+    ]
+    exact = solve_exact(cost, max_providers=max_providers, min_order=min_order)
+    if exact is not None:
+        results.append(exact)
+    return results
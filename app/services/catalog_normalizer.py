@@ -1,13 +1,15 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Set, Tuple
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session, selectinload
 
-from ..models import Product
+from ..models import Product, ProductPrice
 from ..utils.text import normalize_text
+from .catalog_state import bump_generation
+from .change_feed import has_pending_changes, record_change
 from .vendor_dictionary import find_product_match
 
 
@@ -17,6 +19,11 @@ def normalize_catalog(session: Session) -> None:
 
     products = session.query(Product).options(selectinload(Product.prices)).all()
     now = datetime.utcnow()
+    # (product_id, provider_name) is unique: track who holds each slot while prices move around
+    offers: Dict[Tuple[int, str], ProductPrice] = {
+        (price.product_id, price.provider_name): price for product in products for price in product.prices
+    }
+    removed: Set[int] = set()
 
     for product in products:
         # Keep normalized name in sync with latest normalization rules
@@ -25,9 +32,12 @@ def normalize_catalog(session: Session) -> None:
             product.normalized_name = desired_normalized
             product.updated_at = now
             session.add(product)
+            record_change(session, "product", product, "update")
 
         prices = list(product.prices)
         for price in prices:
+            if price.id in removed:
+                continue
             source_name = price.provider_product_name or product.name
             match = find_product_match(price.provider_name, source_name, product.sku)
             if not match:
@@ -59,7 +69,15 @@ def normalize_catalog(session: Session) -> None:
                     )
                     session.add(canonical_product)
                     session.flush()
+                    record_change(session, "product", canonical_product, "insert")
                 else:
+                    if (
+                        canonical_product.canonical_key != canonical_key
+                        or canonical_product.name != canonical_name
+                        or not canonical_product.display_name
+                        or (product.sku and not canonical_product.sku)
+                    ):
+                        record_change(session, "product", canonical_product, "update")
                     if canonical_product.canonical_key != canonical_key:
                         canonical_product.canonical_key = canonical_key
                     if canonical_product.name != canonical_name:
@@ -73,9 +91,33 @@ def normalize_catalog(session: Session) -> None:
 
             if canonical_product.canonical_key != canonical_key:
                 canonical_product.canonical_key = canonical_key
+                record_change(session, "product", canonical_product, "update")
+
+            if price.product_id != canonical_product.id:
+                existing = offers.get((canonical_product.id, price.provider_name))
+                if existing is not None:
+                    # Same provider already priced the canonical product: keep its latest quote
+                    # (updated_at is no good here, moving a price below bumps it)
+                    stale = price if (price.last_seen_at or now) <= (existing.last_seen_at or now) else existing
+                    record_change(session, "price", stale.id, "delete", stale.canonical_key)
+                    removed.add(stale.id)
+                    if stale is existing:
+                        del offers[(canonical_product.id, price.provider_name)]
+                    # delete-orphan removes it; deletes run after updates, so free the slot first
+                    stale.product.prices.remove(stale)
+                    session.flush()
+                    if stale is price:
+                        offers.pop((price.product_id, price.provider_name), None)
+                        continue
 
+            if price.product_id != canonical_product.id or price.canonical_key != canonical_key:
+                record_change(session, "price", price, "update", canonical_key)
             if price.product_id != canonical_product.id:
-                price.product_id = canonical_product.id
+                offers.pop((price.product_id, price.provider_name), None)
+                # Through the relationship, so the old product's collection no longer holds it
+                # and deleting that product as an orphan below does not cascade to this price
+                price.product = canonical_product
+                offers[(canonical_product.id, price.provider_name)] = price
             if price.canonical_key != canonical_key:
                 price.canonical_key = canonical_key
             price.updated_at = now
@@ -89,6 +131,11 @@ def normalize_catalog(session: Session) -> None:
     # Remove products that ended up without precios asociados
     orphan_products = session.query(Product).filter(~Product.prices.any()).all()
     for orphan in orphan_products:
+        record_change(session, "product", orphan.id, "delete", orphan.canonical_key)
         session.delete(orphan)
 
     session.flush()
+    # Runs after every import too, so this single bump covers run_import (its per-sheet commits
+    # left unstamped changes). A run that changed nothing, like most startups, keeps every cache
+    if has_pending_changes(session):
+        bump_generation(session)
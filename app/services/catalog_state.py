@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from ..db import get_engine
+from ..models import CatalogState
+from .change_feed import stamp_pending_changes
+
+
+# Readers may see a new generation up to this many seconds late; writers' own process sees it at once
+GENERATION_REFRESH_SECONDS = 2.0
+
+_lock = threading.Lock()
+_generation: int = 0
+_settings_version: int = 0
+_fetched_at: float = 0.0
+
+
+def _bump(session: Session, column) -> None:
+    now = datetime.utcnow()
+    updated = session.execute(
+        update(CatalogState)
+        .where(CatalogState.id == 1)
+        .values({column: column + 1, CatalogState.updated_at: now})
+    ).rowcount
+    if not updated:
+        session.add(CatalogState(id=1, generation=int(time.time()), settings_version=1, updated_at=now))
+        session.flush()
+    session.info["catalog_state_bumped"] = True
+
+
+def bump_generation(session: Session) -> None:
+    """Increment the catalog generation and stamp the pending change-feed rows with it."""
+    _bump(session, CatalogState.generation)
+    # The UPDATE holds the catalog_state row lock, so generations are stamped in commit order
+    generation = session.execute(select(CatalogState.generation).where(CatalogState.id == 1)).scalar_one()
+    stamp_pending_changes(session, int(generation))
+
+
+def bump_settings_version(session: Session) -> None:
+    """Tell every worker to reload the cached settings, inside the caller's transaction."""
+    _bump(session, CatalogState.settings_version)
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_after_bump(session: Session) -> None:
+    if session.info.pop("catalog_state_bumped", False):
+        invalidate_generation()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_bump(session: Session) -> None:
+    session.info.pop("catalog_state_bumped", None)
+
+
+def invalidate_generation() -> None:
+    global _fetched_at
+    with _lock:
+        _fetched_at = 0.0
+
+
+def _current_state() -> Tuple[int, int]:
+    """(generation, settings_version), re-read at most every GENERATION_REFRESH_SECONDS."""
+    global _generation, _settings_version, _fetched_at
+    now = time.monotonic()
+    with _lock:
+        if now - _fetched_at < GENERATION_REFRESH_SECONDS:
+            return _generation, _settings_version
+    try:
+        with get_engine().connect() as conn:
+            row = conn.execute(
+                select(CatalogState.generation, CatalogState.settings_version).where(CatalogState.id == 1)
+            ).first()
+    except Exception as e:
+        print(f"[CACHE] Could not read catalog generation: {e}")
+        return _generation, _settings_version
+    with _lock:
+        if row is not None:
+            _generation = int(row[0] or 0)
+            _settings_version = int(row[1] or 0)
+        _fetched_at = now
+        return _generation, _settings_version
+
+
+def current_generation() -> int:
+    """Catalog generation, re-read from the database at most every GENERATION_REFRESH_SECONDS."""
+    return _current_state()[0]
+
+
+def current_settings_version() -> int:
+    return _current_state()[1]
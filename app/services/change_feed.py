@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..models import CatalogChange
+
+
+CHANGES_PAGE_SIZE = 1000
+CHANGE_RETENTION_DAYS = 30
+
+_PENDING_KEY = "catalog_changes_pending"
+
+
+@dataclass(frozen=True)
+class ChangeRecord:
+    id: int
+    generation: int
+    entity: str
+    entity_id: int
+    canonical_key: Optional[str]
+    op: str
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "generation": self.generation,
+            "entity": self.entity,
+            "entity_id": self.entity_id,
+            "canonical_key": self.canonical_key,
+            "op": self.op,
+        }
+
+
+def record_change(session: Session, entity: str, target: Any, op: str, canonical_key: Optional[str] = None) -> None:
+    """
+    Buffer a change on the session; it is written on commit (or by bump_generation).
+    `target` is an ORM object or an id: new objects get their id resolved at write time.
+    """
+    session.info.setdefault(_PENDING_KEY, []).append((entity, target, op, canonical_key))
+
+
+def _compact(pending: List[Tuple[str, Any, str, Optional[str]]]) -> List[Dict[str, Any]]:
+    """One row per entity: insert+update stays an insert, insert+delete cancels out."""
+    rows: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for entity, target, op, canonical_key in pending:
+        entity_id = target if isinstance(target, int) else getattr(target, "id", None)
+        if entity_id is None:
+            continue
+        if canonical_key is None and not isinstance(target, int):
+            canonical_key = getattr(target, "canonical_key", None)
+        key = (entity, entity_id)
+        previous = rows.get(key)
+        if previous is not None:
+            if previous["op"] == "insert" and op == "delete":
+                del rows[key]
+                continue
+            if previous["op"] == "insert":
+                op = "insert"
+        rows[key] = {"entity": entity, "entity_id": entity_id, "canonical_key": canonical_key, "op": op}
+    return list(rows.values())
+
+
+def write_pending_changes(session: Session) -> int:
+    """Insert the buffered changes as unstamped (generation NULL) outbox rows."""
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return 0
+    if any(not isinstance(target, int) for _, target, _, _ in pending):
+        session.flush()  # Assigns ids to new objects
+    rows = _compact(pending)
+    if rows:
+        now = datetime.utcnow()
+        for row in rows:
+            row["created_at"] = now
+        session.execute(insert(CatalogChange), rows)
+    return len(rows)
+
+
+def has_pending_changes(session: Session) -> bool:
+    """Whether changes are waiting for a generation: buffered on the session or written unstamped."""
+    if session.info.get(_PENDING_KEY):
+        return True
+    return session.execute(
+        select(CatalogChange.id).where(CatalogChange.generation.is_(None)).limit(1)
+    ).first() is not None
+
+
+def stamp_pending_changes(session: Session, generation: int) -> None:
+    """Assign `generation` to every unstamped row; called with the catalog_state row locked."""
+    write_pending_changes(session)
+    session.execute(
+        update(CatalogChange).where(CatalogChange.generation.is_(None)).values(generation=generation)
+    )
+
+
+@event.listens_for(Session, "before_commit")
+def _write_before_commit(session: Session) -> None:
+    # Commits without a generation bump (e.g. per-sheet import commits) are stamped by the next bump
+    if session.info.get(_PENDING_KEY):
+        write_pending_changes(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def changes_since(
+    session: Session,
+    generation: int,
+    after_id: int = 0,
+    limit: int = CHANGES_PAGE_SIZE,
+) -> List[ChangeRecord]:
+    """Stamped changes after the (generation, id) cursor, oldest first."""
+    rows = session.execute(
+        select(CatalogChange)
+        .where(
+            CatalogChange.generation.is_not(None),
+            (CatalogChange.generation > generation)
+            | ((CatalogChange.generation == generation) & (CatalogChange.id > after_id)),
+        )
+        .order_by(CatalogChange.generation, CatalogChange.id)
+        .limit(limit)
+    ).scalars()
+    return [
+        ChangeRecord(
+            id=row.id,
+            generation=int(row.generation),
+            entity=row.entity,
+            entity_id=row.entity_id,
+            canonical_key=row.canonical_key,
+            op=row.op,
+        )
+        for row in rows
+    ]
+
+
+def prune_changes(session: Session, retention_days: int = CHANGE_RETENTION_DAYS) -> int:
+    """Drop stamped changes older than the retention; consumers further behind must rebuild."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    return session.execute(
+        delete(CatalogChange).where(CatalogChange.created_at < cutoff, CatalogChange.generation.is_not(None))
+    ).rowcount
+
+
+class ChangeFeedConsumer:
+    """
+    Cursor over the change feed for an in-process index or summary table: `poll` hands
+    every batch after the last applied (generation, id) to `apply` and advances the cursor.
+    """
+
+    def __init__(self, apply: Callable[[List[ChangeRecord]], None], generation: int = 0, after_id: int = 0) -> None:
+        self.apply = apply
+        self.generation = generation
+        self.after_id = after_id
+
+    def poll(self, session: Session, limit: int = CHANGES_PAGE_SIZE) -> int:
+        applied = 0
+        while True:
+            batch = changes_since(session, self.generation, self.after_id, limit)
+            if not batch:
+                return applied
+            self.apply(batch)
+            self.generation, self.after_id = batch[-1].generation, batch[-1].id
+            applied += len(batch)
+            if len(batch) < limit:
+                return applied
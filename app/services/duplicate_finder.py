@@ -0,0 +1,276 @@
+"""
+Near-duplicate products via MinHash + LSH, confirmed with RapidFuzz.
+
+Batch job:  python -m app.services.duplicate_finder [--apply] [--output report.json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz
+from sqlalchemy.orm import Session, selectinload
+
+from ..models import Product, ProductPrice
+from ..utils.text import normalize_text
+from .change_feed import record_change
+
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands × 4 rows: pairs above ~0.5 Jaccard become candidates
+MAX_BUCKET_SIZE = 50  # very common token sets would otherwise explode into quadratic pairs
+DEFAULT_THRESHOLD = 90.0
+_SIGNATURE_CHUNK = 5000
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, int(_MERSENNE_PRIME), size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, int(_MERSENNE_PRIME), size=NUM_PERM, dtype=np.uint64)
+
+_STOPWORDS = {"de", "la", "el", "y", "a", "en", "para", "por", "del", "al", "los", "las", "un", "una", "con", "sin", "tipo"}
+_SYNONYMS = {
+    "extintor": "matafuego",
+    "extintores": "matafuego",
+    "extinguidor": "matafuego",
+    "matafuegos": "matafuego",
+    "mang": "manguera",
+    "mangueras": "manguera",
+    "valv": "valvula",
+    "valvulas": "valvula",
+    "kgs": "kg",
+    "kilo": "kg",
+    "kilos": "kg",
+    "mts": "m",
+    "mt": "m",
+    "metro": "m",
+    "metros": "m",
+    "lts": "l",
+    "litro": "l",
+    "litros": "l",
+}
+_NUMBER_UNIT_RE = re.compile(r"^(\d+(?:\.\d+)?)([a-z]+)$")
+
+
+def canonical_tokens(name: str) -> List[str]:
+    """Token set used for similarity: synonyms unified and "5kg" split into "5" + "kg"."""
+    tokens: Set[str] = set()
+    for raw in normalize_text(name).split(" "):
+        if not raw or raw in _STOPWORDS:
+            continue
+        match = _NUMBER_UNIT_RE.match(raw)
+        parts = [match.group(1), match.group(2)] if match else [raw]
+        for part in parts:
+            tokens.add(_SYNONYMS.get(part, part))
+    return sorted(tokens)
+
+
+def minhash_signatures(token_sets: Sequence[Sequence[str]]) -> np.ndarray:
+    """(n, NUM_PERM) MinHash matrix, computed chunk by chunk to bound memory."""
+    signatures = np.full((len(token_sets), NUM_PERM), _MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, len(token_sets), _SIGNATURE_CHUNK):
+        chunk = token_sets[start:start + _SIGNATURE_CHUNK]
+        lengths = np.array([len(tokens) for tokens in chunk], dtype=np.int64)
+        non_empty = np.flatnonzero(lengths)
+        if not len(non_empty):
+            continue
+        hashes = np.fromiter(
+            (zlib.crc32(tok.encode("utf-8")) for tokens in chunk for tok in tokens),
+            dtype=np.uint64,
+            count=int(lengths.sum()),
+        )
+        # (a·x + b) mod p for every permutation and token, then min per product
+        permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])[non_empty]
+        signatures[start + non_empty] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
+
+
+def lsh_candidate_pairs(signatures: np.ndarray, bands: int = BANDS) -> Set[Tuple[int, int]]:
+    """Index pairs that share at least one identical band of their signatures."""
+    rows = signatures.shape[1] // bands
+    pairs: Set[Tuple[int, int]] = set()
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = defaultdict(list)
+        band_slice = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for idx in range(band_slice.shape[0]):
+            buckets[band_slice[idx].tobytes()].append(idx)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            members = members[:MAX_BUCKET_SIZE]
+            for i in range(len(members)):
+                for j in range(i + 1, len(members)):
+                    pairs.add((members[i], members[j]))
+    return pairs
+
+
+@dataclass
+class DuplicateCluster:
+    keeper: Product
+    duplicates: List[Product]
+    scores: Dict[int, float] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return {
+            "keeper": {"id": self.keeper.id, "name": self.keeper.name, "canonical_key": self.keeper.canonical_key},
+            "duplicates": [
+                {
+                    "id": p.id,
+                    "name": p.name,
+                    "score": round(self.scores.get(p.id, 0.0), 1),
+                    "providers": sorted({price.provider_name for price in p.prices}),
+                }
+                for p in self.duplicates
+            ],
+        }
+
+
+def _is_confirmed(tokens_a: List[str], tokens_b: List[str], threshold: float) -> Optional[float]:
+    # Sizes and capacities must match exactly: "5 kg" is never a duplicate of "10 kg"
+    if {t for t in tokens_a if t[0].isdigit()} != {t for t in tokens_b if t[0].isdigit()}:
+        return None
+    score = fuzz.token_set_ratio(" ".join(tokens_a), " ".join(tokens_b))
+    return score if score >= threshold else None
+
+
+def _choose_keeper(members: Iterable[Product]) -> Product:
+    return min(members, key=lambda p: (p.canonical_key is None, -len(p.prices), p.id))
+
+
+def find_duplicate_clusters(session: Session, threshold: float = DEFAULT_THRESHOLD) -> List[DuplicateCluster]:
+    """Propose clusters of near-duplicate products; nothing is modified."""
+    products = session.query(Product).options(selectinload(Product.prices)).order_by(Product.id.asc()).all()
+    token_sets = [canonical_tokens(p.name) for p in products]
+    signatures = minhash_signatures(token_sets)
+
+    parent = list(range(len(products)))
+    # Per cluster root: its providers and canonical key, so chaining A~B~C cannot join
+    # two listings of the same provider or two different canonical keys
+    cluster_providers = [{price.provider_name for price in p.prices} for p in products]
+    cluster_keys = [p.canonical_key for p in products]
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    scores: Dict[int, float] = {}
+    for i, j in sorted(lsh_candidate_pairs(signatures)):
+        score = _is_confirmed(token_sets[i], token_sets[j], threshold)
+        if score is None:
+            continue
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j:
+            continue
+        if cluster_providers[root_i] & cluster_providers[root_j]:
+            continue
+        if cluster_keys[root_i] and cluster_keys[root_j] and cluster_keys[root_i] != cluster_keys[root_j]:
+            continue
+        parent[root_i] = root_j
+        cluster_providers[root_j] |= cluster_providers[root_i]
+        cluster_keys[root_j] = cluster_keys[root_j] or cluster_keys[root_i]
+        scores[products[i].id] = max(scores.get(products[i].id, 0.0), score)
+        scores[products[j].id] = max(scores.get(products[j].id, 0.0), score)
+
+    groups: Dict[int, List[Product]] = defaultdict(list)
+    for idx, product in enumerate(products):
+        groups[find(idx)].append(product)
+
+    clusters: List[DuplicateCluster] = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        keeper = _choose_keeper(members)
+        clusters.append(DuplicateCluster(
+            keeper=keeper,
+            duplicates=[p for p in members if p.id != keeper.id],
+            scores=scores,
+        ))
+    clusters.sort(key=lambda c: c.keeper.name.lower())
+    return clusters
+
+
+def merge_cluster(session: Session, cluster: DuplicateCluster) -> None:
+    """Move every price of the duplicates onto the keeper and delete the duplicates."""
+    now = datetime.utcnow()
+    keeper = cluster.keeper
+    by_provider: Dict[str, ProductPrice] = {price.provider_name: price for price in keeper.prices}
+    for duplicate in cluster.duplicates:
+        for price in list(duplicate.prices):
+            existing = by_provider.get(price.provider_name)
+            if existing is not None:
+                # Keep the most recent offer of that provider
+                if (price.updated_at or now) <= (existing.updated_at or now):
+                    record_change(session, "price", price.id, "delete", price.canonical_key)
+                    session.delete(price)
+                    continue
+                record_change(session, "price", existing.id, "delete", existing.canonical_key)
+                session.delete(existing)
+            price.product = keeper
+            if keeper.canonical_key and not price.canonical_key:
+                price.canonical_key = keeper.canonical_key
+            price.updated_at = now
+            record_change(session, "price", price, "update")
+            by_provider[price.provider_name] = price
+        if duplicate.sku and not keeper.sku:
+            keeper.sku = duplicate.sku
+        session.flush()
+        session.expire(duplicate, ["prices"])
+        record_change(session, "product", duplicate.id, "delete", duplicate.canonical_key)
+        session.delete(duplicate)
+    keeper.updated_at = now
+    record_change(session, "product", keeper, "update")
+    session.flush()
+
+
+def merge_duplicates(
+    session: Session,
+    clusters: List[DuplicateCluster],
+    keeper_ids: Optional[Set[int]] = None,
+) -> List[DuplicateCluster]:
+    """Apply the proposed merges (only the reviewed `keeper_ids` when given)."""
+    applied: List[DuplicateCluster] = []
+    for cluster in clusters:
+        if keeper_ids is not None and cluster.keeper.id not in keeper_ids:
+            continue
+        merge_cluster(session, cluster)
+        applied.append(cluster)
+    return applied
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from ..db import get_session
+    from .catalog_state import bump_generation
+
+    parser = argparse.ArgumentParser(description="Find (and optionally merge) near-duplicate products.")
+    parser.add_argument("--apply", action="store_true", help="merge every proposed cluster")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    with get_session() as session:
+        clusters = find_duplicate_clusters(session, threshold=args.threshold)
+        report = {"applied": args.apply, "clusters": [c.as_dict() for c in clusters]}
+        if args.apply:
+            merge_duplicates(session, clusters)
+            bump_generation(session)
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(payload)
+    else:
+        print(payload)
+    print(f"[DEDUP] {len(clusters)} clusters {'merged' if args.apply else 'proposed'}")
+
+
+if __name__ == "__main__":
+    main()
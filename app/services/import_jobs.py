@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..db import get_session
+from ..models import Upload
+from .import_progress import FINISHED_STAGES, STAGE_QUEUED, report_progress
+from .importer import ImportAborted, ImportItem, fail_unfinished_uploads, run_import
+from .job_queue import claim_job, complete_job, enqueue_job, fail_job, heartbeat, restore_job_files
+from .parse_pool import shutdown_parse_pool
+from .upload_spool import SpooledUpload, spool_upload
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, get_settings().import_concurrency),
+                thread_name_prefix="import",
+            )
+        return _executor
+
+
+def _run_job(items: List[ImportItem]) -> None:
+    """Worker thread body: one session and one event loop for the job, temp files removed at the end."""
+    try:
+        with get_session() as session:
+            asyncio.run(run_import(items, session))
+    except Exception as e:
+        print(f"[import] job for uploads {[i.upload_id for i in items]} failed: {e}")
+        # No retries in-process: the uploads would otherwise stay in their last stage
+        with suppress(Exception), get_session() as session:
+            fail_unfinished_uploads(session, [i.upload_id for i in items], str(e) or type(e).__name__)
+    finally:
+        for item in items:
+            with suppress(OSError):
+                os.unlink(item.path)
+
+
+def _create_uploads(
+    session: Session, filenames: List[str], spooled: List[SpooledUpload], queued: bool, force: bool
+) -> List[Upload]:
+    """Create the queued Upload rows; when `queued`, the files go into an ImportJob in the same transaction."""
+    now = datetime.utcnow()
+    uploads = [
+        Upload(filename=name, uploaded_at=now, status=STAGE_QUEUED, content_sha256=s.sha256)
+        for name, s in zip(filenames, spooled)
+    ]
+    session.add_all(uploads)
+    if queued:
+        session.flush()
+        enqueue_job(session, uploads, [s.path for s in spooled], force=force)
+    session.commit()
+    for upload in uploads:
+        session.refresh(upload)
+    return uploads
+
+
+async def enqueue_import(files: List[UploadFile], session: Session, force: bool = False) -> List[Upload]:
+    """
+    Spool the files, create their Upload rows as queued and hand them to the import pool,
+    or with IMPORT_RUNNER=queue store them as an ImportJob for `python -m app.worker`.
+    Returns right away; the job reports its progress through import_progress and the rows.
+    `force` imports files even when they match their provider's last upload.
+    """
+    settings = get_settings()
+    max_bytes = settings.max_upload_mb * 1024 * 1024
+    queued = settings.import_runner == "queue"
+    spooled: List[SpooledUpload] = []
+    try:
+        # Spool everything to disk first: an oversized file rejects the upload before anything is queued
+        for f in files:
+            spooled.append(await spool_upload(f, max_bytes))
+        filenames = [f.filename or "archivo_desconocido" for f in files]
+        # The insert may wait on a running import's write lock: keep it off the event loop
+        uploads = await run_in_threadpool(_create_uploads, session, filenames, spooled, queued, force)
+    except BaseException:
+        for s in spooled:
+            with suppress(OSError):
+                os.unlink(s.path)
+        raise
+
+    if queued:
+        # The worker restores its own copy from import_job_chunks
+        for s in spooled:
+            with suppress(OSError):
+                os.unlink(s.path)
+        return uploads
+
+    items = [ImportItem(upload.id, upload.filename, s.path, force=force) for upload, s in zip(uploads, spooled)]
+    for item in items:
+        report_progress(item.upload_id, filename=item.filename, stage=STAGE_QUEUED)
+    _get_executor().submit(_run_job, items)
+    return uploads
+
+
+def fail_interrupted_imports() -> None:
+    """
+    Startup with IMPORT_RUNNER=thread: imports live only in this process's pool, so uploads a
+    restart, deploy or crash left unfinished can never resume. They are marked failed instead
+    of polling forever. Queued jobs (job_id set) are left to the worker, which retries them.
+    """
+    with get_session() as session:
+        upload_ids = session.execute(
+            select(Upload.id).where(
+                Upload.status.is_not(None),
+                Upload.status.not_in(FINISHED_STAGES),
+                Upload.job_id.is_(None),
+            )
+        ).scalars().all()
+        if upload_ids:
+            print(f"[import] marking {len(upload_ids)} interrupted uploads as failed: {upload_ids}")
+            fail_unfinished_uploads(session, upload_ids, "Importación interrumpida (el servidor se reinició)")
+
+
+def _keep_lease(job_id: int, worker_id: str, stop: threading.Event, lease_lost: threading.Event) -> None:
+    """
+    Heartbeat thread: renew the job's lease every IMPORT_HEARTBEAT_SECONDS until `stop` is set.
+    Sets `lease_lost` when another worker took the job over, or when no beat got through for a
+    whole IMPORT_LEASE_SECONDS (it may be reclaimed at any moment); the import stops at its next commit.
+    """
+    settings = get_settings()
+    interval = max(1, settings.import_heartbeat_seconds)
+    last_renewed = time.monotonic()
+    while not stop.wait(interval):
+        try:
+            with get_session() as session:
+                if not heartbeat(session, job_id, worker_id):
+                    print(f"[worker] lost the lease on import job {job_id}")
+                    lease_lost.set()
+                    return
+            last_renewed = time.monotonic()
+        except Exception as e:
+            # e.g. SQLite busy while the import holds the write lock; the next beat retries
+            print(f"[worker] heartbeat for import job {job_id} failed: {e}")
+            if time.monotonic() - last_renewed >= settings.import_lease_seconds:
+                print(f"[worker] lease on import job {job_id} expired without a heartbeat")
+                lease_lost.set()
+                return
+
+
+def run_next_job(worker_id: str) -> bool:
+    """
+    Claim one queued import job and run it in this process. Returns False when the queue
+    was empty. Errors that escape run_import (lost connections, a killed worker) are retried.
+    A job whose lease was lost is abandoned as is: the worker that reclaimed it finishes it.
+    """
+    with get_session() as session:
+        job = claim_job(session, worker_id)
+        if job is None:
+            return False
+        print(f"[worker] {worker_id} claimed import job {job.id} (attempt {job.attempts}/{job.max_attempts})")
+
+        stop = threading.Event()
+        lease_lost = threading.Event()
+        beat = threading.Thread(
+            target=_keep_lease,
+            args=(job.id, worker_id, stop, lease_lost),
+            name=f"import-job-{job.id}-heartbeat",
+            daemon=True,
+        )
+        beat.start()
+        directory = tempfile.mkdtemp(prefix=f"import-job-{job.id}-")
+        try:
+            items = restore_job_files(session, job, directory)
+            session.commit()
+            asyncio.run(run_import(items, session, lease_lost))
+        except ImportAborted as e:
+            session.rollback()
+            print(f"[worker] import job {job.id} abandoned: {e}")
+        except Exception as e:
+            session.rollback()
+            print(f"[worker] import job {job.id} failed: {e}")
+            if not fail_job(session, job, worker_id, str(e) or type(e).__name__):
+                print(f"[worker] import job {job.id} was reclaimed by another worker, leaving it to them")
+        else:
+            if not complete_job(session, job, worker_id):
+                print(f"[worker] import job {job.id} was reclaimed by another worker before it finished")
+        finally:
+            stop.set()
+            beat.join()
+            shutil.rmtree(directory, ignore_errors=True)
+    return True
+
+
+def shutdown_import_jobs() -> None:
+    """Stop accepting jobs; running imports are not interrupted, queued sheet parses are dropped."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+    shutdown_parse_pool()
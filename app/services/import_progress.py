@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+from ..models import Upload
+
+
+# Upload.status values, in pipeline order
+STAGE_QUEUED = "queued"
+STAGE_PARSING = "parsing"
+STAGE_NORMALIZING = "normalizing"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+# Same content as the provider's last import: nothing was parsed or written but last_seen_at
+STAGE_UNCHANGED = "unchanged"
+
+FINISHED_STAGES = (STAGE_DONE, STAGE_FAILED, STAGE_UNCHANGED)
+
+STAGE_LABELS = {
+    STAGE_QUEUED: "En cola",
+    STAGE_PARSING: "Procesando filas",
+    STAGE_NORMALIZING: "Unificando catálogo",
+    STAGE_DONE: "Completada",
+    STAGE_FAILED: "Error",
+    STAGE_UNCHANGED: "Sin cambios (ya importada)",
+}
+
+# Live row counts are published every this many rows; the DB copy is updated per sheet
+PROGRESS_EVERY_ROWS = 500
+
+
+@dataclass(frozen=True)
+class UploadStatus:
+    upload_id: int
+    filename: str
+    stage: str
+    rows: int = 0
+    error: Optional[str] = None
+    # Offers added / changed / removed, once a diffed import finished
+    added: Optional[int] = None
+    changed: Optional[int] = None
+    removed: Optional[int] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in FINISHED_STAGES
+
+    @property
+    def label(self) -> str:
+        return STAGE_LABELS.get(self.stage, self.stage)
+
+    @classmethod
+    def from_upload(cls, upload: Upload) -> "UploadStatus":
+        return cls(
+            upload_id=upload.id,
+            filename=upload.filename,
+            stage=upload.status or STAGE_DONE,
+            rows=upload.processed_rows or 0,
+            error=upload.error,
+            added=upload.rows_added,
+            changed=upload.rows_changed,
+            removed=upload.rows_removed,
+        )
+
+
+_lock = threading.Lock()
+_board: Dict[int, UploadStatus] = {}
+
+
+def report_progress(
+    upload_id: int,
+    filename: Optional[str] = None,
+    stage: Optional[str] = None,
+    rows: Optional[int] = None,
+    error: Optional[str] = None,
+) -> None:
+    """
+    Publish an in-flight upload's progress to this process. Finished uploads are dropped:
+    their final state is committed on the Upload row, which is what other workers read anyway.
+    """
+    with _lock:
+        current = _board.get(upload_id) or UploadStatus(upload_id, filename or "", STAGE_QUEUED)
+        updated = replace(
+            current,
+            filename=filename if filename is not None else current.filename,
+            stage=stage if stage is not None else current.stage,
+            rows=rows if rows is not None else current.rows,
+            error=error if error is not None else current.error,
+        )
+        if updated.finished:
+            _board.pop(upload_id, None)
+        else:
+            _board[upload_id] = updated
+
+
+def get_progress(upload_id: int) -> Optional[UploadStatus]:
+    """Live progress when the upload is being imported by this process, else None."""
+    with _lock:
+        return _board.get(upload_id)
@@ -0,0 +1,854 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select, text, update
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import Product, ProductPrice
+from ..utils.text import normalize_text
+from .change_feed import record_change
+from .price_history import build_history_entry, history_key, record_price_history
+from .vendor_dictionary import find_product_match
+
+
+# Rows buffered by BulkRowWriter before one round of bulk INSERT/UPDATE statements
+BULK_BATCH_SIZE = 1000
+# Rows buffered by CopyRowWriter per COPY into the staging table
+COPY_BATCH_SIZE = 5000
+
+
+@dataclass
+class ParsedRow:
+    """One spreadsheet row after column detection and price parsing."""
+    name: str
+    price: float
+    sku: Optional[str] = None
+    currency: str = "ARS"
+
+
+@dataclass
+class MatchedRow:
+    """A ParsedRow after vendor-dictionary matching: plain data, so parse workers can send it back."""
+    row: ParsedRow
+    canonical_key: Optional[str]
+    canonical_name: Optional[str]
+    # canonical_name when the dictionary matched, otherwise the row's own name
+    base_name: str
+    normalized_name: str
+
+    def to_plain(self) -> tuple:
+        """Flat tuple form: pickles several times faster than the dataclasses between processes."""
+        row = self.row
+        return (
+            row.name, row.price, row.sku, row.currency,
+            self.canonical_key, self.canonical_name, self.base_name, self.normalized_name,
+        )
+
+    @classmethod
+    def from_plain(cls, values: tuple) -> "MatchedRow":
+        name, price, sku, currency, canonical_key, canonical_name, base_name, normalized_name = values
+        return cls(ParsedRow(name, price, sku, currency), canonical_key, canonical_name, base_name, normalized_name)
+
+
+@dataclass
+class ImportDiff:
+    """What an import changed in its provider's offers (ProductPrice rows)."""
+    added: int = 0
+    changed: int = 0
+    removed: int = 0
+
+
+def _keeps_unseen_offers(skipped_rows: int) -> bool:
+    """
+    With rows that could not be written, an offer missing from the diff may still be in the
+    file, so finish() deletes nothing rather than dropping offers the provider still lists.
+    """
+    if skipped_rows:
+        print(f"[import] {skipped_rows} rows could not be written; offers missing from the file are kept")
+    return bool(skipped_rows)
+
+
+def match_row(provider_name: str, row: ParsedRow) -> MatchedRow:
+    """Dictionary match and name normalization for a row; CPU only, no database access."""
+    match = find_product_match(provider_name, row.name, row.sku)
+    canonical_name = match.canonical_name if match else None
+    canonical_key = match.canonical_key if match else None
+    base_name = canonical_name or row.name
+    return MatchedRow(row, canonical_key, canonical_name, base_name, normalize_text(base_name))
+
+
+def _process_product_row(
+    name_val: str,
+    price_float: float,
+    sku_val: Optional[str],
+    currency_val: str,
+    upload_id: int,
+    provider_name: str,
+    session: Session,
+    matched: Optional[MatchedRow] = None,
+) -> dict:
+    """
+    Process a single product row: find or create Product, then create/update ProductPrice.
+    Returns the price_history entry for the row so callers can append history in bulk.
+    `matched` skips the dictionary lookup when a parse worker already did it.
+    """
+    now = datetime.utcnow()
+
+    # Try to match product in vendor dictionary; if matched, the standardized name is used
+    # for normalization (forces grouping), otherwise the original name
+    if matched is None:
+        matched = match_row(provider_name, ParsedRow(name=name_val, price=price_float, sku=sku_val, currency=currency_val))
+    canonical_name = matched.canonical_name
+    canonical_key = matched.canonical_key
+    norm_name = matched.normalized_name
+    base_name = matched.base_name
+
+    product = None
+    if canonical_key:
+        product = session.execute(
+            select(Product).where(Product.canonical_key == canonical_key)
+        ).scalar_one_or_none()
+    if product is None:
+        product = session.execute(
+            select(Product).where(Product.normalized_name == norm_name)
+        ).scalar_one_or_none()
+
+    if product is None:
+        # Create new product
+        product = Product(
+            sku=sku_val if sku_val else None,
+            canonical_key=canonical_key,
+            name=base_name,
+            normalized_name=norm_name,
+            display_name=canonical_name,
+            keywords=None,
+            created_at=now,
+            updated_at=now,
+        )
+        session.add(product)
+        session.flush()  # Get the product.id
+        record_change(session, "product", product, "insert")
+    else:
+        # Update existing product metadata
+        product.updated_at = now
+        changed = False
+        if sku_val and not product.sku:
+            product.sku = sku_val
+            changed = True
+        if canonical_key and product.canonical_key != canonical_key:
+            product.canonical_key = canonical_key
+            changed = True
+        if canonical_name:
+            if product.name != canonical_name:
+                product.name = canonical_name
+                changed = True
+            if product.display_name != canonical_name:
+                product.display_name = canonical_name
+                changed = True
+        session.add(product)
+        if changed:
+            record_change(session, "product", product, "update")
+    
+    # Find or create ProductPrice for this provider; flush first so a price added
+    # earlier in this file is found ((product_id, provider_name) is unique)
+    session.flush()
+    existing_price = session.execute(
+        select(ProductPrice).where(
+            ProductPrice.product_id == product.id,
+            ProductPrice.provider_name == provider_name
+        )
+    ).scalar_one_or_none()
+    
+    if existing_price:
+        # Update existing price
+        existing_price.unit_price = round(price_float, 2)
+        existing_price.currency = currency_val
+        existing_price.source_file_id = upload_id
+        existing_price.last_seen_at = now
+        existing_price.updated_at = now
+        existing_price.provider_product_name = name_val
+        existing_price.canonical_key = canonical_key
+        session.add(existing_price)
+        record_change(session, "price", existing_price, "update")
+    else:
+        # Create new price entry
+        new_price = ProductPrice(
+            product_id=product.id,
+            source_file_id=upload_id,
+            unit_price=round(price_float, 2),
+            currency=currency_val,
+            provider_name=provider_name,
+            provider_product_name=name_val,
+            canonical_key=canonical_key,
+            last_seen_at=now,
+            created_at=now,
+            updated_at=now,
+        )
+        session.add(new_price)
+        record_change(session, "price", new_price, "insert")
+
+    return build_history_entry(
+        canonical_key=history_key(canonical_key, norm_name),
+        product_id=product.id,
+        provider_name=provider_name,
+        unit_price=price_float,
+        currency=currency_val,
+        upload_id=upload_id,
+        recorded_at=now,
+    )
+
+
+class SessionRowWriter:
+    """Row-by-row ORM writes: up to three SELECTs and a flush per row (IMPORT_MODE=row)."""
+
+    def __init__(self, session: Session, upload_id: int, provider_name: str) -> None:
+        self.session = session
+        self.upload_id = upload_id
+        self.provider_name = provider_name
+        self.history_entries: List[dict] = []
+
+    def add(self, row: ParsedRow) -> None:
+        self.add_matched(match_row(self.provider_name, row))
+
+    def add_matched(self, matched: MatchedRow) -> None:
+        row = matched.row
+        self.history_entries.append(
+            _process_product_row(
+                name_val=row.name,
+                price_float=row.price,
+                sku_val=row.sku,
+                currency_val=row.currency,
+                upload_id=self.upload_id,
+                provider_name=self.provider_name,
+                session=self.session,
+                matched=matched,
+            )
+        )
+
+    def flush(self) -> None:
+        pass
+
+    def finish(self) -> Optional[ImportDiff]:
+        """The row path rewrites every offer and removes none: there is no diff to report."""
+        return None
+
+
+class _ProductState:
+    __slots__ = ("id", "sku", "canonical_key", "name", "normalized_name", "display_name", "created_at", "updated_at")
+
+    def __init__(self, id, sku, canonical_key, name, normalized_name, display_name, created_at=None, updated_at=None):
+        self.id = id
+        self.sku = sku
+        self.canonical_key = canonical_key
+        self.name = name
+        self.normalized_name = normalized_name
+        self.display_name = display_name
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+
+class _PriceState:
+    __slots__ = (
+        "id", "product", "unit_price", "currency", "provider_product_name", "canonical_key",
+        "last_seen_at", "created_at", "updated_at",
+    )
+
+    def __init__(self, id, product):
+        self.id = id
+        self.product = product
+
+    def signature(self) -> tuple:
+        """The offer fields an import writes; equal signatures mean there is nothing to update."""
+        return (self.unit_price, self.currency, self.provider_product_name, self.canonical_key)
+
+
+def _lookup(index: Dict, key):
+    """The single match for `key`, None when missing; several matches fail the row like scalar_one_or_none."""
+    matches = index.get(key)
+    if not matches:
+        return None
+    if len(matches) > 1:
+        raise LookupError(f"ambiguous match for {key!r}")
+    return matches[0]
+
+
+class BulkRowWriter:
+    """
+    Products and this provider's offers are preloaded into lookup maps once per upload, and the
+    file is diffed against them in memory: only new offers, offers whose price, currency, name
+    or key changed, and products whose metadata changed are written, in batches of bulk
+    INSERT/UPDATE mappings. Offers the file no longer lists are deleted by finish()
+    (IMPORT_MODE=bulk, the default).
+    """
+
+    def __init__(self, session: Session, upload_id: int, provider_name: str, batch_size: int = BULK_BATCH_SIZE) -> None:
+        self.session = session
+        self.upload_id = upload_id
+        self.provider_name = provider_name
+        self.batch_size = batch_size
+        # Price history is written with each batch; nothing is left for record_price_history
+        self.history_entries: List[dict] = []
+        self._loaded = False
+        self._by_key: Dict[str, List[_ProductState]] = defaultdict(list)
+        self._by_norm: Dict[str, List[_ProductState]] = defaultdict(list)
+        self._prices: Dict[_ProductState, List[_PriceState]] = defaultdict(list)
+        # Ordered sets of what the current batch touched
+        self._products: Dict[_ProductState, None] = {}
+        self._price_rows: Dict[_PriceState, None] = {}
+        self._rows: List[Tuple[_ProductState, Optional[str], str, ParsedRow, datetime]] = []
+        # Diff state: the provider's offers before the import, and what the file did to them
+        self._existing: Dict[int, _PriceState] = {}
+        self._seen: Set[_PriceState] = set()
+        self._added: Set[_PriceState] = set()
+        self._changed: Set[_PriceState] = set()
+        self._row_count = 0
+        # Rows that failed (e.g. an ambiguous lookup): their offers cannot be told apart from removed ones
+        self._skipped_rows = 0
+
+    def _load(self) -> None:
+        by_id: Dict[int, _ProductState] = {}
+        for row in self.session.execute(
+            select(
+                Product.id, Product.sku, Product.canonical_key, Product.name,
+                Product.normalized_name, Product.display_name,
+            )
+        ):
+            product = _ProductState(*row)
+            by_id[product.id] = product
+            if product.canonical_key:
+                self._by_key[product.canonical_key].append(product)
+            self._by_norm[product.normalized_name].append(product)
+        for price_id, product_id, unit_price, currency, provider_product_name, canonical_key in self.session.execute(
+            select(
+                ProductPrice.id, ProductPrice.product_id, ProductPrice.unit_price, ProductPrice.currency,
+                ProductPrice.provider_product_name, ProductPrice.canonical_key,
+            ).where(ProductPrice.provider_name == self.provider_name)
+        ):
+            product = by_id.get(product_id)
+            if product is not None:
+                price = _PriceState(price_id, product)
+                price.unit_price = round(float(unit_price), 2)
+                price.currency = currency
+                price.provider_product_name = provider_product_name
+                price.canonical_key = canonical_key
+                self._prices[product].append(price)
+                self._existing[price_id] = price
+        self._loaded = True
+
+    def add(self, row: ParsedRow) -> None:
+        self.add_matched(match_row(self.provider_name, row))
+
+    def add_matched(self, matched: MatchedRow) -> None:
+        try:
+            self._add_matched(matched)
+        except Exception:
+            self._skipped_rows += 1
+            raise
+
+    def _add_matched(self, matched: MatchedRow) -> None:
+        if not self._loaded:
+            self._load()
+        now = datetime.utcnow()
+
+        row = matched.row
+        canonical_name = matched.canonical_name
+        canonical_key = matched.canonical_key
+        norm_name = matched.normalized_name
+        base_name = matched.base_name
+
+        product = _lookup(self._by_key, canonical_key) if canonical_key else None
+        if product is None:
+            product = _lookup(self._by_norm, norm_name)
+
+        if product is None:
+            product = _ProductState(
+                None, row.sku if row.sku else None, canonical_key, base_name, norm_name, canonical_name, now, now
+            )
+            if canonical_key:
+                self._by_key[canonical_key].append(product)
+            self._by_norm[norm_name].append(product)
+            record_change(self.session, "product", product, "insert")
+            self._products[product] = None
+        else:
+            changed = False
+            if row.sku and not product.sku:
+                product.sku = row.sku
+                changed = True
+            if canonical_key and product.canonical_key != canonical_key:
+                if product.canonical_key:
+                    self._by_key[product.canonical_key].remove(product)
+                product.canonical_key = canonical_key
+                self._by_key[canonical_key].append(product)
+                changed = True
+            if canonical_name:
+                if product.name != canonical_name:
+                    product.name = canonical_name
+                    changed = True
+                if product.display_name != canonical_name:
+                    product.display_name = canonical_name
+                    changed = True
+            if changed:
+                product.updated_at = now
+                record_change(self.session, "product", product, "update")
+                self._products[product] = None
+        self._row_count += 1
+
+        price = _lookup(self._prices, product)
+        offer = (round(row.price, 2), row.currency, row.name, canonical_key)
+        if price is None:
+            price = _PriceState(None, product)
+            price.created_at = now
+            self._prices[product].append(price)
+            self._added.add(price)
+            record_change(self.session, "price", price, "insert")
+            price_moved = True
+        else:
+            self._seen.add(price)
+            if price.signature() == offer:
+                # Unchanged offer: no UPDATE, no change-feed row, no history point
+                return
+            if price.id is not None:
+                self._changed.add(price)
+                record_change(self.session, "price", price, "update")
+            price_moved = (price.unit_price, price.currency) != offer[:2]
+        price.unit_price, price.currency, price.provider_product_name, price.canonical_key = offer
+        price.last_seen_at = now
+        price.updated_at = now
+        self._price_rows[price] = None
+
+        # History keeps one point per price actually seen to move (or appear)
+        if price_moved:
+            self._rows.append((product, canonical_key, norm_name, row, now))
+        if len(self._price_rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered batch: new products first, so their ids can be used by the prices."""
+        if not self._products and not self._price_rows:
+            return
+        session = self.session
+
+        new_products = [p for p in self._products if p.id is None]
+        existing_products = [p for p in self._products if p.id is not None]
+        if new_products:
+            mappings = [
+                {
+                    "sku": p.sku,
+                    "canonical_key": p.canonical_key,
+                    "name": p.name,
+                    "normalized_name": p.normalized_name,
+                    "display_name": p.display_name,
+                    "keywords": None,
+                    "created_at": p.created_at,
+                    "updated_at": p.updated_at,
+                }
+                for p in new_products
+            ]
+            session.bulk_insert_mappings(Product, mappings, return_defaults=True)
+            for p, mapping in zip(new_products, mappings):
+                p.id = mapping["id"]
+        if existing_products:
+            session.bulk_update_mappings(
+                Product,
+                [
+                    {
+                        "id": p.id,
+                        "sku": p.sku,
+                        "canonical_key": p.canonical_key,
+                        "name": p.name,
+                        "display_name": p.display_name,
+                        "updated_at": p.updated_at,
+                    }
+                    for p in existing_products
+                ],
+            )
+
+        new_prices = [p for p in self._price_rows if p.id is None]
+        existing_prices = [p for p in self._price_rows if p.id is not None]
+        if new_prices:
+            mappings = [
+                {
+                    "product_id": p.product.id,
+                    "source_file_id": self.upload_id,
+                    "unit_price": p.unit_price,
+                    "currency": p.currency,
+                    "provider_name": self.provider_name,
+                    "provider_product_name": p.provider_product_name,
+                    "canonical_key": p.canonical_key,
+                    "last_seen_at": p.last_seen_at,
+                    "created_at": p.created_at,
+                    "updated_at": p.updated_at,
+                }
+                for p in new_prices
+            ]
+            session.bulk_insert_mappings(ProductPrice, mappings, return_defaults=True)
+            for p, mapping in zip(new_prices, mappings):
+                p.id = mapping["id"]
+        if existing_prices:
+            session.bulk_update_mappings(
+                ProductPrice,
+                [
+                    {
+                        "id": p.id,
+                        "source_file_id": self.upload_id,
+                        "unit_price": p.unit_price,
+                        "currency": p.currency,
+                        "provider_product_name": p.provider_product_name,
+                        "canonical_key": p.canonical_key,
+                        "last_seen_at": p.last_seen_at,
+                        "updated_at": p.updated_at,
+                    }
+                    for p in existing_prices
+                ],
+            )
+
+        # History goes out with its batch so memory does not grow with the sheet's row count
+        record_price_history(
+            session,
+            [
+                build_history_entry(
+                    canonical_key=history_key(canonical_key, norm_name),
+                    product_id=product.id,
+                    provider_name=self.provider_name,
+                    unit_price=row.price,
+                    currency=row.currency,
+                    upload_id=self.upload_id,
+                    recorded_at=recorded_at,
+                )
+                for product, canonical_key, norm_name, row, recorded_at in self._rows
+            ],
+        )
+        self._products.clear()
+        self._price_rows.clear()
+        self._rows.clear()
+
+    def finish(self) -> ImportDiff:
+        """Flush, then delete the provider's offers the file did not list; returns the diff counts."""
+        self.flush()
+        removed: List[_PriceState] = []
+        # A file that yielded no rows (unreadable columns, empty sheets) must not wipe the provider
+        if self._row_count and not _keeps_unseen_offers(self._skipped_rows):
+            removed = [p for p in self._existing.values() if p not in self._seen]
+        for start in range(0, len(removed), self.batch_size):
+            batch = removed[start:start + self.batch_size]
+            self.session.execute(delete(ProductPrice).where(ProductPrice.id.in_([p.id for p in batch])))
+            for price in batch:
+                record_change(self.session, "price", price.id, "delete", price.canonical_key)
+        # Unchanged offers were not rewritten, but the file listed them again: one batched UPDATE
+        # keeps last_seen_at meaning "in the provider's latest list" (catalog_normalizer relies on it)
+        now = datetime.utcnow()
+        relisted = [p.id for p in self._seen if p.id is not None and p not in self._changed and p not in self._added]
+        for start in range(0, len(relisted), self.batch_size):
+            self.session.execute(
+                update(ProductPrice)
+                .where(ProductPrice.id.in_(relisted[start:start + self.batch_size]))
+                .values(last_seen_at=now)
+            )
+        return ImportDiff(
+            added=len(self._added),
+            changed=len(self._changed - self._added),
+            removed=len(removed),
+        )
+
+
+_STAGING_COLUMNS = (
+    "upload_id", "seq", "provider_product_name", "sku", "canonical_key", "canonical_name",
+    "base_name", "normalized_name", "unit_price", "currency", "recorded_at",
+)
+
+# Rows whose lookup matches several products are dropped instead of guessing, like
+# scalar_one_or_none failing the row in the other writers
+_DROP_AMBIGUOUS_BY_KEY = text("""
+    DELETE FROM import_staging s
+    WHERE s.upload_id = :upload_id AND s.product_id IS NULL AND s.canonical_key IS NOT NULL
+      AND (SELECT COUNT(*) FROM products p WHERE p.canonical_key = s.canonical_key) > 1
+""")
+
+_DROP_AMBIGUOUS_BY_NAME = text("""
+    DELETE FROM import_staging s
+    WHERE s.upload_id = :upload_id AND s.product_id IS NULL
+      AND (SELECT COUNT(*) FROM products p WHERE p.normalized_name = s.normalized_name) > 1
+""")
+
+_RESOLVE_BY_KEY = text("""
+    UPDATE import_staging s SET product_id = p.id
+    FROM products p
+    WHERE s.upload_id = :upload_id AND s.product_id IS NULL AND p.canonical_key = s.canonical_key
+""")
+
+_RESOLVE_BY_NAME = text("""
+    UPDATE import_staging s SET product_id = p.id
+    FROM products p
+    WHERE s.upload_id = :upload_id AND s.product_id IS NULL AND p.normalized_name = s.normalized_name
+""")
+
+# A row that found its product by name hands its canonical key to that product, so later rows
+# with the same key follow it (the other writers see the updated key in their lookups)
+_RESOLVE_BY_STAGED_KEY = text("""
+    UPDATE import_staging s SET product_id = r.product_id
+    FROM (
+        SELECT DISTINCT ON (canonical_key) canonical_key, product_id
+        FROM import_staging
+        WHERE upload_id = :upload_id AND product_id IS NOT NULL AND canonical_key IS NOT NULL
+        ORDER BY canonical_key, seq
+    ) r
+    WHERE s.upload_id = :upload_id AND s.product_id IS NULL AND s.canonical_key = r.canonical_key
+""")
+
+# New products take the first staged row of their group (canonical key first, then normalized name)
+_INSERT_PRODUCTS_BY_KEY = text("""
+    INSERT INTO products (sku, canonical_key, name, normalized_name, display_name, created_at, updated_at)
+    SELECT DISTINCT ON (canonical_key)
+        LEFT(NULLIF(sku, ''), 64), canonical_key, base_name, normalized_name, canonical_name, :now, :now
+    FROM import_staging
+    WHERE upload_id = :upload_id AND product_id IS NULL AND canonical_key IS NOT NULL
+    ORDER BY canonical_key, seq
+    RETURNING id, canonical_key
+""")
+
+_INSERT_PRODUCTS_BY_NAME = text("""
+    INSERT INTO products (sku, canonical_key, name, normalized_name, display_name, created_at, updated_at)
+    SELECT DISTINCT ON (normalized_name)
+        LEFT(NULLIF(sku, ''), 64), canonical_key, base_name, normalized_name, canonical_name, :now, :now
+    FROM import_staging
+    WHERE upload_id = :upload_id AND product_id IS NULL
+    ORDER BY normalized_name, seq
+    RETURNING id, canonical_key
+""")
+
+# Same per-row rules as BulkRowWriter, folded per product: the first SKU fills a missing one,
+# the last dictionary match sets canonical_key, name and display_name. Unchanged products are left alone
+_UPDATE_PRODUCTS = text("""
+    WITH staged AS (
+        SELECT
+            product_id,
+            (array_agg(LEFT(sku, 64) ORDER BY seq) FILTER (WHERE sku <> ''))[1] AS sku,
+            (array_agg(canonical_key ORDER BY seq DESC) FILTER (WHERE canonical_key IS NOT NULL))[1] AS canonical_key,
+            (array_agg(canonical_name ORDER BY seq DESC) FILTER (WHERE canonical_name IS NOT NULL))[1] AS canonical_name
+        FROM import_staging
+        WHERE upload_id = :upload_id AND product_id IS NOT NULL
+        GROUP BY product_id
+    ),
+    changes AS (
+        SELECT
+            staged.*,
+            (
+                (staged.sku IS NOT NULL AND COALESCE(p.sku, '') = '')
+                OR (staged.canonical_key IS NOT NULL AND p.canonical_key IS DISTINCT FROM staged.canonical_key)
+                OR (staged.canonical_name IS NOT NULL AND (
+                    p.name IS DISTINCT FROM staged.canonical_name
+                    OR p.display_name IS DISTINCT FROM staged.canonical_name
+                ))
+            ) AS changed
+        FROM staged JOIN products p ON p.id = staged.product_id
+    )
+    UPDATE products p SET
+        sku = CASE WHEN COALESCE(p.sku, '') = '' AND changes.sku IS NOT NULL THEN changes.sku ELSE p.sku END,
+        canonical_key = COALESCE(changes.canonical_key, p.canonical_key),
+        name = COALESCE(changes.canonical_name, p.name),
+        display_name = COALESCE(changes.canonical_name, p.display_name),
+        updated_at = :now
+    FROM changes
+    WHERE p.id = changes.product_id AND changes.changed
+    RETURNING p.id, p.canonical_key
+""")
+
+# The last staged row of each product is this provider's current offer; an identical offer
+# is not rewritten (the conflict WHERE skips it, so it is not returned either)
+_UPSERT_PRICES = text("""
+    INSERT INTO product_prices (
+        product_id, source_file_id, unit_price, currency, provider_name, provider_product_name,
+        canonical_key, last_seen_at, created_at, updated_at
+    )
+    SELECT DISTINCT ON (product_id)
+        product_id, :upload_id, unit_price, LEFT(currency, 8), :provider_name, provider_product_name,
+        canonical_key, recorded_at, recorded_at, recorded_at
+    FROM import_staging
+    WHERE upload_id = :upload_id AND product_id IS NOT NULL
+    ORDER BY product_id, seq DESC
+    ON CONFLICT (product_id, provider_name) DO UPDATE SET
+        source_file_id = EXCLUDED.source_file_id,
+        unit_price = EXCLUDED.unit_price,
+        currency = EXCLUDED.currency,
+        provider_product_name = EXCLUDED.provider_product_name,
+        canonical_key = EXCLUDED.canonical_key,
+        last_seen_at = EXCLUDED.last_seen_at,
+        updated_at = EXCLUDED.updated_at
+    WHERE (product_prices.unit_price, product_prices.currency, product_prices.provider_product_name, product_prices.canonical_key)
+        IS DISTINCT FROM (EXCLUDED.unit_price, EXCLUDED.currency, EXCLUDED.provider_product_name, EXCLUDED.canonical_key)
+    RETURNING id, canonical_key, (xmax = 0) AS inserted
+""")
+
+# Runs before the upsert: one point per staged row whose offer is new or whose price moved
+_INSERT_HISTORY = text("""
+    INSERT INTO price_history (recorded_at, canonical_key, product_id, upload_id, provider_name, unit_price, currency)
+    SELECT s.recorded_at, LEFT(COALESCE(s.canonical_key, s.normalized_name), 128), s.product_id, s.upload_id,
+        :provider_name, s.unit_price, LEFT(s.currency, 8)
+    FROM import_staging s
+    LEFT JOIN product_prices p ON p.product_id = s.product_id AND p.provider_name = :provider_name
+    WHERE s.upload_id = :upload_id AND s.product_id IS NOT NULL
+      AND (p.id IS NULL OR p.unit_price <> s.unit_price OR p.currency IS DISTINCT FROM LEFT(s.currency, 8))
+    ORDER BY s.seq
+""")
+
+_STAGED_PRODUCTS = text("""
+    SELECT DISTINCT product_id FROM import_staging WHERE upload_id = :upload_id AND product_id IS NOT NULL
+""")
+
+# Offers of this provider on products the file did not list
+_DELETE_UNSEEN_PRICES = text("""
+    DELETE FROM product_prices
+    WHERE provider_name = :provider_name AND product_id <> ALL(:seen_product_ids)
+    RETURNING id, canonical_key
+""")
+
+# Offers the file listed unchanged (the upsert skipped them) were still seen in this list
+_TOUCH_RELISTED_PRICES = text("""
+    UPDATE product_prices SET last_seen_at = :now
+    WHERE provider_name = :provider_name
+      AND product_id = ANY(CAST(:seen_product_ids AS INTEGER[]))
+      AND id <> ALL(CAST(:written_ids AS INTEGER[]))
+""")
+
+_CLEAR_STAGING = text("DELETE FROM import_staging WHERE upload_id = :upload_id")
+
+
+class CopyRowWriter:
+    """
+    Postgres-only set-based ingest (IMPORT_MODE=copy): parsed rows are streamed into the UNLOGGED
+    import_staging table with COPY, and each flush resolves, inserts and upserts the whole batch
+    with a handful of statements, skipping identical offers like BulkRowWriter. Dictionary
+    matching runs in Python (match_row) before rows are added.
+    """
+
+    def __init__(self, session: Session, upload_id: int, provider_name: str, batch_size: int = COPY_BATCH_SIZE) -> None:
+        self.session = session
+        self.upload_id = upload_id
+        self.provider_name = provider_name
+        self.batch_size = batch_size
+        # Price history is appended from the staging table; nothing is left for record_price_history
+        self.history_entries: List[dict] = []
+        self._seq = 0
+        self._staged = 0
+        self._buffer: List[tuple] = []
+        # Diff state across flushes
+        self._seen_product_ids: Set[int] = set()
+        self._added: Set[int] = set()
+        self._changed: Set[int] = set()
+        # Staged rows dropped as ambiguous: their offers cannot be told apart from removed ones
+        self._skipped_rows = 0
+
+    def add(self, row: ParsedRow) -> None:
+        self.add_matched(match_row(self.provider_name, row))
+
+    def add_matched(self, matched: MatchedRow) -> None:
+        row = matched.row
+        self._seq += 1
+        self._buffer.append((
+            self.upload_id,
+            self._seq,
+            row.name,
+            row.sku,
+            matched.canonical_key,
+            matched.canonical_name,
+            matched.base_name,
+            matched.normalized_name,
+            round(row.price, 2),
+            row.currency or "ARS",
+            datetime.utcnow(),
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._copy()
+
+    def _copy(self) -> None:
+        """Stream the buffered rows into import_staging over the session's own connection."""
+        if not self._buffer:
+            return
+        raw = self.session.connection().connection.driver_connection
+        with raw.cursor() as cursor:
+            with cursor.copy(f"COPY import_staging ({', '.join(_STAGING_COLUMNS)}) FROM STDIN") as copy:
+                for values in self._buffer:
+                    copy.write_row(values)
+        self._staged += len(self._buffer)
+        self._buffer.clear()
+
+    def flush(self) -> None:
+        """Merge everything staged so far into products, product_prices and price_history."""
+        self._copy()
+        if not self._staged:
+            return
+        session = self.session
+        params = {"upload_id": self.upload_id, "provider_name": self.provider_name, "now": datetime.utcnow()}
+
+        # Existing products: canonical key first, then normalized name
+        self._skipped_rows += session.execute(_DROP_AMBIGUOUS_BY_KEY, params).rowcount
+        session.execute(_RESOLVE_BY_KEY, params)
+        self._skipped_rows += session.execute(_DROP_AMBIGUOUS_BY_NAME, params).rowcount
+        session.execute(_RESOLVE_BY_NAME, params)
+        session.execute(_RESOLVE_BY_STAGED_KEY, params)
+        # New products, grouped by canonical key and then by normalized name
+        for product_id, canonical_key in session.execute(_INSERT_PRODUCTS_BY_KEY, params):
+            record_change(session, "product", product_id, "insert", canonical_key)
+        session.execute(_RESOLVE_BY_KEY, params)
+        self._skipped_rows += session.execute(_DROP_AMBIGUOUS_BY_NAME, params).rowcount
+        session.execute(_RESOLVE_BY_NAME, params)
+        for product_id, canonical_key in session.execute(_INSERT_PRODUCTS_BY_NAME, params):
+            record_change(session, "product", product_id, "insert", canonical_key)
+        session.execute(_RESOLVE_BY_NAME, params)
+
+        for product_id, canonical_key in session.execute(_UPDATE_PRODUCTS, params):
+            record_change(session, "product", product_id, "update", canonical_key)
+        session.execute(_INSERT_HISTORY, params)
+        for price_id, canonical_key, inserted in session.execute(_UPSERT_PRICES, params):
+            record_change(session, "price", price_id, "insert" if inserted else "update", canonical_key)
+            (self._added if inserted else self._changed).add(price_id)
+        self._seen_product_ids.update(session.execute(_STAGED_PRODUCTS, params).scalars())
+        session.execute(_CLEAR_STAGING, params)
+        self._staged = 0
+
+    def finish(self) -> ImportDiff:
+        """Flush, then delete the provider's offers the file did not list; returns the diff counts."""
+        self.flush()
+        removed = []
+        # A file that yielded no rows must not wipe the provider
+        if self._seen_product_ids and not _keeps_unseen_offers(self._skipped_rows):
+            removed = self.session.execute(
+                _DELETE_UNSEEN_PRICES,
+                {"provider_name": self.provider_name, "seen_product_ids": list(self._seen_product_ids)},
+            ).all()
+        for price_id, canonical_key in removed:
+            record_change(self.session, "price", price_id, "delete", canonical_key)
+        # Same as BulkRowWriter: offers relisted unchanged get their last_seen_at in one UPDATE
+        if self._seen_product_ids:
+            self.session.execute(
+                _TOUCH_RELISTED_PRICES,
+                {
+                    "now": datetime.utcnow(),
+                    "provider_name": self.provider_name,
+                    "seen_product_ids": list(self._seen_product_ids),
+                    "written_ids": list(self._added | self._changed),
+                },
+            )
+        return ImportDiff(
+            added=len(self._added),
+            changed=len(self._changed - self._added),
+            removed=len(removed),
+        )
+
+
+def make_row_writer(session: Session, upload_id: int, provider_name: str):
+    """
+    The writer for IMPORT_MODE: "bulk" (default), "row" for the row-by-row path, or "copy" for
+    COPY + set-based merges on Postgres (other databases fall back to "bulk").
+    """
+    mode = get_settings().import_mode
+    if mode == "row":
+        return SessionRowWriter(session, upload_id, provider_name)
+    if mode == "copy" and session.get_bind().dialect.name == "postgresql":
+        return CopyRowWriter(session, upload_id, provider_name)
+    return BulkRowWriter(session, upload_id, provider_name)
@@ -1,19 +1,39 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from datetime import datetime
-from io import BytesIO
-from typing import List, Optional
+from itertools import chain, islice
+from threading import Event
+from typing import Deque, Iterator, List, Optional, Sequence, Tuple
 import re
 
-from fastapi import UploadFile
 from openpyxl import load_workbook
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from sqlalchemy import select
 from xlrd import open_workbook
 
-from ..models import Upload, Product, ProductPrice
-from ..utils.text import normalize_text
+from ..config import get_settings
+from ..models import ProductPrice, Upload
 from .pdf_image_importer import import_pdf_or_image
 from .catalog_normalizer import normalize_catalog
-from .vendor_dictionary import find_product_match
+from .change_feed import prune_changes
+from .import_progress import (
+    FINISHED_STAGES,
+    PROGRESS_EVERY_ROWS,
+    STAGE_DONE,
+    STAGE_FAILED,
+    STAGE_NORMALIZING,
+    STAGE_PARSING,
+    STAGE_UNCHANGED,
+    report_progress,
+)
+from .import_writers import MatchedRow, ParsedRow, make_row_writer, match_row
+from .parse_pool import get_parse_pool, shutdown_parse_pool
+from .price_history import record_price_history, rollup_price_history
+from .upload_spool import mapped_file
+from .warmup import schedule_warm_up
 
 
 def _infer_columns(headers: List[str]) -> dict:
@@ -160,6 +180,62 @@ def find_header_row(rows: List[List[object]]) -> int:
     return best_idx
 
 
+# Rows read ahead of each sheet: header detection scans the first 20, column guessing 60 more
+PREVIEW_ROWS = 80
+
+
+def _detect_sheet_columns(preview: List[List[object]]) -> Tuple[int, List[Optional[str]], dict]:
+    """Header row index, headers and column mapping for a sheet, from its first PREVIEW_ROWS rows."""
+    header_row_idx = find_header_row(preview[:20])
+    headers = [str(h).strip() if h is not None else None for h in preview[header_row_idx]]
+    mapping = _infer_columns(headers)
+    if mapping["price"] is None or mapping["name"] is None:
+        sample_rows = preview[header_row_idx + 1: header_row_idx + 61]
+        price_c, name_c = choose_price_and_name(headers, sample_rows)
+        if mapping["price"] is None:
+            mapping["price"] = price_c
+        if mapping["name"] is None:
+            mapping["name"] = name_c
+    return header_row_idx, headers, mapping
+
+
+def _parse_sheet_row(row: Sequence[object], mapping: dict, header_index: dict) -> Optional[ParsedRow]:
+    """The row as a ParsedRow, or None when it has no usable name or price."""
+    name_col = mapping["name"]
+    price_col = mapping["price"]
+    sku_col = mapping["sku"]
+    currency_col = mapping["currency"]
+    if name_col is None or price_col is None:
+        return None
+    name_idx = header_index.get(name_col)
+    price_idx = header_index.get(price_col)
+    if name_idx is None or price_idx is None:
+        return None
+    name_cell = row[name_idx] if name_idx < len(row) else None
+    price_cell = row[price_idx] if price_idx < len(row) else None
+    if name_cell is None or str(name_cell).strip() in ("", "nan", "None"):
+        return None
+    if price_cell is None:
+        return None
+    price_float = try_parse_price(price_cell)
+    if price_float is None:
+        return None
+
+    sku_val = None
+    if sku_col is not None and header_index.get(sku_col) is not None:
+        sku_idx = header_index[sku_col]
+        if sku_idx < len(row) and row[sku_idx] is not None:
+            sku_val = str(row[sku_idx]).strip()
+
+    currency_val = "ARS"
+    if currency_col is not None and header_index.get(currency_col) is not None:
+        cur_idx = header_index[currency_col]
+        if cur_idx < len(row) and row[cur_idx] is not None:
+            currency_val = str(row[cur_idx]).strip() or "ARS"
+
+    return ParsedRow(name=str(name_cell).strip(), price=price_float, sku=sku_val, currency=currency_val)
+
+
 def extract_provider_name(filename: str) -> str:
     """Extract provider name from upload filename."""
     if not filename:
@@ -177,275 +253,399 @@ def extract_provider_name(filename: str) -> str:
     return provider_name if provider_name else "Proveedor Desconocido"
 
 
-def _process_product_row(
-    name_val: str,
-    price_float: float,
-    sku_val: Optional[str],
-    currency_val: str,
-    upload_id: int,
-    provider_name: str,
-    session: Session,
-) -> None:
-    """Process a single product row: find or create Product, then create/update ProductPrice."""
-    now = datetime.utcnow()
-
-    # Try to match product in vendor dictionary
-    canonical_match = find_product_match(provider_name, name_val, sku_val)
-    canonical_name = canonical_match.canonical_name if canonical_match else None
-    canonical_key = canonical_match.canonical_key if canonical_match else None
-
-    # If matched in dictionary, use standardized name for normalization (forces grouping)
-    # Otherwise use original name
-    if canonical_name:
-        norm_name = normalize_text(canonical_name)
-        base_name = canonical_name
-    else:
-        norm_name = normalize_text(name_val)
-        base_name = name_val
-
-    product = None
-    if canonical_key:
-        product = session.execute(
-            select(Product).where(Product.canonical_key == canonical_key)
-        ).scalar_one_or_none()
-    if product is None:
-        product = session.execute(
-            select(Product).where(Product.normalized_name == norm_name)
-        ).scalar_one_or_none()
-
-    if product is None:
-        # Create new product
-        product = Product(
-            sku=sku_val if sku_val else None,
-            canonical_key=canonical_key,
-            name=base_name,
-            normalized_name=norm_name,
-            display_name=canonical_name,
-            keywords=None,
-            created_at=now,
-            updated_at=now,
-        )
-        session.add(product)
-        session.flush()  # Get the product.id
-    else:
-        # Update existing product metadata
-        product.updated_at = now
-        if sku_val and not product.sku:
-            product.sku = sku_val
-        if canonical_key and product.canonical_key != canonical_key:
-            product.canonical_key = canonical_key
-        if canonical_name:
-            if product.name != canonical_name:
-                product.name = canonical_name
-            product.display_name = canonical_name
-        session.add(product)
-    
-    # Find or create ProductPrice for this provider
-    existing_price = session.execute(
-        select(ProductPrice).where(
-            ProductPrice.product_id == product.id,
-            ProductPrice.provider_name == provider_name
-        )
-    ).scalar_one_or_none()
-    
-    if existing_price:
-        # Update existing price
-        existing_price.unit_price = round(price_float, 2)
-        existing_price.currency = currency_val
-        existing_price.source_file_id = upload_id
-        existing_price.last_seen_at = now
-        existing_price.updated_at = now
-        existing_price.provider_product_name = name_val
-        existing_price.canonical_key = canonical_key
-        session.add(existing_price)
+def _spreadsheet_kind(filename: str) -> Optional[str]:
+    """"xls" or "xlsx" for spreadsheets, None for PDFs and images (imported through OCR)."""
+    fname = filename.lower()
+    if fname.endswith((".pdf", ".jpg", ".jpeg", ".png")):
+        return None
+    return "xls" if fname.endswith(".xls") else "xlsx"
+
+
+def _iter_sheets(path: str, kind: str, only: Optional[int] = None) -> Iterator[Tuple[int, str, Iterator[Sequence[object]]]]:
+    """
+    (sheet count, title, rows) for every sheet of the workbook, or only sheet `only`.
+    Each sheet's rows must be consumed before the next one is requested.
+    """
+    if kind == "xls":
+        # on_demand parses each sheet only when it is requested; unload_sheet drops it afterwards.
+        # xlrd reads the map in place: the OS pages the file in instead of a bytes copy in RAM
+        with mapped_file(path) as content:
+            book = open_workbook(file_contents=content, on_demand=True)
+            try:
+                for sheet_idx in range(book.nsheets) if only is None else [only]:
+                    sheet = book.sheet_by_index(sheet_idx)
+                    try:
+                        # One row_values call per row
+                        yield book.nsheets, sheet.name, (sheet.row_values(r) for r in range(sheet.nrows))
+                    finally:
+                        book.unload_sheet(sheet_idx)
+            finally:
+                book.release_resources()
     else:
-        # Create new price entry
-        new_price = ProductPrice(
-            product_id=product.id,
-            source_file_id=upload_id,
-            unit_price=round(price_float, 2),
-            currency=currency_val,
-            provider_name=provider_name,
-            provider_product_name=name_val,
-            canonical_key=canonical_key,
-            last_seen_at=now,
-            created_at=now,
-            updated_at=now,
-        )
-        session.add(new_price)
+        # Read-only mode streams rows from the zip instead of building the whole workbook DOM
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            worksheets = wb.worksheets
+            for ws in worksheets if only is None else [worksheets[only]]:
+                yield len(worksheets), ws.title, ws.iter_rows(values_only=True)
+        finally:
+            # Read-only workbooks keep the archive open until closed
+            wb.close()
+
+
+def _sheet_rows(title: str, rows: Iterator[Sequence[object]], provider_name: str) -> Iterator[MatchedRow]:
+    """Detect the sheet's columns from its first rows, then parse and dictionary-match every row."""
+    # Only the first rows are kept for header detection and column sampling
+    preview = [list(r) for r in islice(rows, PREVIEW_ROWS)]
+    if not preview:
+        return
+    header_row_idx, headers, mapping = _detect_sheet_columns(preview)
+
+    print(f"[IMPORT] Sheet={title}, Headers={headers[:10]}")
+    print(f"[IMPORT] Detected columns: name={mapping['name']}, price={mapping['price']}, sku={mapping['sku']}, currency={mapping['currency']}")
 
+    header_index = {h: i for i, h in enumerate(headers) if h is not None}
+    for row in chain(preview[header_row_idx + 1:], rows):
+        try:
+            parsed = _parse_sheet_row(row, mapping, header_index)
+            if parsed is None:
+                continue
+            matched = match_row(provider_name, parsed)
+        except Exception:
+            continue
+        yield matched
 
-async def import_excels(files: List[UploadFile], session: Session) -> None:
-    for f in files:
-        filename = f.filename or "archivo_desconocido"
-        upload = Upload(filename=filename, uploaded_at=datetime.utcnow())
-        session.add(upload)
-        session.commit()
-        session.refresh(upload)
-
-        provider_name = extract_provider_name(filename)
-        total_rows = 0
-        total_sheets = 0
-
-        content = await f.read()
-        fname = filename.lower()
-
-        if fname.endswith((".pdf", ".jpg", ".jpeg", ".png")):
-            imported = await import_pdf_or_image(
-                file_bytes=content,
-                filename=filename,
-                upload_id=upload.id,
-                provider_name=provider_name,
-                session=session,
-            )
-            total_rows += imported
+
+@dataclass
+class SheetRows:
+    """One sheet parsed by a pool worker, as plain MatchedRow tuples (see MatchedRow.to_plain)."""
+    sheet_count: int
+    rows: List[tuple]
+
+
+def parse_sheet(path: str, kind: str, sheet_index: int, provider_name: str) -> SheetRows:
+    """Parse pool task: read, parse and match one whole sheet. Runs in a worker process."""
+    sheets = _iter_sheets(path, kind, only=sheet_index)
+    try:
+        sheet_count, title, rows = next(sheets)
+        return SheetRows(sheet_count, [m.to_plain() for m in _sheet_rows(title, rows, provider_name)])
+    finally:
+        sheets.close()
+
+
+class ImportAborted(Exception):
+    """The worker lost its lease on the job: another worker owns the uploads now."""
+
+
+def _check_lease(lease_lost: Optional[Event]) -> None:
+    if lease_lost is not None and lease_lost.is_set():
+        raise ImportAborted("Se perdió el lease del trabajo de importación")
+
+
+@dataclass(frozen=True)
+class ImportItem:
+    """A spooled file waiting to be imported into its (already created) Upload row."""
+    upload_id: int
+    filename: str
+    path: str
+    # Import even when the content matches the provider's last upload
+    force: bool = False
+
+
+@dataclass(frozen=True)
+class _SheetTask:
+    item: ImportItem
+    kind: str
+    provider_name: str
+    sheet_index: int
+
+
+def _set_stage(session: Session, upload: Upload, stage: str, error: Optional[str] = None) -> None:
+    """Commit the upload's new stage, then publish it (finished uploads leave the live board)."""
+    upload.status = stage
+    if error is not None:
+        upload.error = error[:2000]
+    if stage in FINISHED_STAGES:
+        upload.finished_at = datetime.utcnow()
+    session.add(upload)
+    session.commit()
+    report_progress(upload.id, filename=upload.filename, stage=stage, rows=upload.processed_rows, error=error)
+
+
+class _SheetPrefetch:
+    """
+    Feeds the parse pool with the sheets of a run's spreadsheets, in upload order, keeping about
+    `window` sheets parsed ahead of the writer. A file's first sheet reports how many it has,
+    and the rest are queued right behind it.
+    """
+
+    def __init__(self, pool: ProcessPoolExecutor, items: Sequence[ImportItem], window: int) -> None:
+        self._pool = pool
+        self._window = max(1, window)
+        self._pending: Deque[_SheetTask] = deque()
+        self._running: List[Tuple[_SheetTask, Future]] = []
+        for item in items:
+            kind = _spreadsheet_kind(item.filename)
+            if kind is not None:
+                self._pending.append(_SheetTask(item, kind, extract_provider_name(item.filename), 0))
+
+    def _submit(self, task: _SheetTask) -> Future:
+        return self._pool.submit(parse_sheet, task.item.path, task.kind, task.sheet_index, task.provider_name)
+
+    def _top_up(self) -> None:
+        while self._pending and len(self._running) < self._window:
+            task = self._pending.popleft()
+            self._running.append((task, self._submit(task)))
+
+    def _take(self, upload_id: int) -> Optional[Tuple[_SheetTask, Future]]:
+        for i, (task, future) in enumerate(self._running):
+            if task.item.upload_id == upload_id:
+                return self._running.pop(i)
+        # Not submitted yet (the window is busy with later files): this file goes first
+        for i, task in enumerate(self._pending):
+            if task.item.upload_id == upload_id:
+                del self._pending[i]
+                return task, self._submit(task)
+        return None
+
+    def sheets(self, upload_id: int) -> Iterator[Iterator[MatchedRow]]:
+        """The upload's sheets in order, as each worker finishes them."""
+        self._top_up()
+        while True:
+            entry = self._take(upload_id)
+            if entry is None:
+                return
+            task, future = entry
+            try:
+                parsed: SheetRows = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory): the next import starts a fresh pool
+                shutdown_parse_pool()
+                raise
+            if task.sheet_index == 0:
+                self._pending.extendleft(
+                    _SheetTask(task.item, task.kind, task.provider_name, i)
+                    for i in reversed(range(1, parsed.sheet_count))
+                )
+            self._top_up()
+            yield map(MatchedRow.from_plain, parsed.rows)
+
+    def discard(self, upload_id: Optional[int] = None) -> None:
+        """Drop the queued work of one upload (after it failed), or all of it."""
+        self._pending = deque(t for t in self._pending if upload_id is not None and t.item.upload_id != upload_id)
+        keep = []
+        for task, future in self._running:
+            if upload_id is None or task.item.upload_id == upload_id:
+                future.cancel()
+            else:
+                keep.append((task, future))
+        self._running = keep
+
+
+def _local_sheets(path: str, kind: str, provider_name: str) -> Iterator[Iterator[MatchedRow]]:
+    """The same sheets as the parse pool, streamed in this thread (IMPORT_PARSE_WORKERS=1)."""
+    for _, title, rows in _iter_sheets(path, kind):
+        yield _sheet_rows(title, rows, provider_name)
+
+
+async def _import_file(
+    item: ImportItem,
+    session: Session,
+    prefetch: Optional[_SheetPrefetch] = None,
+    lease_lost: Optional[Event] = None,
+) -> Upload:
+    """
+    Import one spooled file into its Upload, committing (and recording progress) after every sheet.
+    Raises ImportAborted before a commit once `lease_lost` is set.
+    """
+    upload = session.get(Upload, item.upload_id)
+    filename = item.filename
+    path = item.path
+    _set_stage(session, upload, STAGE_PARSING)
+
+    provider_name = extract_provider_name(filename)
+    total_rows = 0
+    total_sheets = 0
+    writer = make_row_writer(session, upload.id, provider_name)
+    history_entries = writer.history_entries
+
+    kind = _spreadsheet_kind(filename)
+    if kind is None:
+        imported = await import_pdf_or_image(
+            file_path=path,
+            filename=filename,
+            upload_id=upload.id,
+            provider_name=provider_name,
+            session=session,
+            history_entries=history_entries,
+        )
+        total_rows += imported
+        total_sheets += 1
+    else:
+        # Sheets are parsed and matched by the pool (or right here); this thread is the only writer
+        sheets = prefetch.sheets(upload.id) if prefetch is not None else _local_sheets(path, kind, provider_name)
+        for matched_rows in sheets:
             total_sheets += 1
-        elif fname.endswith(".xls"):
-            book = open_workbook(file_contents=content)
-            for sheet in book.sheets():
-                total_sheets += 1
-                if sheet.nrows == 0:
+            for matched in matched_rows:
+                try:
+                    writer.add_matched(matched)
+                except Exception:
                     continue
-                preview = [[sheet.cell_value(r, c) for c in range(sheet.ncols)] for r in range(min(sheet.nrows, 20))]
-                header_row_idx = find_header_row(preview)
-                headers = [str(sheet.cell_value(header_row_idx, c)).strip() if sheet.cell_value(header_row_idx, c) is not None else None for c in range(sheet.ncols)]
-                mapping = _infer_columns(headers)
-                if mapping["price"] is None or mapping["name"] is None:
-                    sample_rows = [[sheet.cell_value(r, c) for c in range(sheet.ncols)] for r in range(header_row_idx + 1, min(sheet.nrows, header_row_idx + 61))]
-                    price_c, name_c = choose_price_and_name(headers, sample_rows)
-                    if mapping["price"] is None:
-                        mapping["price"] = price_c
-                    if mapping["name"] is None:
-                        mapping["name"] = name_c
-                name_col = mapping["name"]
-                price_col = mapping["price"]
-                sku_col = mapping["sku"]
-                currency_col = mapping["currency"]
-                header_index = {h: i for i, h in enumerate(headers) if h is not None}
-
-                for r in range(header_row_idx + 1, sheet.nrows):
-                    try:
-                        row = [sheet.cell_value(r, c) for c in range(sheet.ncols)]
-                        if name_col is None or price_col is None:
-                            continue
-                        name_idx = header_index.get(name_col)
-                        price_idx = header_index.get(price_col)
-                        if name_idx is None or price_idx is None:
-                            continue
-                        name_cell = row[name_idx] if name_idx < len(row) else None
-                        price_cell = row[price_idx] if price_idx < len(row) else None
-                        if name_cell is None or str(name_cell).strip() in ("", "nan", "None"):
-                            continue
-                        if price_cell is None:
-                            continue
-                        price_float = try_parse_price(price_cell)
-                        if price_float is None:
-                            continue
-
-                        sku_val = None
-                        if sku_col is not None and header_index.get(sku_col) is not None:
-                            sku_idx = header_index[sku_col]
-                            if sku_idx < len(row) and row[sku_idx] is not None:
-                                sku_val = str(row[sku_idx]).strip()
-
-                        currency_val = "ARS"
-                        if currency_col is not None and header_index.get(currency_col) is not None:
-                            cur_idx = header_index[currency_col]
-                            if cur_idx < len(row) and row[cur_idx] is not None:
-                                currency_val = str(row[cur_idx]).strip() or "ARS"
-
-                        name_val = str(name_cell).strip()
-                        _process_product_row(
-                            name_val=name_val,
-                            price_float=price_float,
-                            sku_val=sku_val,
-                            currency_val=currency_val,
-                            upload_id=upload.id,
-                            provider_name=provider_name,
-                            session=session,
-                        )
-                        total_rows += 1
-                    except Exception:
-                        continue
-                session.commit()
+                total_rows += 1
+                if total_rows % PROGRESS_EVERY_ROWS == 0:
+                    report_progress(upload.id, rows=total_rows)
+            writer.flush()
+            _check_lease(lease_lost)
+            upload.processed_rows = total_rows
+            session.commit()
+            report_progress(upload.id, rows=total_rows)
+        # Removals only once every sheet was read: they commit together with the final counts
+        diff = writer.finish()
+        if diff is not None:
+            upload.rows_added = diff.added
+            upload.rows_changed = diff.changed
+            upload.rows_removed = diff.removed
+            print(f"[import] {filename}: +{diff.added} ~{diff.changed} -{diff.removed} offers, the rest unchanged")
+
+    # History the writer left for the end of the upload (row path, PDF/image imports)
+    record_price_history(session, history_entries)
+    upload.sheet_count = total_sheets
+    upload.processed_rows = total_rows
+    session.add(upload)
+    _check_lease(lease_lost)
+    session.commit()
+    report_progress(upload.id, rows=total_rows)
+    return upload
+
+
+def fail_unfinished_uploads(session: Session, upload_ids: Sequence[int], error: str) -> None:
+    """Mark the uploads that are not done or failed yet as failed, e.g. after a job gave up."""
+    for upload_id in upload_ids:
+        upload = session.get(Upload, upload_id)
+        if upload is not None and upload.status not in FINISHED_STAGES:
+            _set_stage(session, upload, STAGE_FAILED, error=error)
+
+
+def _provider_uploads(session: Session, provider_name: str, *criteria) -> Iterator[Tuple[int, Optional[str]]]:
+    """(id, content_sha256) of the provider's successful uploads matching `criteria`, newest first."""
+    rows = session.execute(
+        select(Upload.id, Upload.filename, Upload.content_sha256)
+        .where(Upload.status.in_((STAGE_DONE, STAGE_UNCHANGED)), *criteria)
+        .order_by(Upload.id.desc())
+    )
+    for upload_id, filename, content_sha256 in rows:
+        if extract_provider_name(filename) == provider_name:
+            yield upload_id, content_sha256
+
+
+def _previous_import(session: Session, upload: Upload) -> Optional[Upload]:
+    """The provider's latest successful upload before this one, when its content was identical."""
+    if not upload.content_sha256:
+        return None
+    provider_name = extract_provider_name(upload.filename)
+    for upload_id, content_sha256 in _provider_uploads(session, provider_name, Upload.id < upload.id):
+        # Only the latest one counts: after a different list, resending the old one is a change
+        return session.get(Upload, upload_id) if content_sha256 == upload.content_sha256 else None
+    return None
+
+
+def superseding_upload_id(session: Session, upload: Upload) -> Optional[int]:
+    """
+    The provider's latest successful upload after `upload`, when it left the offers it did not
+    change in place: a diff import (it stored its counts) or a skipped identical resend. Those
+    offers still point at the upload that last wrote them. After a full rewrite (IMPORT_MODE=row,
+    PDF/image imports) an offer left on `upload` was not in the later list, so there is none.
+    """
+    provider_name = extract_provider_name(upload.filename)
+    for upload_id, _ in _provider_uploads(session, provider_name, Upload.id > upload.id):
+        later = session.get(Upload, upload_id)
+        if later.status == STAGE_UNCHANGED or later.rows_added is not None:
+            return upload_id
+        return None
+    return None
+
+
+def _mark_unchanged(session: Session, upload: Upload, previous: Upload) -> None:
+    """Skip an identical resend: its prices were just seen again, so only last_seen_at moves (one UPDATE)."""
+    provider_name = extract_provider_name(upload.filename)
+    touched = session.execute(
+        update(ProductPrice)
+        .where(ProductPrice.provider_name == provider_name)
+        .values(last_seen_at=datetime.utcnow())
+    ).rowcount
+    upload.sheet_count = previous.sheet_count
+    upload.processed_rows = previous.processed_rows
+    print(f"[import] {upload.filename}: same content as upload {previous.id}, {touched} prices marked as seen")
+    _set_stage(session, upload, STAGE_UNCHANGED)
+
+
+async def run_import(items: List[ImportItem], session: Session, lease_lost: Optional[Event] = None) -> None:
+    """
+    Import spooled files one by one, then normalize the catalog once for all of them.
+    With IMPORT_PARSE_WORKERS > 1 the sheets of every file are parsed ahead in the process pool
+    while this thread writes them in order.
+    A file identical to its provider's last upload is not parsed again unless forced.
+    A failing file is marked failed with its error and does not stop the others; a lost
+    database connection (OperationalError) is raised instead, so a queued job can be retried.
+    A queue worker passes `lease_lost`: once it is set, the import stops (ImportAborted) without
+    committing anything else, since the job's uploads belong to the worker that reclaimed it.
+    """
+    started_at = datetime.utcnow()
+    imported: List[Upload] = []
+    changed: List[ImportItem] = []
+    for item in items:
+        upload = session.get(Upload, item.upload_id)
+        previous = None if item.force or upload is None else _previous_import(session, upload)
+        if previous is not None:
+            _mark_unchanged(session, upload, previous)
         else:
-            wb = load_workbook(BytesIO(content), data_only=True)
-            for ws in wb.worksheets:
-                total_sheets += 1
-                rows = list(ws.iter_rows(values_only=True))
-                if not rows:
-                    continue
-                header_row_idx = find_header_row([list(r) for r in rows[:20]])
-                headers = [str(h).strip() if h is not None else None for h in rows[header_row_idx]]
-                mapping = _infer_columns(headers)
-
-                print(f"[IMPORT] Sheet={ws.title}, Headers={headers[:10]}")
-                print(f"[IMPORT] Detected columns: name={mapping['name']}, price={mapping['price']}, sku={mapping['sku']}, currency={mapping['currency']}")
-
-                if mapping["price"] is None or mapping["name"] is None:
-                    sample_rows = [list(r) for r in rows[header_row_idx + 1: min(len(rows), header_row_idx + 61)]]
-                    price_c, name_c = choose_price_and_name(headers, sample_rows)
-                    if mapping["price"] is None:
-                        mapping["price"] = price_c
-                    if mapping["name"] is None:
-                        mapping["name"] = name_c
-                name_col = mapping["name"]
-                price_col = mapping["price"]
-                sku_col = mapping["sku"]
-                currency_col = mapping["currency"]
-
-                header_index = {h: i for i, h in enumerate(headers) if h is not None}
-
-                for row in rows[header_row_idx + 1:]:
-                    try:
-                        if name_col is None or price_col is None:
-                            continue
-                        name_idx = header_index.get(name_col)
-                        price_idx = header_index.get(price_col)
-                        if name_idx is None or price_idx is None:
-                            continue
-                        name_cell = row[name_idx] if name_idx < len(row) else None
-                        price_cell = row[price_idx] if price_idx < len(row) else None
-                        if name_cell is None or str(name_cell).strip() in ("", "nan", "None"):
-                            continue
-                        if price_cell is None:
-                            continue
-                        price_float = try_parse_price(price_cell)
-                        if price_float is None:
-                            continue
-
-                        sku_val = None
-                        if sku_col is not None and header_index.get(sku_col) is not None:
-                            sku_idx = header_index[sku_col]
-                            if sku_idx < len(row) and row[sku_idx] is not None:
-                                sku_val = str(row[sku_idx]).strip()
-
-                        currency_val = "ARS"
-                        if currency_col is not None and header_index.get(currency_col) is not None:
-                            cur_idx = header_index[currency_col]
-                            if cur_idx < len(row) and row[cur_idx] is not None:
-                                currency_val = str(row[cur_idx]).strip() or "ARS"
-
-                        name_val = str(name_cell).strip()
-                        _process_product_row(
-                            name_val=name_val,
-                            price_float=price_float,
-                            sku_val=sku_val,
-                            currency_val=currency_val,
-                            upload_id=upload.id,
-                            provider_name=provider_name,
-                            session=session,
-                        )
-                        total_rows += 1
-                    except Exception:
-                        continue
-                session.commit()
-
-        upload.sheet_count = total_sheets
-        upload.processed_rows = total_rows
-        session.add(upload)
-        session.commit()
+            changed.append(item)
 
-    normalize_catalog(session)
+    pool = get_parse_pool() if changed else None
+    prefetch = _SheetPrefetch(pool, changed, window=2 * get_settings().import_parse_workers) if pool is not None else None
+    try:
+        for item in changed:
+            try:
+                imported.append(await _import_file(item, session, prefetch, lease_lost))
+            except (OperationalError, ImportAborted):
+                session.rollback()
+                raise
+            except Exception as e:
+                session.rollback()
+                if prefetch is not None:
+                    prefetch.discard(item.upload_id)
+                print(f"[import] {item.filename} failed: {e}")
+                upload = session.get(Upload, item.upload_id)
+                if upload is not None:
+                    _set_stage(session, upload, STAGE_FAILED, error=str(e) or type(e).__name__)
+    finally:
+        if prefetch is not None:
+            prefetch.discard()
+    if not imported:
+        return
+
+    for upload in imported:
+        upload.status = STAGE_NORMALIZING
+        report_progress(upload.id, stage=STAGE_NORMALIZING)
+    _check_lease(lease_lost)
     session.commit()
-    print("[import] completed uploads:", len(files))
+    try:
+        normalize_catalog(session)
+        rollup_price_history(session, since=started_at)
+        prune_changes(session)
+        _check_lease(lease_lost)
+        session.commit()
+    except (OperationalError, ImportAborted):
+        session.rollback()
+        raise
+    except Exception as e:
+        session.rollback()
+        print(f"[import] catalog normalization failed: {e}")
+        for upload in imported:
+            _set_stage(session, upload, STAGE_FAILED, error=f"Unificación del catálogo: {e}")
+        return
+    for upload in imported:
+        _set_stage(session, upload, STAGE_DONE)
+    print("[import] completed uploads:", len(imported))
+    # Prices changed: recompute the popular queries for the new catalog generation
+    schedule_warm_up("import")
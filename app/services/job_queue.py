@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import ImportJob, ImportJobChunk, Upload
+from .import_progress import FINISHED_STAGES
+from .importer import ImportItem, fail_unfinished_uploads
+from .upload_spool import SPOOL_CHUNK_SIZE
+
+
+# ImportJob.status values
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# A failed attempt waits attempts × this many seconds before it can be claimed again
+RETRY_BACKOFF_SECONDS = 30
+
+
+def enqueue_job(session: Session, uploads: Sequence[Upload], paths: Sequence[str], force: bool = False) -> ImportJob:
+    """
+    Queue the spooled files for the worker, copying each one into import_job_chunks in
+    SPOOL_CHUNK_SIZE pieces (the worker may run on another machine). Flushes, does not commit.
+    """
+    job = ImportJob(status=JOB_QUEUED, max_attempts=max(1, get_settings().import_max_attempts), force=force)
+    session.add(job)
+    session.flush()
+    for upload, path in zip(uploads, paths):
+        upload.job_id = job.id
+        with open(path, "rb") as fh:
+            seq = 0
+            while True:
+                data = fh.read(SPOOL_CHUNK_SIZE)
+                if not data:
+                    break
+                # Core insert: the chunk is sent right away and never kept in the session
+                session.execute(insert(ImportJobChunk).values(job_id=job.id, upload_id=upload.id, seq=seq, data=data))
+                seq += 1
+    session.flush()
+    return job
+
+
+def _fail_exhausted_jobs(session: Session, now: datetime) -> None:
+    """Running jobs whose lease expired on their last attempt are given up, with their uploads."""
+    lease_expired = now - timedelta(seconds=get_settings().import_lease_seconds)
+    exhausted = session.execute(
+        select(ImportJob.id).where(
+            ImportJob.status == JOB_RUNNING,
+            ImportJob.heartbeat_at < lease_expired,
+            ImportJob.attempts >= ImportJob.max_attempts,
+        )
+    ).scalars().all()
+    for job_id in exhausted:
+        # Re-checked in the UPDATE: the owner may have renewed its lease or finished meanwhile
+        _finish_job(
+            session, job_id, JOB_FAILED, ImportJob.heartbeat_at < lease_expired,
+            error="El proceso de importación dejó de responder",
+        )
+
+
+def claim_job(session: Session, worker_id: str) -> Optional[ImportJob]:
+    """
+    Lease the oldest claimable job for `worker_id`: queued and past its backoff, or running
+    with an expired lease (its worker died). Returns None when there is nothing to do.
+
+    Postgres skips rows other workers hold (FOR UPDATE SKIP LOCKED); SQLite ignores the
+    clause, so the claim itself is a compare-and-set UPDATE that only one worker can win.
+    """
+    now = datetime.utcnow()
+    _fail_exhausted_jobs(session, now)
+    lease_expired = now - timedelta(seconds=get_settings().import_lease_seconds)
+    claimable = or_(
+        and_(ImportJob.status == JOB_QUEUED, ImportJob.available_at <= now),
+        and_(
+            ImportJob.status == JOB_RUNNING,
+            ImportJob.heartbeat_at < lease_expired,
+            ImportJob.attempts < ImportJob.max_attempts,
+        ),
+    )
+    candidate = session.execute(
+        select(ImportJob.id, ImportJob.status, ImportJob.attempts)
+        .where(claimable)
+        .order_by(ImportJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if candidate is None:
+        session.commit()
+        return None
+
+    claimed = session.execute(
+        update(ImportJob)
+        .where(
+            ImportJob.id == candidate.id,
+            ImportJob.status == candidate.status,
+            ImportJob.attempts == candidate.attempts,
+        )
+        .values(
+            status=JOB_RUNNING,
+            attempts=candidate.attempts + 1,
+            worker_id=worker_id,
+            started_at=now,
+            heartbeat_at=now,
+        )
+    ).rowcount
+    session.commit()
+    if claimed != 1:
+        return None
+    return session.get(ImportJob, candidate.id)
+
+
+def heartbeat(session: Session, job_id: int, worker_id: str) -> bool:
+    """Extend the lease; False when the job is no longer ours (it expired and was reclaimed)."""
+    renewed = session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job_id, ImportJob.status == JOB_RUNNING, ImportJob.worker_id == worker_id)
+        .values(heartbeat_at=datetime.utcnow())
+    ).rowcount
+    session.commit()
+    return renewed == 1
+
+
+def _finish_job(session: Session, job_id: int, status: str, *owned, error: Optional[str] = None) -> bool:
+    """
+    Close a running job that still matches `owned` (e.g. its worker_id). False, touching nothing,
+    when it does not: the lease expired and another worker reclaimed the job, so its chunks and
+    uploads belong to that worker now.
+    """
+    finished = session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job_id, ImportJob.status == JOB_RUNNING, *owned)
+        .values(status=status, finished_at=datetime.utcnow(), last_error=error[:2000] if error else None)
+    ).rowcount
+    if finished != 1:
+        session.commit()
+        return False
+    # The file bytes are only needed while the job can still run
+    session.execute(delete(ImportJobChunk).where(ImportJobChunk.job_id == job_id))
+    if status == JOB_FAILED:
+        upload_ids = session.execute(select(Upload.id).where(Upload.job_id == job_id)).scalars().all()
+        fail_unfinished_uploads(session, upload_ids, error or "Error de importación")
+    session.commit()
+    return True
+
+
+def complete_job(session: Session, job: ImportJob, worker_id: str) -> bool:
+    """Mark `worker_id`'s job done; False when it no longer held the lease."""
+    return _finish_job(session, job.id, JOB_DONE, ImportJob.worker_id == worker_id)
+
+
+def fail_job(session: Session, job: ImportJob, worker_id: str, error: str) -> bool:
+    """
+    Requeue `worker_id`'s job with a backoff, or give up (failing its uploads) after max_attempts.
+    False when it no longer held the lease.
+    """
+    if job.attempts >= job.max_attempts:
+        return _finish_job(session, job.id, JOB_FAILED, ImportJob.worker_id == worker_id, error=error)
+    requeued = session.execute(
+        update(ImportJob)
+        .where(ImportJob.id == job.id, ImportJob.status == JOB_RUNNING, ImportJob.worker_id == worker_id)
+        .values(
+            status=JOB_QUEUED,
+            worker_id=None,
+            last_error=error[:2000],
+            available_at=datetime.utcnow() + timedelta(seconds=RETRY_BACKOFF_SECONDS * job.attempts),
+        )
+    ).rowcount
+    session.commit()
+    return requeued == 1
+
+
+def restore_job_files(session: Session, job: ImportJob, directory: str) -> List[ImportItem]:
+    """
+    Write the job's files back to `directory`, one chunk in memory at a time. Uploads an
+    earlier attempt already finished (done, failed or unchanged) are left out of a retry.
+    """
+    uploads = session.execute(
+        select(Upload).where(Upload.job_id == job.id).order_by(Upload.id)
+    ).scalars().all()
+    items: List[ImportItem] = []
+    for upload in uploads:
+        if upload.status in FINISHED_STAGES:
+            continue
+        suffix = os.path.splitext(upload.filename or "")[1].lower()
+        path = os.path.join(directory, f"upload-{upload.id}{suffix}")
+        chunk_ids = session.execute(
+            select(ImportJobChunk.id)
+            .where(ImportJobChunk.job_id == job.id, ImportJobChunk.upload_id == upload.id)
+            .order_by(ImportJobChunk.seq)
+        ).scalars().all()
+        with open(path, "wb") as out:
+            for chunk_id in chunk_ids:
+                out.write(session.execute(
+                    select(ImportJobChunk.data).where(ImportJobChunk.id == chunk_id)
+                ).scalar_one())
+        items.append(ImportItem(upload.id, upload.filename, path, force=job.force))
+    return items
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from ..config import get_settings
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    The process pool that parses sheets for imports, created on first use and shared by every
+    import in this process; None when IMPORT_PARSE_WORKERS is 1 (parse in the importing thread).
+    """
+    global _pool
+    workers = get_settings().import_parse_workers
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the web process has live threads and DB connections a fork would copy
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_parse_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
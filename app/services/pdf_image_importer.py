@@ -1,18 +1,19 @@
 from datetime import datetime
 from typing import List, Optional
 import json
-import io
 import os
 
 from PIL import Image
 import pytesseract
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_path, pdfinfo_from_path
 from openai import OpenAI
 from sqlalchemy.orm import Session
 
 from ..config import get_settings
 from ..models import Product, ProductPrice
 from ..utils.text import normalize_text
+from .change_feed import record_change
+from .price_history import build_history_entry, history_key
 from sqlalchemy import select
 
 # Ensure Tesseract knows where to find language data on common macOS setups.
@@ -79,34 +80,37 @@ TEXTO OCR A PROCESAR:
 Ahora devuelve el JSON con los productos encontrados:"""
 
 
-async def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+async def extract_text_from_pdf(pdf_path: str) -> str:
     """
     Extract text from PDF using OCR.
     Converts PDF pages to images and applies pytesseract.
     """
     try:
-        # Convert PDF to images (one per page)
-        images = convert_from_bytes(pdf_bytes, dpi=300)
-        
+        # Rasterize one page at a time: a 300 dpi page is tens of MB, a whole scanned list is not affordable
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+
         # OCR each page
         full_text = ""
-        for i, img in enumerate(images):
-            page_text = run_ocr_on_image(img)
-            full_text += f"\n--- Página {i+1} ---\n{page_text}"
-        
+        for page in range(1, page_count + 1):
+            images = convert_from_path(pdf_path, dpi=300, first_page=page, last_page=page)
+            for img in images:
+                page_text = run_ocr_on_image(img)
+                full_text += f"\n--- Página {page} ---\n{page_text}"
+                img.close()
+
         return full_text.strip()
     except Exception as e:
         print(f"[PDF OCR] Error: {e}")
         return ""
 
 
-def extract_text_from_image(image_bytes: bytes) -> str:
+def extract_text_from_image(image_path: str) -> str:
     """
     Extract text from image (JPEG, PNG, etc.) using OCR.
     """
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        text = run_ocr_on_image(img)
+        with Image.open(image_path) as img:
+            text = run_ocr_on_image(img)
         return text.strip()
     except Exception as e:
         print(f"[Image OCR] Error: {e}")
@@ -395,24 +399,25 @@ def parse_prices_hybrid(ocr_text: str, provider_name: str) -> List[dict]:
 
 
 async def import_pdf_or_image(
-    file_bytes: bytes,
+    file_path: str,
     filename: str,
     upload_id: int,
     provider_name: str,
     session: Session,
+    history_entries: Optional[List[dict]] = None,
 ) -> int:
     """
     Import products from PDF or image file using OCR + GPT-4.
-    Returns number of products imported.
+    Returns number of products imported; price_history entries are appended to `history_entries`.
     """
     
     # Step 1: OCR - Extract text from file
     print(f"[OCR] Processing {filename}...")
     
     if filename.lower().endswith('.pdf'):
-        ocr_text = await extract_text_from_pdf(file_bytes)
+        ocr_text = await extract_text_from_pdf(file_path)
     else:
-        ocr_text = extract_text_from_image(file_bytes)
+        ocr_text = extract_text_from_image(file_path)
     
     if not ocr_text or len(ocr_text) < 50:
         print(f"[OCR] Warning: Extracted text too short ({len(ocr_text)} chars). Possible OCR failure.")
@@ -477,11 +482,14 @@ async def import_pdf_or_image(
                 )
                 session.add(product)
                 session.flush()
+                record_change(session, "product", product, "insert")
             else:
                 product.updated_at = now
                 session.add(product)
             
-            # Find or create ProductPrice for this provider
+            # Find or create ProductPrice for this provider; flush first so a price added
+            # earlier in this file is found ((product_id, provider_name) is unique)
+            session.flush()
             existing_price = session.execute(
                 select(ProductPrice).where(
                     ProductPrice.product_id == product.id,
@@ -497,6 +505,7 @@ async def import_pdf_or_image(
                 existing_price.last_seen_at = now
                 existing_price.updated_at = now
                 session.add(existing_price)
+                record_change(session, "price", existing_price, "update")
             else:
                 new_price = ProductPrice(
                     product_id=product.id,
@@ -510,6 +519,18 @@ async def import_pdf_or_image(
                     updated_at=now,
                 )
                 session.add(new_price)
+                record_change(session, "price", new_price, "insert")
+
+            if history_entries is not None:
+                history_entries.append(build_history_entry(
+                    canonical_key=history_key(product.canonical_key, norm_name),
+                    product_id=product.id,
+                    provider_name=provider_name,
+                    unit_price=price_float,
+                    currency=moneda,
+                    upload_id=upload_id,
+                    recorded_at=now,
+                ))
             
             imported_count += 1
             
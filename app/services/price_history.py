@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import PriceHistory, PriceHistoryRollup
+
+
+# Spans up to these many days are answered from raw rows / daily rollups; longer ones from monthly rollups
+_RAW_SPAN_DAYS = 31
+_DAILY_SPAN_DAYS = 400
+
+
+def history_key(canonical_key: Optional[str], normalized_name: str) -> str:
+    """Series key used by price_history: the canonical key, or the normalized name when unmatched."""
+    return canonical_key or normalized_name
+
+
+def build_history_entry(
+    *,
+    canonical_key: str,
+    product_id: Optional[int],
+    provider_name: str,
+    unit_price: float,
+    currency: str,
+    upload_id: Optional[int],
+    recorded_at: datetime,
+) -> dict:
+    return {
+        "canonical_key": canonical_key[:128],
+        "product_id": product_id,
+        "provider_name": provider_name,
+        "unit_price": round(float(unit_price), 2),
+        "currency": currency or "ARS",
+        "upload_id": upload_id,
+        "recorded_at": recorded_at,
+    }
+
+
+def record_price_history(session: Session, entries: List[dict]) -> int:
+    """Append history rows in a single bulk INSERT."""
+    if not entries:
+        return 0
+    session.execute(insert(PriceHistory), entries)
+    return len(entries)
+
+
+def _day_start(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _month_start(value: datetime) -> datetime:
+    return _day_start(value).replace(day=1)
+
+
+def rollup_price_history(session: Session, since: Optional[datetime] = None) -> None:
+    """
+    Recompute daily/monthly rollups from `since` onwards and prune expired rows.
+
+    Daily buckets are built from raw rows and monthly buckets from daily ones, so raw
+    history can be dropped after `price_history_raw_days` without losing the long-term series.
+    """
+    settings = get_settings()
+    now = datetime.utcnow()
+    raw_cutoff = _day_start(now - timedelta(days=settings.price_history_raw_days))
+    daily_cutoff = _day_start(now - timedelta(days=settings.price_history_daily_days))
+
+    if since is None:
+        since = session.execute(
+            select(func.max(PriceHistoryRollup.bucket_start)).where(PriceHistoryRollup.granularity == "day")
+        ).scalar()
+        if since is None:
+            since = session.execute(select(func.min(PriceHistory.recorded_at))).scalar()
+        if since is None:
+            return
+    # Days older than the raw retention cannot be rebuilt, keep their rollups untouched
+    day_start = max(_day_start(since), raw_cutoff)
+
+    daily: Dict[Tuple[str, str, datetime], dict] = {}
+    raw_rows = session.execute(
+        select(
+            PriceHistory.canonical_key,
+            PriceHistory.provider_name,
+            PriceHistory.unit_price,
+            PriceHistory.recorded_at,
+        )
+        .where(PriceHistory.recorded_at >= day_start)
+        .order_by(PriceHistory.recorded_at.asc(), PriceHistory.id.asc())
+        .execution_options(yield_per=5000)
+    )
+    for key, provider, price, recorded_at in raw_rows:
+        price = float(price)
+        bucket = daily.get((key, provider, _day_start(recorded_at)))
+        if bucket is None:
+            daily[(key, provider, _day_start(recorded_at))] = {
+                "min_price": price,
+                "max_price": price,
+                "last_price": price,
+                "last_seen_at": recorded_at,
+                "samples": 1,
+            }
+            continue
+        bucket["min_price"] = min(bucket["min_price"], price)
+        bucket["max_price"] = max(bucket["max_price"], price)
+        bucket["last_price"] = price
+        bucket["last_seen_at"] = recorded_at
+        bucket["samples"] += 1
+
+    session.execute(
+        delete(PriceHistoryRollup).where(
+            PriceHistoryRollup.granularity == "day",
+            PriceHistoryRollup.bucket_start >= day_start,
+        )
+    )
+    if daily:
+        session.execute(
+            insert(PriceHistoryRollup),
+            [
+                {"granularity": "day", "canonical_key": key, "provider_name": provider, "bucket_start": bucket_start, **values}
+                for (key, provider, bucket_start), values in daily.items()
+            ],
+        )
+
+    month_start = _month_start(day_start)
+    monthly: Dict[Tuple[str, str, datetime], dict] = {}
+    day_rows = session.execute(
+        select(PriceHistoryRollup)
+        .where(
+            PriceHistoryRollup.granularity == "day",
+            PriceHistoryRollup.bucket_start >= month_start,
+        )
+        .order_by(PriceHistoryRollup.bucket_start.asc())
+    ).scalars()
+    for day in day_rows:
+        group = (day.canonical_key, day.provider_name, _month_start(day.bucket_start))
+        bucket = monthly.get(group)
+        if bucket is None:
+            monthly[group] = {
+                "min_price": float(day.min_price),
+                "max_price": float(day.max_price),
+                "last_price": float(day.last_price),
+                "last_seen_at": day.last_seen_at,
+                "samples": day.samples,
+            }
+            continue
+        bucket["min_price"] = min(bucket["min_price"], float(day.min_price))
+        bucket["max_price"] = max(bucket["max_price"], float(day.max_price))
+        bucket["last_price"] = float(day.last_price)
+        bucket["last_seen_at"] = day.last_seen_at
+        bucket["samples"] += day.samples
+
+    # Only months still fully covered by daily rollups are rebuilt
+    rebuild_from = month_start
+    if rebuild_from < daily_cutoff:
+        rebuild_from = _month_start(_month_start(daily_cutoff) + timedelta(days=32))
+    session.execute(
+        delete(PriceHistoryRollup).where(
+            PriceHistoryRollup.granularity == "month",
+            PriceHistoryRollup.bucket_start >= rebuild_from,
+        )
+    )
+    monthly_rows = [
+        {"granularity": "month", "canonical_key": key, "provider_name": provider, "bucket_start": bucket_start, **values}
+        for (key, provider, bucket_start), values in monthly.items()
+        if bucket_start >= rebuild_from
+    ]
+    if monthly_rows:
+        session.execute(insert(PriceHistoryRollup), monthly_rows)
+
+    # Bound storage: raw rows and daily buckets expire, monthly buckets stay
+    session.execute(delete(PriceHistory).where(PriceHistory.recorded_at < raw_cutoff))
+    session.execute(
+        delete(PriceHistoryRollup).where(
+            PriceHistoryRollup.granularity == "day",
+            PriceHistoryRollup.bucket_start < daily_cutoff,
+        )
+    )
+    session.flush()
+
+
+def get_price_history(
+    session: Session,
+    canonical_key: str,
+    *,
+    since: datetime,
+    granularity: str = "auto",
+) -> List[dict]:
+    """Return the price series for a canonical key, picking the coarsest table that fits the span."""
+    if granularity == "auto":
+        span_days = (datetime.utcnow() - since).days
+        if span_days <= _RAW_SPAN_DAYS:
+            granularity = "raw"
+        elif span_days <= _DAILY_SPAN_DAYS:
+            granularity = "day"
+        else:
+            granularity = "month"
+
+    if granularity == "raw":
+        rows = session.execute(
+            select(PriceHistory.recorded_at, PriceHistory.provider_name, PriceHistory.unit_price)
+            .where(PriceHistory.canonical_key == canonical_key, PriceHistory.recorded_at >= since)
+            .order_by(PriceHistory.recorded_at.asc(), PriceHistory.id.asc())
+        ).all()
+        return [
+            {
+                "at": recorded_at.isoformat(),
+                "provider_name": provider,
+                "min": float(price),
+                "max": float(price),
+                "last": float(price),
+                "samples": 1,
+            }
+            for recorded_at, provider, price in rows
+        ]
+
+    bucket_since = _day_start(since) if granularity == "day" else _month_start(since)
+    rollups = session.execute(
+        select(PriceHistoryRollup)
+        .where(
+            PriceHistoryRollup.canonical_key == canonical_key,
+            PriceHistoryRollup.granularity == granularity,
+            PriceHistoryRollup.bucket_start >= bucket_since,
+        )
+        .order_by(PriceHistoryRollup.bucket_start.asc(), PriceHistoryRollup.provider_name.asc())
+    ).scalars()
+    return [
+        {
+            "at": r.bucket_start.isoformat(),
+            "provider_name": r.provider_name,
+            "min": float(r.min_price),
+            "max": float(r.max_price),
+            "last": float(r.last_price),
+            "samples": r.samples,
+        }
+        for r in rollups
+    ]
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import String, cast, func, literal, select
+from sqlalchemy.orm import Session
+
+from ..models import Product, ProductPrice
+from ..utils.formatting import format_ars
+from ..utils.text import normalize_text
+from .variant_resolver import BEST_PRICE_TOLERANCE
+
+
+@dataclass
+class PriceMatrix:
+    """Canonical product × provider grid of final prices (NaN where a provider has no offer)."""
+    keys: List[str]
+    labels: List[str]
+    providers: List[str]
+    base: np.ndarray
+    final: np.ndarray
+    best_price: np.ndarray
+    best_mask: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def _grouping_key():
+    # Same grouping as /search: canonical key of the price, then of the product, then the product itself
+    return func.coalesce(
+        ProductPrice.canonical_key,
+        Product.canonical_key,
+        literal("product-") + cast(Product.id, String),
+    )
+
+
+def build_price_matrix(
+    session: Session,
+    *,
+    iva: float,
+    iibb: float,
+    profit: float,
+    query: Optional[str] = None,
+) -> PriceMatrix:
+    """
+    Build the matrix with one GROUP BY query and a NumPy pivot.
+
+    Per (key, provider) the lowest base price wins, which is what collect_variant_offers picks
+    since the multipliers are the same for every provider; best offers use its tolerance.
+    """
+    key_expr = _grouping_key()
+    stmt = (
+        select(
+            key_expr,
+            ProductPrice.provider_name,
+            func.min(ProductPrice.unit_price),
+            func.min(func.coalesce(Product.display_name, Product.name)),
+        )
+        .join(Product, Product.id == ProductPrice.product_id)
+        .where(ProductPrice.unit_price.isnot(None))
+        .group_by(key_expr, ProductPrice.provider_name)
+    )
+
+    key_index: Dict[str, int] = {}
+    provider_index: Dict[str, int] = {}
+    labels: List[str] = []
+    row_idx = array("q")
+    col_idx = array("q")
+    prices = array("d")
+
+    norm_query = normalize_text(query) if query else ""
+    query_tokens = [t for t in norm_query.split(" ") if t]
+
+    result = session.execute(stmt.execution_options(yield_per=10000))
+    for key, provider_name, unit_price, label in result:
+        label = label or key
+        if query_tokens:
+            haystack = f"{normalize_text(label)} {key}"
+            if not all(tok in haystack for tok in query_tokens):
+                continue
+        provider = (provider_name or "Proveedor desconocido").strip() or "Proveedor desconocido"
+        r = key_index.get(key)
+        if r is None:
+            r = key_index[key] = len(labels)
+            labels.append(label)
+        elif label < labels[r]:
+            labels[r] = label
+        c = provider_index.get(provider)
+        if c is None:
+            c = provider_index[provider] = len(provider_index)
+        row_idx.append(r)
+        col_idx.append(c)
+        prices.append(float(unit_price))
+
+    keys = list(key_index)
+    providers = list(provider_index)
+    base = np.full((len(keys), len(providers)), np.nan)
+    if prices:
+        # Provider names that only differ in surrounding spaces collapse into one column
+        np.fmin.at(
+            base,
+            (np.frombuffer(row_idx, dtype=np.int64), np.frombuffer(col_idx, dtype=np.int64)),
+            np.frombuffer(prices, dtype=np.float64),
+        )
+
+    # Sort rows by label and columns by provider name
+    row_order = np.array(sorted(range(len(keys)), key=lambda i: labels[i].lower()), dtype=np.int64)
+    col_order = np.array(sorted(range(len(providers)), key=lambda i: providers[i].lower()), dtype=np.int64)
+    if len(keys) and len(providers):
+        base = base[row_order][:, col_order]
+    keys = [keys[i] for i in row_order]
+    labels = [labels[i] for i in row_order]
+    providers = [providers[i] for i in col_order]
+
+    final = np.round(base * float(iva) * float(iibb) * float(profit), 2)
+    if final.size:
+        best_price = np.nanmin(final, axis=1)
+        best_mask = np.abs(final - best_price[:, None]) <= BEST_PRICE_TOLERANCE
+    else:
+        best_price = np.full(len(keys), np.nan)
+        best_mask = np.zeros(final.shape, dtype=bool)
+
+    return PriceMatrix(
+        keys=keys,
+        labels=labels,
+        providers=providers,
+        base=base,
+        final=final,
+        best_price=best_price,
+        best_mask=best_mask,
+    )
+
+
+def matrix_rows(matrix: PriceMatrix, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """Yield one view row per product, formatting only the requested slice."""
+    stop = len(matrix) if stop is None else min(stop, len(matrix))
+    for i in range(start, stop):
+        cells = []
+        for j in range(len(matrix.providers)):
+            value = matrix.final[i, j]
+            if np.isnan(value):
+                cells.append(None)
+                continue
+            cells.append({
+                "unit_price": float(matrix.base[i, j]),
+                "final_price": float(value),
+                "final_price_fmt": format_ars(value),
+                "is_best": bool(matrix.best_mask[i, j]),
+            })
+        yield {
+            "key": matrix.keys[i],
+            "name": matrix.labels[i],
+            "best_price": float(matrix.best_price[i]),
+            "best_price_fmt": format_ars(matrix.best_price[i]),
+            "best_providers": [matrix.providers[j] for j in np.flatnonzero(matrix.best_mask[i])],
+            "cells": cells,
+        }
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..db import get_session
+from ..models import QueryStat
+from .suggest_cache import cache_key
+
+
+FLUSH_INTERVAL_SECONDS = 30.0
+MAX_QUERY_LENGTH = 255
+
+_lock = threading.Lock()
+_pending: Counter = Counter()
+_last_seen: Dict[Tuple[str, str], datetime] = {}
+_flusher: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def record_query(kind: str, q: Optional[str]) -> None:
+    """Count a query in memory; the background flusher writes the totals in batches."""
+    key = cache_key(q or "")
+    if len(key) < 2:
+        return
+    key = key[:MAX_QUERY_LENGTH]
+    with _lock:
+        _pending[(kind, key)] += 1
+        _last_seen[(kind, key)] = datetime.utcnow()
+
+
+def flush_query_stats() -> int:
+    """Add the buffered counts to query_stats; returns how many distinct queries were written."""
+    with _lock:
+        if not _pending:
+            return 0
+        pending = dict(_pending)
+        last_seen = dict(_last_seen)
+        _pending.clear()
+        _last_seen.clear()
+
+    try:
+        with get_session() as session:
+            for kind in {k for k, _ in pending}:
+                queries = [q for k, q in pending if k == kind]
+                existing = {
+                    row.query: row
+                    for row in session.execute(
+                        select(QueryStat).where(QueryStat.kind == kind, QueryStat.query.in_(queries))
+                    ).scalars()
+                }
+                for q in queries:
+                    row = existing.get(q)
+                    if row is None:
+                        session.add(QueryStat(kind=kind, query=q, count=pending[(kind, q)], last_seen_at=last_seen[(kind, q)]))
+                    else:
+                        row.count += pending[(kind, q)]
+                        row.last_seen_at = max(row.last_seen_at, last_seen[(kind, q)])
+    except Exception as e:
+        # Stats are best-effort: put the counts back and retry on the next flush
+        print(f"[STATS] Could not flush query stats: {e}")
+        with _lock:
+            _pending.update(pending)
+            for key, seen in last_seen.items():
+                _last_seen[key] = max(_last_seen.get(key, seen), seen)
+        return 0
+    return len(pending)
+
+
+def _flush_loop() -> None:
+    while not _stop.wait(FLUSH_INTERVAL_SECONDS):
+        flush_query_stats()
+
+
+def start_query_stats_flusher() -> None:
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    _stop.clear()
+    _flusher = threading.Thread(target=_flush_loop, name="query-stats-flusher", daemon=True)
+    _flusher.start()
+
+
+def stop_query_stats_flusher() -> None:
+    _stop.set()
+    flush_query_stats()
+
+
+def top_queries(session: Session, kind: str, limit: int) -> List[str]:
+    return list(
+        session.execute(
+            select(QueryStat.query)
+            .where(QueryStat.kind == kind)
+            .order_by(QueryStat.count.desc(), QueryStat.last_seen_at.desc())
+            .limit(limit)
+        ).scalars()
+    )
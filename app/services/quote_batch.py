@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import csv
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from openpyxl import load_workbook
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, joinedload
+from xlrd import open_workbook
+
+from ..models import Product, ProductPrice
+from ..utils.text import normalize_text
+from .importer import find_header_row, try_parse_price
+from .search import FuzzyCandidatePool, search_products
+from .variant_resolver import ProviderOffer, build_provider_offers, merge_price_sources, resolve_variant_lookup
+
+
+MAX_QUOTE_LINES = 1000
+
+# "3 x matafuego", "3x matafuego", "10 manguera..." but not "2 1/2 valvula" (a size, not a quantity)
+_LEADING_QTY_RE = re.compile(r"^(\d+(?:[.,]\d+)?)\s*(?:x|u|un|unid|unidades)?\s+(?![\d/])(.+)$", re.IGNORECASE)
+_TRAILING_QTY_RE = re.compile(r"^(.+?)\s+(?:x\s*)?(\d+(?:[.,]\d+)?)\s*(?:u|un|unid|unidades)$", re.IGNORECASE)
+
+_QUANTITY_HEADERS = {"cantidad", "cant", "cant.", "qty", "unidades", "quantity"}
+_DESCRIPTION_HEADERS = {"producto", "descripcion", "descripción", "detalle", "articulo", "artículo", "item", "nombre"}
+
+
+@dataclass
+class QuoteLine:
+    text: str
+    quantity: float = 1.0
+
+
+@dataclass
+class QuoteLineResult:
+    line: QuoteLine
+    product: Optional[Product]
+    score: float
+    offers: List[ProviderOffer] = field(default_factory=list)
+
+    @property
+    def best_offer(self) -> Optional[ProviderOffer]:
+        return self.offers[0] if self.offers else None
+
+    @property
+    def line_total(self) -> Optional[float]:
+        if not self.offers:
+            return None
+        return round(self.offers[0].final_price * self.line.quantity, 2)
+
+
+def _parse_quantity(value) -> Optional[float]:
+    quantity = try_parse_price(value)
+    if quantity is None or quantity <= 0:
+        return None
+    return quantity
+
+
+def parse_quote_text(text: str) -> List[QuoteLine]:
+    """One line per item; an optional quantity may lead ("3 x ...") or trail ("... 3 u")."""
+    lines: List[QuoteLine] = []
+    for raw in (text or "").splitlines():
+        stripped = raw.strip(" \t-•*")
+        if not stripped:
+            continue
+        if "\t" in stripped:
+            # Pasted from a spreadsheet: description and quantity in separate cells
+            cells = [c.strip() for c in stripped.split("\t") if c.strip()]
+            quantity = next((q for q in (_parse_quantity(c) for c in cells) if q is not None), None)
+            description = max(cells, key=lambda c: sum(ch.isalpha() for ch in c))
+            lines.append(QuoteLine(text=description, quantity=quantity or 1.0))
+            continue
+        match = _LEADING_QTY_RE.match(stripped)
+        if match:
+            lines.append(QuoteLine(text=match.group(2).strip(), quantity=_parse_quantity(match.group(1)) or 1.0))
+            continue
+        match = _TRAILING_QTY_RE.match(stripped)
+        if match:
+            lines.append(QuoteLine(text=match.group(1).strip(), quantity=_parse_quantity(match.group(2)) or 1.0))
+            continue
+        lines.append(QuoteLine(text=stripped))
+    return lines[:MAX_QUOTE_LINES]
+
+
+def _lines_from_rows(rows: List[List[object]]) -> List[QuoteLine]:
+    if not rows:
+        return []
+    header_idx = find_header_row(rows[:20])
+    headers = [str(h).strip().lower() if h is not None else "" for h in rows[header_idx]]
+    qty_idx = next((i for i, h in enumerate(headers) if h in _QUANTITY_HEADERS), None)
+    desc_idx = next((i for i, h in enumerate(headers) if h in _DESCRIPTION_HEADERS), None)
+    if desc_idx is None:
+        # No recognizable header: treat every row as data and pick the most textual column
+        header_idx = -1
+        widths: Dict[int, int] = {}
+        for row in rows[:50]:
+            for i, cell in enumerate(row):
+                if cell is not None and any(ch.isalpha() for ch in str(cell)):
+                    widths[i] = widths.get(i, 0) + len(str(cell))
+        if not widths:
+            return []
+        desc_idx = max(widths, key=widths.get)
+
+    lines: List[QuoteLine] = []
+    for row in rows[header_idx + 1:]:
+        description = row[desc_idx] if desc_idx < len(row) else None
+        if description is None or not str(description).strip():
+            continue
+        quantity = None
+        if qty_idx is not None and qty_idx < len(row):
+            quantity = _parse_quantity(row[qty_idx])
+        lines.append(QuoteLine(text=str(description).strip(), quantity=quantity or 1.0))
+        if len(lines) >= MAX_QUOTE_LINES:
+            break
+    return lines
+
+
+class QuoteFileError(Exception):
+    """An attached quote file could not be read as a spreadsheet or CSV."""
+
+    def __init__(self, filename: str, reason: str) -> None:
+        super().__init__(f"No se pudo leer {filename}: {reason}")
+        self.filename = filename
+
+
+def _csv_dialect(text: str):
+    """The sniffed dialect; a one-column list has no delimiter to find, so it reads as plain CSV."""
+    if not text.strip():
+        return csv.excel
+    try:
+        return csv.Sniffer().sniff(text[:2048], delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+
+def parse_quote_file(filename: str, content: bytes) -> List[QuoteLine]:
+    """
+    Read quote lines from the first sheet of an .xlsx/.xls, or from a .csv/.txt file.
+    Raises QuoteFileError when the file cannot be parsed.
+    """
+    fname = (filename or "").lower()
+    try:
+        if fname.endswith(".xlsx"):
+            wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+            try:
+                rows = [list(r) for r in wb.worksheets[0].iter_rows(values_only=True, max_row=MAX_QUOTE_LINES + 20)]
+            finally:
+                wb.close()
+            return _lines_from_rows(rows)
+        if fname.endswith(".xls"):
+            book = open_workbook(file_contents=content, on_demand=True)
+            sheet = book.sheet_by_index(0)
+            rows = [sheet.row_values(r) for r in range(min(sheet.nrows, MAX_QUOTE_LINES + 20))]
+            book.release_resources()
+            return _lines_from_rows(rows)
+        text = content.decode("utf-8", errors="replace")
+        if fname.endswith(".csv"):
+            return _lines_from_rows([list(r) for r in csv.reader(io.StringIO(text), _csv_dialect(text))])
+        return parse_quote_text(text)
+    except Exception as e:
+        # Corrupt workbooks surface as zipfile/openpyxl/xlrd/csv errors alike
+        raise QuoteFileError(filename, str(e) or type(e).__name__) from e
+
+
+def resolve_quote_lines(
+    session: Session,
+    lines: List[QuoteLine],
+    *,
+    iva: float,
+    iibb: float,
+    profit: float,
+    search_limit: int = 40,
+    min_similarity: float = 65.0,
+) -> List[QuoteLineResult]:
+    """
+    Resolve many free-text lines at once: identical queries are searched once, the fuzzy
+    candidate pool is loaded once, and prices for every match come from a single query.
+    """
+    unique: Dict[str, str] = {}
+    for line in lines:
+        norm = normalize_text(line.text)
+        if norm and norm not in unique:
+            unique[norm] = line.text
+
+    candidate_pool = FuzzyCandidatePool()
+    matches: Dict[str, Tuple[Product, float, Optional[str], List[int]]] = {}
+    for norm, text in unique.items():
+        hits = search_products(query=text, session=session, limit=search_limit, candidate_pool=candidate_pool)
+        if not hits:
+            continue
+        product, score = max(hits, key=lambda hit: hit[1])
+        canonical_key, candidate_ids = resolve_variant_lookup(product, hits, min_similarity)
+        matches[norm] = (product, score, canonical_key, candidate_ids)
+
+    keys = {key for _, _, key, _ in matches.values() if key}
+    ids = {pid for _, _, key, pids in matches.values() if not key for pid in pids}
+    prices_by_key: Dict[str, List[ProductPrice]] = {}
+    prices_by_product: Dict[int, List[ProductPrice]] = {}
+    if keys or ids:
+        clauses = []
+        if keys:
+            clauses.append(ProductPrice.canonical_key.in_(keys))
+        if ids:
+            clauses.append(ProductPrice.product_id.in_(ids))
+        prices = (
+            session.query(ProductPrice)
+            .options(joinedload(ProductPrice.product))
+            .filter(or_(*clauses))
+            .order_by(ProductPrice.provider_name.asc(), ProductPrice.updated_at.desc())
+            .all()
+        )
+        for price in prices:
+            if price.canonical_key:
+                prices_by_key.setdefault(price.canonical_key, []).append(price)
+            prices_by_product.setdefault(price.product_id, []).append(price)
+
+    offers_by_query: Dict[str, List[ProviderOffer]] = {}
+    for norm, (product, _, canonical_key, candidate_ids) in matches.items():
+        if canonical_key:
+            related = prices_by_key.get(canonical_key, [])
+        else:
+            related = [price for pid in candidate_ids for price in prices_by_product.get(pid, [])]
+        related = merge_price_sources(product, related)
+        offers_by_query[norm] = build_provider_offers(related, iva=iva, iibb=iibb, profit=profit)
+
+    results: List[QuoteLineResult] = []
+    for line in lines:
+        norm = normalize_text(line.text)
+        match = matches.get(norm)
+        if match is None:
+            results.append(QuoteLineResult(line=line, product=None, score=0.0))
+            continue
+        product, score, _, _ = match
+        results.append(QuoteLineResult(line=line, product=product, score=score, offers=offers_by_query.get(norm, [])))
+    return results
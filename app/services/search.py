@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import text, and_, or_
 from rapidfuzz import fuzz, process
@@ -7,14 +7,67 @@ from ..models import Product
 from ..utils.text import normalize_text
 
 
-def search_products(query: str, session: Session, limit: int = 50) -> List[Tuple[Product, float]]:
+FUZZY_CANDIDATE_LIMIT = 5000
+STOPWORDS = {"de", "la", "el", "y", "a", "en", "para", "por", "del", "al", "los", "las", "un", "una", "unos", "unas"}
+
+
+def load_fuzzy_candidates(session: Session) -> List[Product]:
+    """Products scanned by the RapidFuzz fallback; load once to share across many queries."""
+    return (
+        session.query(Product)
+        .options(joinedload(Product.prices))
+        .order_by(Product.updated_at.desc())
+        .limit(FUZZY_CANDIDATE_LIMIT)
+        .all()
+    )
+
+
+class FuzzyCandidatePool:
+    """Candidate products for the fuzzy fallback, loaded on first use and shared across searches."""
+
+    def __init__(self) -> None:
+        self._products: Optional[List[Product]] = None
+
+    def get(self, session: Session) -> List[Product]:
+        if self._products is None:
+            self._products = load_fuzzy_candidates(session)
+        return self._products
+
+
+# Stage of search_products that produced the hits. Only "like_and" hits are a plain substring
+# match on every token, which is what the suggest cache relies on to narrow a prefix's results.
+STAGE_NONE = "none"
+STAGE_FTS = "fts"
+STAGE_LIKE_AND = "like_and"
+STAGE_LIKE_OR = "like_or"
+STAGE_FUZZY = "fuzzy"
+
+
+def search_products(
+    query: str,
+    session: Session,
+    limit: int = 50,
+    candidate_pool: Optional[FuzzyCandidatePool] = None,
+) -> List[Tuple[Product, float]]:
     """
     Search products by fuzzy matching on normalized name.
     Returns a list of (Product, score) tuples, sorted by relevance.
+    Batch callers pass a shared `candidate_pool` so the fuzzy fallback loads its pool only once.
     """
+    hits, _ = search_products_with_stage(query, session, limit=limit, candidate_pool=candidate_pool)
+    return hits
+
+
+def search_products_with_stage(
+    query: str,
+    session: Session,
+    limit: int = 50,
+    candidate_pool: Optional[FuzzyCandidatePool] = None,
+) -> Tuple[List[Tuple[Product, float]], str]:
+    """Same as search_products, also returning which stage matched (STAGE_*)."""
     norm_q = normalize_text(query)
     if not norm_q:
-        return []
+        return [], STAGE_NONE
 
     # Preserve special patterns before tokenization
     # Convert "s/sello" → "ssello", "c/sello" → "csello" to make them distinct
@@ -25,8 +78,7 @@ def search_products(query: str, session: Session, limit: int = 50) -> List[Tuple
     norm_q = norm_q.replace("con sello", "csello")
     
     # Tokenize and filter stopwords
-    stopwords = {"de", "la", "el", "y", "a", "en", "para", "por", "del", "al", "los", "las", "un", "una", "unos", "unas"}
-    tokens = [t for t in norm_q.split(" ") if t and t not in stopwords]
+    tokens = [t for t in norm_q.split(" ") if t and t not in STOPWORDS]
 
     raw_query = (query or "").lower()
     raw_no_slash = raw_query.replace("/", " ")
@@ -87,7 +139,7 @@ def search_products(query: str, session: Session, limit: int = 50) -> List[Tuple
                 .all()
             )
             if fts_results:
-                return [with_query_boost(p, 100.0) for p in fts_results]
+                return [with_query_boost(p, 100.0) for p in fts_results], STAGE_FTS
         except Exception as e:
             # Rollback on error to prevent transaction abort
             session.rollback()
@@ -106,7 +158,7 @@ def search_products(query: str, session: Session, limit: int = 50) -> List[Tuple
             .all()
         )
         if and_results:
-            return [with_query_boost(p, 100.0) for p in and_results]
+            return [with_query_boost(p, 100.0) for p in and_results], STAGE_LIKE_AND
 
     # 3. Fallback to LIKE with OR for any token (broader match)
     if match_tokens:
@@ -120,12 +172,15 @@ def search_products(query: str, session: Session, limit: int = 50) -> List[Tuple
             .all()
         )
         if or_results:
-            return [with_query_boost(p, 100.0) for p in or_results]
+            return [with_query_boost(p, 100.0) for p in or_results], STAGE_LIKE_OR
 
     # 4. Fallback to fuzzy search (RapidFuzz) if no direct matches
-    candidates = session.query(Product).options(joinedload(Product.prices)).order_by(Product.updated_at.desc()).limit(5000).all()
+    if candidate_pool is not None:
+        candidates = candidate_pool.get(session)
+    else:
+        candidates = load_fuzzy_candidates(session)
     if not candidates:
-        return []
+        return [], STAGE_NONE
 
     choices = {p.id: f"{p.normalized_name} {p.keywords or ''}" for p in candidates}
 
@@ -139,9 +194,10 @@ def search_products(query: str, session: Session, limit: int = 50) -> List[Tuple
 
     id_to_product = {p.id: p for p in candidates}
     output: List[Tuple[Product, float]] = []
-    for key, score, _ in results:
+    # With a dict of choices, extract() yields (choice, score, key)
+    for _, score, key in results:
         product = id_to_product.get(key)
         if product is not None:
             boosted_score = with_query_boost(product, float(score))
             output.append(boosted_score)
-    return output
+    return output, STAGE_FUZZY
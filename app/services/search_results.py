@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from cachetools import TTLCache
+from sqlalchemy.orm import Session, joinedload
+
+from ..config import get_settings
+from ..models import Product, ProductPrice
+from .catalog_state import current_generation
+from .search import search_products
+from .shared_cache import generation_key, get_shared_cache
+from .single_flight import search_flight
+from .suggest_cache import cache_key
+from .variant_resolver import build_provider_offers, collect_variant_prices
+
+
+@dataclass
+class ProductSnapshot:
+    """The product fields result_card.html and build_provider_offers read."""
+    id: int
+    name: str
+    display_name: Optional[str]
+    canonical_key: Optional[str]
+
+
+@dataclass
+class PriceSnapshot:
+    """A ProductPrice detached from the session, so cached hits can be priced without the DB."""
+    product_id: int
+    provider_name: Optional[str]
+    provider_product_name: Optional[str]
+    unit_price: Optional[float]
+    currency: Optional[str]
+    updated_at: Optional[datetime]
+    canonical_key: Optional[str]
+    product: Optional[ProductSnapshot]
+
+
+@dataclass
+class SearchHit:
+    """Multiplier-independent part of a /search result: the product, its score and base prices."""
+    product: ProductSnapshot
+    score: float
+    prices: List[PriceSnapshot] = field(default_factory=list)
+    # Grouping key: canonical key of the variants, or "product-<id>"
+    key: str = ""
+
+
+def _snapshot_product(product: Product) -> ProductSnapshot:
+    return ProductSnapshot(
+        id=product.id,
+        name=product.name,
+        display_name=product.display_name,
+        canonical_key=product.canonical_key,
+    )
+
+
+def _snapshot_price(price: ProductPrice, products: Dict[int, ProductSnapshot]) -> PriceSnapshot:
+    product = None
+    if price.product is not None:
+        product = products.get(price.product.id)
+        if product is None:
+            product = products[price.product.id] = _snapshot_product(price.product)
+    return PriceSnapshot(
+        product_id=price.product_id,
+        provider_name=price.provider_name,
+        provider_product_name=price.provider_product_name,
+        unit_price=float(price.unit_price) if price.unit_price is not None else None,
+        currency=price.currency,
+        updated_at=price.updated_at,
+        canonical_key=price.canonical_key,
+        product=product,
+    )
+
+
+def compute_search_hits(
+    session: Session,
+    q: Optional[str],
+    limit: int = 50,
+    product_id: Optional[int] = None,
+) -> List[SearchHit]:
+    """Ranked hits, one per canonical product (best score wins), with every variant's prices."""
+    if product_id is not None:
+        p = session.query(Product).options(joinedload(Product.prices)).filter(Product.id == product_id).first()
+        results = [(p, 100.0)] if p is not None else []
+    else:
+        results = search_products(query=q, session=session, limit=limit)
+
+    products: Dict[int, ProductSnapshot] = {}
+    hits: Dict[str, SearchHit] = {}
+    for p, score in results:
+        related_prices, variant_key = collect_variant_prices(session, p, query_text=q)
+        canonical_key = variant_key or p.canonical_key or f"product-{p.id}"
+        existing = hits.get(canonical_key)
+        if existing is None or score > existing.score:
+            hits[canonical_key] = SearchHit(
+                product=products.get(p.id) or _snapshot_product(p),
+                score=score,
+                prices=[_snapshot_price(price, products) for price in related_prices],
+                key=canonical_key,
+            )
+
+    ranked = list(hits.values())
+    ranked.sort(key=lambda hit: hit.score, reverse=True)
+    return ranked
+
+
+def _hits_to_dict(hits: List[SearchHit]) -> List[dict]:
+    data = [asdict(hit) for hit in hits]
+    for item in data:
+        for price in item["prices"]:
+            if price["updated_at"] is not None:
+                price["updated_at"] = price["updated_at"].isoformat()
+    return data
+
+
+def _hits_from_dict(data: List[dict]) -> List[SearchHit]:
+    def product(value: Optional[dict]) -> Optional[ProductSnapshot]:
+        return ProductSnapshot(**value) if value else None
+
+    hits: List[SearchHit] = []
+    for item in data:
+        prices = []
+        for price in item["prices"]:
+            updated_at = price.get("updated_at")
+            prices.append(PriceSnapshot(
+                **{**price, "updated_at": datetime.fromisoformat(updated_at) if updated_at else None, "product": product(price.get("product"))}
+            ))
+        hits.append(SearchHit(product=product(item["product"]), score=item["score"], prices=prices, key=item.get("key", "")))
+    return hits
+
+
+_local_cache: TTLCache = TTLCache(maxsize=512, ttl=60)
+_local_lock = threading.Lock()
+_local_generation: Optional[int] = None
+
+
+def get_search_hits(
+    session: Session,
+    q: Optional[str],
+    limit: int = 50,
+    product_id: Optional[int] = None,
+) -> List[SearchHit]:
+    """compute_search_hits through the in-process and shared caches, keyed by catalog generation."""
+    global _local_generation
+    generation = current_generation()
+    if product_id is not None:
+        key = f"id:{product_id}:{cache_key(q or '')}"
+    else:
+        key = f"q:{limit}:{cache_key(q or '')}"
+
+    with _local_lock:
+        if _local_generation != generation:
+            _local_cache.clear()
+            _local_generation = generation
+        hits = _local_cache.get(key)
+    if hits is not None:
+        return hits
+
+    shared_key = generation_key("search", generation, key)
+
+    def load() -> List[SearchHit]:
+        shared = get_shared_cache()
+        cached = shared.get(shared_key)
+        if cached is not None:
+            return _hits_from_dict(cached)
+        computed = compute_search_hits(session, q, limit=limit, product_id=product_id)
+        shared.set(shared_key, _hits_to_dict(computed), get_settings().shared_cache_ttl)
+        return computed
+
+    # Concurrent misses for the same query wait for one computation
+    hits = search_flight.do(shared_key, load)
+
+    with _local_lock:
+        if _local_generation == generation:
+            _local_cache[key] = hits
+    return hits
+
+
+def price_search_hit(hit: SearchHit, *, iva: float, iibb: float, profit: float) -> dict:
+    """Apply the request's multipliers to a cached hit, in the shape result_card.html expects."""
+    return {
+        "key": hit.key,
+        "product": hit.product,
+        "score": hit.score,
+        "prices": build_provider_offers(hit.prices, iva=iva, iibb=iibb, profit=profit),
+    }
+
+
+def price_search_hits(hits: List[SearchHit], *, iva: float, iibb: float, profit: float) -> List[dict]:
+    return [price_search_hit(hit, iva=iva, iibb=iibb, profit=profit) for hit in hits]
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from ..config import get_settings
+
+
+def generation_key(namespace: str, generation: int, key: str) -> str:
+    """Keys embed the catalog generation: bumping it orphans every older entry at once."""
+    return f"{namespace}:g{generation}:{key}"
+
+
+class SharedCache:
+    """Cache tier shared by every worker and instance. The base class caches nothing."""
+
+    backend = "none"
+
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        return None
+
+
+class SQLiteSharedCache(SharedCache):
+    """JSON values in a local SQLite file (WAL), shared by the workers of one machine."""
+
+    backend = "sqlite"
+    _PRUNE_EVERY = 500
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[CACHE] shared get failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        try:
+            conn = self._conn()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl),
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[CACHE] shared set failed: {e}")
+
+
+class RedisSharedCache(SharedCache):
+    """Redis (or any Redis-compatible server), shared across machines."""
+
+    backend = "redis"
+
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = self._client.get(key)
+        except Exception as e:
+            print(f"[CACHE] shared get failed: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        try:
+            self._client.setex(key, ttl, json.dumps(value, ensure_ascii=False))
+        except Exception as e:
+            print(f"[CACHE] shared set failed: {e}")
+
+
+_shared_cache: Optional[SharedCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def _create_shared_cache() -> SharedCache:
+    settings = get_settings()
+    if settings.redis_url:
+        try:
+            return RedisSharedCache(settings.redis_url)
+        except ImportError as e:
+            # A per-host fallback would silently stop sharing the cache across instances
+            raise RuntimeError("REDIS_URL is set but the redis package is not installed (pip install -r requirements.txt)") from e
+    if settings.shared_cache_path:
+        try:
+            os.makedirs(os.path.dirname(settings.shared_cache_path) or ".", exist_ok=True)
+            return SQLiteSharedCache(settings.shared_cache_path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[CACHE] Could not open shared cache at {settings.shared_cache_path}: {e}")
+    return SharedCache()
+
+
+def get_shared_cache() -> SharedCache:
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = _create_shared_cache()
+                print(f"[CACHE] shared cache backend: {_shared_cache.backend}")
+    return _shared_cache
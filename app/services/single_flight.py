@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical work: the first caller for a key runs `fn`, callers that
+    arrive while it is running wait and get the same result (or exception).
+
+    Results are shared between threads, so `fn` must return data that is never mutated and
+    holds no session-bound ORM objects.
+    """
+
+    def __init__(self, wait_timeout: float = 30.0) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.wait_timeout = wait_timeout
+        self._stats = {"executions": 0, "shared": 0, "timeouts": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["executions"] += 1
+
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                with self._lock:
+                    self._stats["shared"] += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            # The leader is stuck; do the work ourselves rather than fail the request
+            with self._lock:
+                self._stats["timeouts"] += 1
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+# Shared by /suggest and /search; keys carry the endpoint, the catalog generation and the query
+search_flight = SingleFlight()
@@ -1,9 +1,175 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
 from cachetools import TTLCache
 
+from ..utils.text import normalize_text
+from .search import STOPWORDS
+
+
+# Tokens that switch search_products into its sin/con sello handling; prefixes containing
+# them are never narrowed locally
+_SPECIAL_TOKENS = {"sin", "con", "s", "c", "ssello", "csello"}
+
+
+@dataclass
+class SuggestEntry:
+    """Cached answer for one query: the rendered suggestions plus what is needed to narrow them."""
+    suggestions: List[dict]
+    # (normalized_name, canonical_key, suggestion) for every hit, before canonical-key dedup
+    candidates: List[Tuple[str, str, dict]] = field(default_factory=list)
+    # True when the hits are every product matching all tokens (substring stage, under the limit)
+    complete: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "suggestions": self.suggestions,
+            "candidates": [list(c) for c in self.candidates],
+            "complete": self.complete,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SuggestEntry":
+        return cls(
+            suggestions=data["suggestions"],
+            candidates=[tuple(c) for c in data.get("candidates", [])],
+            complete=bool(data.get("complete")),
+        )
+
+
+class _EvictionCountingTTLCache(TTLCache):
+    """TTLCache that reports capacity evictions (popitem); expirations are not counted."""
+
+    def __init__(self, maxsize, ttl, on_evict) -> None:
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._on_evict = on_evict
+        self._clearing = False
+
+    def popitem(self):
+        item = super().popitem()
+        if not self._clearing:
+            self._on_evict()
+        return item
+
+    def clear(self) -> None:
+        # MutableMapping.clear() empties the cache through popitem()
+        self._clearing = True
+        try:
+            super().clear()
+        finally:
+            self._clearing = False
 
-suggest_cache = TTLCache(maxsize=1024, ttl=60)  # 60s cache for suggest
 
 def cache_key(q: str) -> str:
-    return q.strip().lower()
+    return " ".join(q.strip().lower().split())
+
+
+def _match_tokens(key: str) -> List[str]:
+    return [t for t in normalize_text(key).split(" ") if t and t not in STOPWORDS]
+
+
+class SuggestCache:
+    """
+    Thread-safe cache for /suggest.
+
+    Empty answers are kept in a separate short-lived negative cache, and a query that only
+    extends a cached complete prefix ("mang" → "mangu") is answered by filtering that prefix's
+    candidates locally instead of going to the database.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60, negative_ttl: float = 10, min_length: int = 2) -> None:
+        self._lock = threading.RLock()
+        self._positive = _EvictionCountingTTLCache(maxsize, ttl, self._count_eviction)
+        self._negative = _EvictionCountingTTLCache(maxsize, negative_ttl, self._count_eviction)
+        self.min_length = min_length
+        self.negative_ttl = negative_ttl
+        self._generation: Optional[int] = None
+        self._stats: Dict[str, int] = {"hits": 0, "prefix_hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0}
+
+    def _count_eviction(self) -> None:
+        self._stats["evictions"] += 1
+
+    def sync_generation(self, generation: int) -> None:
+        """Drop every entry once the catalog generation moves on."""
+        with self._lock:
+            if self._generation != generation:
+                if self._generation is not None:
+                    self._positive.clear()
+                    self._negative.clear()
+                self._generation = generation
+
+    def get(self, q: str) -> Optional[List[dict]]:
+        """Cached suggestions for `q` ([] for a cached miss), or None when it must be computed."""
+        key = cache_key(q)
+        if len(key) < self.min_length:
+            return None
+        with self._lock:
+            entry = self._positive.get(key)
+            if entry is not None:
+                self._stats["hits"] += 1
+                return entry.suggestions
+            if key in self._negative:
+                self._stats["negative_hits"] += 1
+                return []
+            narrowed = self._narrow_from_prefix(key)
+            if narrowed is not None:
+                self._positive[key] = narrowed
+                self._stats["prefix_hits"] += 1
+                return narrowed.suggestions
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, q: str, entry: SuggestEntry) -> None:
+        key = cache_key(q)
+        if len(key) < self.min_length:
+            return
+        with self._lock:
+            if entry.suggestions:
+                self._positive[key] = entry
+                self._negative.pop(key, None)
+            else:
+                self._negative[key] = True
+
+    def _narrow_from_prefix(self, key: str) -> Optional[SuggestEntry]:
+        child_tokens = _match_tokens(key)
+        if not child_tokens or _SPECIAL_TOKENS.intersection(child_tokens):
+            return None
+        for end in range(len(key) - 1, self.min_length - 1, -1):
+            parent = self._positive.get(key[:end])
+            if parent is None or not parent.complete:
+                continue
+            parent_tokens = _match_tokens(key[:end])
+            if _SPECIAL_TOKENS.intersection(parent_tokens):
+                return None
+            # Anything matching the child must match the parent, or the parent may be missing hits
+            if not all(any(pt in ct for ct in child_tokens) for pt in parent_tokens):
+                return None
+            candidates = [c for c in parent.candidates if all(tok in c[0] for tok in child_tokens)]
+            if not candidates:
+                # Let the database try its broader fallbacks
+                return None
+            suggestions: Dict[str, dict] = {}
+            for _, canonical_key, suggestion in candidates:
+                suggestions.setdefault(canonical_key, suggestion)
+            return SuggestEntry(suggestions=list(suggestions.values()), candidates=candidates, complete=True)
+        return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._positive.clear()
+            self._negative.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats: Dict[str, float] = dict(self._stats)
+            stats["size"] = len(self._positive)
+            stats["negative_size"] = len(self._negative)
+        lookups = stats["hits"] + stats["prefix_hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
 
 
+suggest_cache = SuggestCache(maxsize=1024, ttl=60, negative_ttl=10)  # 60s cache for suggest
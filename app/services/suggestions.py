@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from .catalog_state import current_generation
+from .search import STAGE_LIKE_AND, search_products_with_stage
+from .shared_cache import generation_key, get_shared_cache
+from .single_flight import search_flight
+from .suggest_cache import SuggestEntry, cache_key, suggest_cache
+from .variant_resolver import collect_variant_offers
+
+
+SUGGEST_LIMIT = 20  # Show top 20 with scroll
+
+
+def compute_suggestions(session: Session, q: str, limit: int = SUGGEST_LIMIT) -> SuggestEntry:
+    """Suggestions for the /suggest dropdown, one per canonical product, with base prices."""
+    results, stage = search_products_with_stage(query=q, session=session, limit=limit)
+    candidates: List[Tuple[str, str, dict]] = []
+    suggestions_map: Dict[str, dict] = {}
+    for p, _ in results:
+        variant_result = collect_variant_offers(
+            session=session,
+            product=p,
+            iva=1.0,
+            iibb=1.0,
+            profit=1.0,
+            query_text=None,
+            search_limit=25,
+        )
+        offers = variant_result.offers
+
+        if offers:
+            cheapest_offer = offers[0]
+            provider_count = len(offers)
+            price_label = cheapest_offer.unit_price_fmt
+            if provider_count > 1:
+                price_label += f" ({provider_count} proveedores)"
+            currency = cheapest_offer.currency
+        else:
+            price_label = "Sin precio"
+            currency = p.prices[0].currency if p.prices else "ARS"
+
+        canonical_key = variant_result.canonical_key or p.canonical_key or f"product-{p.id}"
+        suggestion = {
+            "key": canonical_key,
+            "id": p.id,
+            "name": p.name,
+            "display_name": p.display_name if p.display_name else p.name,
+            "price_fmt": price_label,
+            "currency": currency,
+        }
+        candidates.append((p.normalized_name or "", canonical_key, suggestion))
+        suggestions_map.setdefault(canonical_key, suggestion)
+
+    return SuggestEntry(
+        suggestions=list(suggestions_map.values()),
+        candidates=candidates,
+        complete=stage == STAGE_LIKE_AND and len(results) < limit,
+    )
+
+
+def get_suggestions(session: Session, q: str) -> List[dict]:
+    """Suggestions through the cache tiers: in-process, then shared across workers, then the DB."""
+    generation = current_generation()
+    suggest_cache.sync_generation(generation)
+    suggestions = suggest_cache.get(q)
+    if suggestions is not None:
+        return suggestions
+
+    shared_key = generation_key("suggest", generation, cache_key(q))
+
+    def load() -> SuggestEntry:
+        shared = get_shared_cache()
+        cached = shared.get(shared_key)
+        if cached is not None:
+            return SuggestEntry.from_dict(cached)
+        entry = compute_suggestions(session, q)
+        ttl = get_settings().shared_cache_ttl if entry.suggestions else int(suggest_cache.negative_ttl)
+        shared.set(shared_key, entry.to_dict(), ttl)
+        return entry
+
+    # Concurrent misses for the same query wait for one computation
+    entry = search_flight.do(shared_key, load)
+    suggest_cache.put(q, entry)
+    return entry.suggestions
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Union
+
+from fastapi import UploadFile
+
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """An uploaded file exceeded MAX_UPLOAD_MB while being spooled."""
+
+    def __init__(self, filename: str, max_bytes: int) -> None:
+        super().__init__(f"{filename} supera el máximo de {max_bytes // (1024 * 1024)} MB")
+        self.filename = filename
+        self.max_bytes = max_bytes
+
+
+@dataclass(frozen=True)
+class SpooledUpload:
+    path: str
+    # Hex SHA-256 of the content, computed while spooling
+    sha256: str
+
+
+async def spool_upload(upload: UploadFile, max_bytes: int) -> SpooledUpload:
+    """
+    Copy the upload to a named temp file in SPOOL_CHUNK_SIZE chunks, hashing it on the way;
+    the caller removes the file. Raises UploadTooLarge (leaving nothing behind) past `max_bytes`.
+    """
+    suffix = os.path.splitext(upload.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix)
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(SPOOL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(upload.filename or "archivo", max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return SpooledUpload(path, digest.hexdigest())
+
+
+@contextmanager
+def mapped_file(path: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """Read-only memory map of the file: pages are loaded by the OS on access, not copied up front."""
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            yield b""
+            return
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
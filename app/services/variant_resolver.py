@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 from sqlalchemy.orm import Session, joinedload
 
@@ -12,6 +12,11 @@ from ..utils.text import compute_final_price
 from .search import search_products
 
 
+# Offers whose final prices differ by less than these are treated as the same price
+SAME_PRICE_EPSILON = 0.005
+BEST_PRICE_TOLERANCE = 0.01
+
+
 @dataclass
 class ProviderOffer:
     provider_name: str
@@ -52,7 +57,28 @@ def _collect_candidates_from_search(
     return search_products(query=search_basis, session=session, limit=limit)
 
 
-def _merge_price_sources(product: Product, prices: List[ProductPrice]) -> List[ProductPrice]:
+def resolve_variant_lookup(
+    product: Product,
+    search_hits: List[Tuple[Product, float]],
+    min_similarity: float = 65.0,
+) -> Tuple[Optional[str], List[int]]:
+    """Canonical key to group by (own or from search hits) and product ids to use without one."""
+    canonical_key = product.canonical_key
+    if canonical_key is None:
+        for candidate, _ in search_hits:
+            if candidate.canonical_key:
+                canonical_key = candidate.canonical_key
+                break
+    candidate_ids = [product.id]
+    for candidate, score in search_hits:
+        if candidate.id == product.id or candidate.id in candidate_ids:
+            continue
+        if score >= min_similarity:
+            candidate_ids.append(candidate.id)
+    return canonical_key, candidate_ids
+
+
+def merge_price_sources(product: Product, prices: List[ProductPrice]) -> List[ProductPrice]:
     """Combine price rows from query with those already attached to product."""
     by_id: dict[int, ProductPrice] = {}
     for price in prices:
@@ -66,67 +92,16 @@ def _merge_price_sources(product: Product, prices: List[ProductPrice]) -> List[P
     return list(by_id.values())
 
 
-def collect_variant_offers(
-    session: Session,
-    product: Product,
+def build_provider_offers(
+    prices: Iterable[ProductPrice],
     *,
     iva: float,
     iibb: float,
     profit: float,
-    query_text: Optional[str] = None,
-    search_limit: int = 40,
-    min_similarity: float = 65.0,
-) -> VariantResult:
-    """
-    Aggregate provider offers for a given product. Uses canonical keys when available,
-    otherwise falls back to fuzzy search to capture variants sold by other vendors.
-    """
-    canonical_key = product.canonical_key
-    search_basis = _resolve_search_basis(product, query_text)
-
-    search_hits: List[Tuple[Product, float]] = []
-    if canonical_key is None:
-        search_hits = _collect_candidates_from_search(session, search_basis, search_limit)
-        for candidate, _ in search_hits:
-            if candidate.canonical_key:
-                canonical_key = candidate.canonical_key
-                break
-
-    price_query = session.query(ProductPrice).options(joinedload(ProductPrice.product))
-    related_prices: List[ProductPrice] = []
-
-    if canonical_key:
-        related_prices = (
-            price_query
-            .filter(ProductPrice.canonical_key == canonical_key)
-            .order_by(ProductPrice.provider_name.asc(), ProductPrice.updated_at.desc())
-            .all()
-        )
-    else:
-        candidate_ids = {product.id}
-        for candidate, score in search_hits:
-            if candidate.id == product.id:
-                continue
-            if score >= min_similarity:
-                candidate_ids.add(candidate.id)
-        if candidate_ids:
-            related_prices = (
-                price_query
-                .filter(ProductPrice.product_id.in_(list(candidate_ids)))
-                .order_by(ProductPrice.provider_name.asc(), ProductPrice.updated_at.desc())
-                .all()
-            )
-
-    related_prices = _merge_price_sources(product, related_prices)
-
-    if canonical_key is None:
-        for price in related_prices:
-            if price.canonical_key:
-                canonical_key = price.canonical_key
-                break
-
+) -> List[ProviderOffer]:
+    """Best offer per provider (cheapest, then newest), sorted by final price with best offers flagged."""
     offers_by_provider: dict[str, ProviderOffer] = {}
-    for price in related_prices:
+    for price in prices:
         if price.unit_price is None:
             continue
         provider_name = (price.provider_name or "Proveedor desconocido").strip() or "Proveedor desconocido"
@@ -163,8 +138,8 @@ def collect_variant_offers(
             offers_by_provider[provider_name] = entry
             continue
 
-        better_price = final_price < existing.final_price - 0.005
-        same_price_newer = abs(final_price - existing.final_price) <= 0.005 and (
+        better_price = final_price < existing.final_price - SAME_PRICE_EPSILON
+        same_price_newer = abs(final_price - existing.final_price) <= SAME_PRICE_EPSILON and (
             entry.last_seen_at and (existing.last_seen_at is None or entry.last_seen_at > existing.last_seen_at)
         )
         if better_price or same_price_newer:
@@ -176,9 +151,81 @@ def collect_variant_offers(
     if offers:
         best_price = offers[0].final_price
         for offer in offers:
-            if abs(offer.final_price - best_price) <= 0.01:
+            if abs(offer.final_price - best_price) <= BEST_PRICE_TOLERANCE:
                 offer.is_best = True
             else:
                 break
 
+    return offers
+
+
+def collect_variant_prices(
+    session: Session,
+    product: Product,
+    *,
+    query_text: Optional[str] = None,
+    search_limit: int = 40,
+    min_similarity: float = 65.0,
+) -> Tuple[List[ProductPrice], Optional[str]]:
+    """Price rows of every variant of `product` and the canonical key they group under."""
+    search_basis = _resolve_search_basis(product, query_text)
+
+    search_hits: List[Tuple[Product, float]] = []
+    if product.canonical_key is None:
+        search_hits = _collect_candidates_from_search(session, search_basis, search_limit)
+    canonical_key, candidate_ids = resolve_variant_lookup(product, search_hits, min_similarity)
+
+    price_query = session.query(ProductPrice).options(joinedload(ProductPrice.product))
+    related_prices: List[ProductPrice] = []
+
+    if canonical_key:
+        related_prices = (
+            price_query
+            .filter(ProductPrice.canonical_key == canonical_key)
+            .order_by(ProductPrice.provider_name.asc(), ProductPrice.updated_at.desc())
+            .all()
+        )
+    else:
+        if candidate_ids:
+            related_prices = (
+                price_query
+                .filter(ProductPrice.product_id.in_(candidate_ids))
+                .order_by(ProductPrice.provider_name.asc(), ProductPrice.updated_at.desc())
+                .all()
+            )
+
+    related_prices = merge_price_sources(product, related_prices)
+
+    if canonical_key is None:
+        for price in related_prices:
+            if price.canonical_key:
+                canonical_key = price.canonical_key
+                break
+
+    return related_prices, canonical_key
+
+
+def collect_variant_offers(
+    session: Session,
+    product: Product,
+    *,
+    iva: float,
+    iibb: float,
+    profit: float,
+    query_text: Optional[str] = None,
+    search_limit: int = 40,
+    min_similarity: float = 65.0,
+) -> VariantResult:
+    """
+    Aggregate provider offers for a given product. Uses canonical keys when available,
+    otherwise falls back to fuzzy search to capture variants sold by other vendors.
+    """
+    related_prices, canonical_key = collect_variant_prices(
+        session,
+        product,
+        query_text=query_text,
+        search_limit=search_limit,
+        min_similarity=min_similarity,
+    )
+    offers = build_provider_offers(related_prices, iva=iva, iibb=iibb, profit=profit)
     return VariantResult(offers=offers, canonical_key=canonical_key)
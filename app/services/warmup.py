@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from ..config import get_settings
+from ..db import get_session
+from .query_stats import flush_query_stats, top_queries
+from .search_results import get_search_hits
+from .suggestions import get_suggestions
+
+
+_running = threading.Lock()
+
+
+def _word_prefixes(query: str) -> List[str]:
+    """"matafuego 5kg abc" → ["matafuego", "matafuego 5kg"]: what the dropdown sees while typing."""
+    words = query.split(" ")
+    return [" ".join(words[:i]) for i in range(1, len(words))]
+
+
+def _warm_suggest(q: str) -> None:
+    with get_session() as session:
+        get_suggestions(session, q)
+
+
+def _warm_search(q: str) -> None:
+    with get_session() as session:
+        get_search_hits(session, q)
+
+
+def warm_up(reason: str) -> None:
+    """Precompute suggest and search results for the most popular queries of the catalog generation."""
+    settings = get_settings()
+    top_n = settings.warmup_top_n
+    if top_n <= 0:
+        return
+    if not _running.acquire(blocking=False):
+        print(f"[WARMUP] Skipped ({reason}): a warm-up is already running")
+        return
+    try:
+        started = time.monotonic()
+        flush_query_stats()
+        with get_session() as session:
+            search_queries = top_queries(session, "search", top_n)
+            suggest_queries = top_queries(session, "suggest", top_n)
+
+        suggest_set = dict.fromkeys(suggest_queries)
+        for q in search_queries:
+            suggest_set.update(dict.fromkeys(_word_prefixes(q)))
+            suggest_set.setdefault(q)
+
+        tasks = [(_warm_search, q) for q in search_queries] + [(_warm_suggest, q) for q in suggest_set]
+        failures = 0
+        with ThreadPoolExecutor(max_workers=max(1, settings.warmup_concurrency), thread_name_prefix="warmup") as pool:
+            for future in [pool.submit(fn, q) for fn, q in tasks]:
+                try:
+                    future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"[WARMUP] Query failed: {e}")
+        print(
+            f"[WARMUP] {reason}: {len(search_queries)} searches, {len(suggest_set)} suggestions "
+            f"in {time.monotonic() - started:.1f}s ({failures} failed)"
+        )
+    finally:
+        _running.release()
+
+
+def schedule_warm_up(reason: str) -> None:
+    """Run warm_up in a background thread so startup and imports don't wait for it."""
+    if get_settings().warmup_top_n <= 0:
+        return
+    threading.Thread(target=warm_up, args=(reason,), name=f"warmup-{reason}", daemon=True).start()
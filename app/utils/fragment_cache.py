@@ -0,0 +1,38 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from cachetools import LRUCache
+from jinja2 import Environment
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """
+    Rendered HTML of single rows (a suggestion, a result card), so a page built from cached
+    data is mostly string concatenation. Keys must include everything the row depends on,
+    including the catalog generation; stale generations simply age out of the LRU.
+    """
+
+    def __init__(self, env: Environment, maxsize: int = 4096) -> None:
+        self._env = env
+        self._lock = threading.Lock()
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._stats = {"hits": 0, "misses": 0}
+
+    def render(self, template_name: str, key: Hashable, context: Callable[[], Dict[str, Any]]) -> Markup:
+        """Cached row HTML; `context` is only called on a miss, so the row's data can be built lazily."""
+        cache_key = (template_name, key)
+        with self._lock:
+            html = self._cache.get(cache_key)
+            if html is not None:
+                self._stats["hits"] += 1
+                return html
+            self._stats["misses"] += 1
+        html = Markup(self._env.get_template(template_name).render(context()))
+        with self._lock:
+            self._cache[cache_key] = html
+        return html
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "size": len(self._cache)}
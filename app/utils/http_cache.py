@@ -0,0 +1,42 @@
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+
+
+# Fragments may be stored but must be revalidated: the ETag changes with the catalog generation
+FRAGMENT_CACHE_CONTROL = "private, no-cache"
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+
+def fragment_etag(*parts: object) -> str:
+    """Weak ETag over everything a fragment depends on (query, pricing params, catalog generation)."""
+    digest = hashlib.blake2b("\x1f".join(str(p) for p in parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response when the client already holds `etag`, else None."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    candidates = {tag.strip() for tag in header.split(",")}
+    if etag in candidates or "*" in candidates or etag.removeprefix("W/") in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": FRAGMENT_CACHE_CONTROL})
+    return None
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = FRAGMENT_CACHE_CONTROL
+    return response
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles (which already answers If-None-Match) plus a Cache-Control max-age."""
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", STATIC_CACHE_CONTROL)
+        return response
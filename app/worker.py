@@ -0,0 +1,53 @@
+"""
+Import worker: claims jobs queued by the web process (IMPORT_RUNNER=queue) and runs them.
+
+    python -m app.worker
+
+Any number of workers can run against the same database; each job is leased to one of them.
+"""
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import threading
+
+from .db import prepare_database
+from .services.import_jobs import run_next_job
+from .services.parse_pool import shutdown_parse_pool
+
+
+# Seconds between polls while the queue is empty
+POLL_SECONDS = 2.0
+
+
+def main() -> None:
+    prepare_database()
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    stop = threading.Event()
+
+    def _request_stop(signum, frame) -> None:
+        # Finish the current job; if the platform kills us first, its lease expires and another worker retries it
+        print(f"[worker] {worker_id} stopping after the current job")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    print(f"[worker] {worker_id} waiting for import jobs")
+    try:
+        while not stop.is_set():
+            try:
+                ran = run_next_job(worker_id)
+            except Exception as e:
+                print(f"[worker] could not claim an import job: {e}")
+                ran = False
+            if not ran:
+                stop.wait(POLL_SECONDS)
+    finally:
+        shutdown_parse_pool()
+
+
+if __name__ == "__main__":
+    main()